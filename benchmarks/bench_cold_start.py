@@ -0,0 +1,134 @@
+"""Cold start benchmark: import time of the Lambda entry path.
+
+Run from the repository root:
+    python benchmarks/bench_cold_start.py --repeat 5
+
+Each scenario runs in a new interpreter with python -X importtime, as a
+Lambda cold start does: importing main alone, then a first request for
+each format (import main, create the S3 client and obfuscate a small
+file). Import time is the total of the imports made after start-up (site
+and what it loads are left out). The heavy modules each scenario loaded
+are listed. With --max-import-ms the script exits with status 1 if
+importing main takes longer.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import numpy as np  # noqa: E402
+from datasets import make_dataset  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('boto3', 'pandas', 'numpy', 'pyarrow')
+FORMATS = ('csv', 'json', 'parquet')
+
+# Code run in the new interpreter, printing the modules it loaded:
+IMPORT_CODE = """
+import main
+"""
+REQUEST_CODE = """
+import json
+import main
+from src.extractor import get_client, parse_body
+from src.transformer import transformation_handler
+get_client()
+with open({path!r}, 'rb') as data_file:
+    data = parse_body({path!r}, data_file.read())
+if transformation_handler(data, {pii_fields!r}) is None:
+    raise RuntimeError('File was not obfuscated.')
+"""
+REPORT_CODE = """
+import sys as _sys
+print(__import__('json').dumps([name for name in {modules!r}
+                                if name in _sys.modules]))
+"""
+
+
+# Microseconds of the top-level imports made after site, from the
+# -X importtime lines (self | cumulative | name, indented by depth):
+def get_import_us(stderr):
+    lines = [line for line in stderr.splitlines()
+             if line.startswith('import time:') and '|' in line]
+    total = 0
+    after_site = False
+    for line in lines:
+        _, cumulative, name = line.split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue
+        # Depth is shown by two spaces of indent for each level:
+        if name.startswith('  '):
+            continue
+        if after_site:
+            total += int(cumulative)
+        elif name.strip() == 'site':
+            after_site = True
+    return total
+
+
+def run_scenario(code, repeat):
+    import_ms = []
+    wall_ms = []
+    modules = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             code + REPORT_CODE.format(modules=HEAVY_MODULES)],
+            cwd=ROOT, capture_output=True, text=True,
+            env=dict(os.environ, PYTHONPATH=ROOT,
+                     AWS_ACCESS_KEY_ID='testing',
+                     AWS_SECRET_ACCESS_KEY='testing'))
+        wall_ms.append((time.perf_counter() - start) * 1000)
+        # pyarrow can abort while the interpreter exits, after the report:
+        report = [line for line in process.stdout.splitlines()
+                  if line.startswith('[')]
+        if not report:
+            raise RuntimeError(f'Scenario failed:\n{process.stderr[-2000:]}')
+        modules = json.loads(report[-1])
+        import_ms.append(get_import_us(process.stderr) / 1000)
+    return {'import_ms': float(np.median(import_ms)),
+            'wall_ms': float(np.median(wall_ms)),
+            'modules': modules}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--output', help='file to save results to')
+    args = parser.parse_args(argv)
+    results = {'import main': run_scenario(IMPORT_CODE, args.repeat)}
+    with tempfile.TemporaryDirectory() as directory:
+        for file_format in FORMATS:
+            data, pii_fields = make_dataset(args.rows, file_format=file_format)
+            path = os.path.join(directory, f'students.{file_format}')
+            with open(path, 'wb') as data_file:
+                data_file.write(data)
+            results[f'{file_format} request'] = run_scenario(
+                REQUEST_CODE.format(path=path, pii_fields=pii_fields),
+                args.repeat)
+    print(f"{'scenario':<18}{'import ms':>11}{'process ms':>12}  modules")
+    for scenario, result in results.items():
+        print(f"{scenario:<18}{result['import_ms']:>11.1f}"
+              f"{result['wall_ms']:>12.1f}  "
+              f"{', '.join(result['modules']) or '-'}")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.max_import_ms is not None and \
+            results['import main']['import_ms'] > args.max_import_ms:
+        print(f"import main took {results['import main']['import_ms']:.1f} "
+              f"ms, over the {args.max_import_ms:.0f} ms target")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Masking benchmark: current masking core against the original loop.
+
+Run from the repository root:
+    python benchmarks/bench_masking.py --rows 5000000 --columns 6 --pii 2
+
+Each implementation runs in its own process so peak RSS is not shared.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from src.masking import mask_dataframe  # noqa: E402
+
+
+# Masking loop as it was in transformation_handler before the masking core:
+def legacy_mask(df_with_pii, pii_fields):
+    df_anonymised = pd.DataFrame(columns=df_with_pii.columns)
+    for column in df_with_pii.columns:
+        if column in pii_fields:
+            df_anonymised[column] = ['***'] * len(df_with_pii)
+        else:
+            df_anonymised[column] = df_with_pii[column]
+    return df_anonymised
+
+
+IMPLEMENTATIONS = {
+    'legacy': legacy_mask,
+    'masking_core': mask_dataframe,
+}
+
+
+# Student-style frame, PII columns are strings, the rest numbers and text:
+def make_frame(rows, columns, pii):
+    data = {}
+    for i in range(columns):
+        if i < pii:
+            data[f'pii_{i}'] = np.array(
+                [f'person_{n}' for n in range(1000)],
+                dtype=object)[np.arange(rows) % 1000]
+        elif i % 2:
+            data[f'col_{i}'] = np.arange(rows, dtype=np.int64)
+        else:
+            data[f'col_{i}'] = np.array(['Software', 'Data'],
+                                        dtype=object)[np.arange(rows) % 2]
+    return pd.DataFrame(data), [f'pii_{i}' for i in range(pii)]
+
+
+# Resident set size figures of this process in MB. On Linux the peak
+# (VmHWM) can be reset, so masking is measured without the data set-up:
+def read_status_mb(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    if os.path.exists('/proc/self/status'):
+        return read_status_mb('VmHWM')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux:
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def run_one(implementation, rows, columns, pii, repeat):
+    df, pii_fields = make_frame(rows, columns, pii)
+    rss_before = (read_status_mb('VmRSS') if reset_peak_rss()
+                  else peak_rss_mb())
+    mask = IMPLEMENTATIONS[implementation]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        masked = mask(df, pii_fields)
+        timings.append(time.perf_counter() - start)
+        del masked
+    best = min(timings)
+    return {
+        'implementation': implementation,
+        'rows': rows,
+        'seconds': best,
+        'rows_per_sec': rows / best,
+        'peak_rss_mb': peak_rss_mb(),
+        'mask_rss_mb': peak_rss_mb() - rss_before,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--pii', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--impl', choices=sorted(IMPLEMENTATIONS))
+    args = parser.parse_args(argv)
+    # Child process, run one implementation and print its result:
+    if args.impl:
+        print(json.dumps(run_one(args.impl, args.rows, args.columns,
+                                 args.pii, args.repeat)))
+        return
+    results = []
+    for implementation in IMPLEMENTATIONS:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--impl', implementation, '--rows', str(args.rows),
+             '--columns', str(args.columns), '--pii', str(args.pii),
+             '--repeat', str(args.repeat)],
+            check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+    print(f"{'implementation':<14}{'rows/sec':>16}{'peak RSS MB':>14}"
+          f"{'mask RSS MB':>14}")
+    for result in results:
+        print(f"{result['implementation']:<14}"
+              f"{result['rows_per_sec']:>16,.0f}"
+              f"{result['peak_rss_mb']:>14.1f}"
+              f"{result['mask_rss_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Pipeline benchmark: transformation_handler, and main on S3 and local files.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --rows 200000 --columns 12 \
+        --pii-ratio 0.25 --output results.json
+    python benchmarks/bench_pipeline.py --rows 200000 --columns 12 \
+        --pii-ratio 0.25 --compare results.json
+
+Synthetic student data (see datasets.py) is obfuscated for each format by
+transformation_handler alone, by main with the file read from a moto S3
+bucket, and by main with the file read from and written to local disk.
+Nothing is sent over the network. Each format and stage runs in its own
+process so peak RSS is not shared. Results can be saved as JSON, and
+compared with a saved run: a stage whose p50 latency is more than
+--threshold slower is reported as a regression, and the script exits with
+status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import numpy as np  # noqa: E402
+from bench_masking import (peak_rss_mb,  # noqa: E402
+                           read_status_mb,
+                           reset_peak_rss)
+from datasets import make_dataset, parse_dataset  # noqa: E402
+
+FORMATS = ('csv', 'json', 'parquet')
+STAGES = ('transform', 'pipeline', 'local')
+BUCKET = 'benchmark-bucket'
+
+
+# Runs the stage once per repeat, returns the time of each run:
+def time_transform(data, file_format, pii_fields, repeat):
+    from src.transformer import transformation_handler
+    parsed = parse_dataset(data, file_format)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = transformation_handler(parsed, pii_fields)
+        timings.append(time.perf_counter() - start)
+        if output is None:
+            raise RuntimeError(f'{file_format} was not obfuscated.')
+        del output
+    return timings
+
+
+def time_pipeline(data, file_format, pii_fields, repeat):
+    import boto3
+    from moto import mock_s3
+    for variable in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY',
+                     'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN'):
+        os.environ[variable] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'eu-west-2'
+    from main import main
+    key = f'students/students.{file_format}'
+    request = json.dumps({'file_to_obfuscate': f's3://{BUCKET}/{key}',
+                          'pii_fields': pii_fields})
+    timings = []
+    with mock_s3():
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={
+            'LocationConstraint': 'eu-west-2'})
+        s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = main(request)
+            timings.append(time.perf_counter() - start)
+            if output is None:
+                raise RuntimeError(f'{file_format} was not obfuscated.')
+            del output
+    return timings
+
+
+# Runs in the temporary working directory of run_one, which the input and
+# output files are written to:
+def time_local(data, file_format, pii_fields, repeat):
+    from main import main
+    source = f'students.{file_format}'
+    with open(source, 'wb') as source_file:
+        source_file.write(data)
+    request = json.dumps({'file_to_obfuscate': source,
+                          'pii_fields': pii_fields,
+                          'destination': f'output/{source}'})
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = main(request)
+        timings.append(time.perf_counter() - start)
+        if output is None:
+            raise RuntimeError(f'{file_format} was not obfuscated.')
+    return timings
+
+
+TIMERS = {
+    'transform': time_transform,
+    'pipeline': time_pipeline,
+    'local': time_local,
+}
+
+
+def run_one(file_format, stage, rows, columns, pii_ratio, repeat):
+    data, pii_fields = make_dataset(rows, columns, pii_ratio, file_format)
+    rss_before = (read_status_mb('VmRSS') if reset_peak_rss()
+                  else peak_rss_mb())
+    # main writes log.txt to the working directory, kept out of the repo:
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            timings = TIMERS[stage](data, file_format, pii_fields, repeat)
+        finally:
+            os.chdir(working_directory)
+    p50, p99 = np.percentile(timings, [50, 99])
+    megabytes = len(data) / 1024 / 1024
+    return {
+        'format': file_format,
+        'stage': stage,
+        'rows': rows,
+        'columns': columns,
+        'pii_columns': len(pii_fields),
+        'input_mb': megabytes,
+        'p50_seconds': p50,
+        'p99_seconds': p99,
+        'rows_per_sec': rows / p50,
+        'mb_per_sec': megabytes / p50,
+        'peak_rss_mb': peak_rss_mb(),
+        'run_rss_mb': peak_rss_mb() - rss_before,
+    }
+
+
+# Stages of this run more than threshold slower (at p50) than the baseline:
+def find_regressions(results, baseline, threshold):
+    previous = {(result['format'], result['stage']): result
+                for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['format'], result['stage']))
+        if before is None:
+            continue
+        change = result['p50_seconds'] / before['p50_seconds'] - 1
+        result['p50_change'] = change
+        if change > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def print_results(results):
+    print(f"{'format':<9}{'stage':<11}{'rows/sec':>14}{'MB/sec':>9}"
+          f"{'p50 s':>9}{'p99 s':>9}{'peak RSS MB':>13}{'vs base':>9}")
+    for result in results:
+        change = result.get('p50_change')
+        print(f"{result['format']:<9}{result['stage']:<11}"
+              f"{result['rows_per_sec']:>14,.0f}"
+              f"{result['mb_per_sec']:>9.1f}"
+              f"{result['p50_seconds']:>9.3f}"
+              f"{result['p99_seconds']:>9.3f}"
+              f"{result['peak_rss_mb']:>13.1f}"
+              f"{'' if change is None else format(change, '+.1%'):>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=8)
+    parser.add_argument('--pii-ratio', type=float, default=0.25)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--formats', nargs='+', choices=FORMATS,
+                        default=list(FORMATS))
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+                        default=list(STAGES))
+    parser.add_argument('--output', help='file to save results to')
+    parser.add_argument('--compare', help='saved results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--run', nargs=2, metavar=('FORMAT', 'STAGE'))
+    args = parser.parse_args(argv)
+    # Child process, run one format and stage and print its result:
+    if args.run:
+        print(json.dumps(run_one(*args.run, args.rows, args.columns,
+                                 args.pii_ratio, args.repeat)))
+        return
+    results = []
+    for file_format in args.formats:
+        for stage in args.stages:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__),
+                 '--run', file_format, stage, '--rows', str(args.rows),
+                 '--columns', str(args.columns),
+                 '--pii-ratio', str(args.pii_ratio),
+                 '--repeat', str(args.repeat)],
+                check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file),
+                                           args.threshold)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'settings': {'rows': args.rows,
+                                    'columns': args.columns,
+                                    'pii_ratio': args.pii_ratio,
+                                    'repeat': args.repeat},
+                       'results': results}, output_file, indent=2)
+    for result in regressions:
+        print(f"Regression: {result['format']} {result['stage']} p50 "
+              f"{result['p50_change']:+.1%}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
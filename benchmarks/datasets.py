@@ -0,0 +1,138 @@
+"""Synthetic student-style datasets for the benchmarks.
+
+Write a dataset to a file, from the repository root:
+    python benchmarks/datasets.py --rows 1000000 --columns 12 \
+        --pii-ratio 0.25 --format parquet --output students.parquet
+
+Rows, column width and the share of PII columns can be set. Values repeat
+the way real student data does (a few courses and cohorts, IDs with
+leading zeros, day-first dates), and are generated from a seed so runs
+can be compared.
+"""
+import argparse
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+FORMATS = ('csv', 'json', 'ndjson', 'parquet')
+
+# Columns in the order they are added, PII and non-PII:
+PII_COLUMNS = ['name', 'email_address', 'phone_number', 'home_address',
+               'date_of_birth', 'national_insurance_number']
+OTHER_COLUMNS = ['student_id', 'course', 'cohort', 'graduation_date',
+                 'score']
+COURSES = np.array(['Software', 'Data', 'Cloud', 'DevOps', 'Security'],
+                   dtype=object)
+COHORTS = np.array(['January', 'April', 'August', 'November'],
+                   dtype=object)
+
+
+def make_pii_column(name, ids, rng):
+    people = pd.Series(rng.integers(0, 100000, len(ids))).astype(str)
+    if name == 'name':
+        return ('Student ' + people).to_numpy(dtype=object)
+    if name == 'email_address':
+        return ('student' + people + '@email.com').to_numpy(dtype=object)
+    if name == 'phone_number':
+        return ('07' + people.str.zfill(9)).to_numpy(dtype=object)
+    if name == 'home_address':
+        return (people + ' High Street, Leeds').to_numpy(dtype=object)
+    if name == 'date_of_birth':
+        days = pd.Series(rng.integers(1, 29, len(ids))).astype(str)
+        return (days.str.zfill(2) + '/05/2001').to_numpy(dtype=object)
+    return ('AB' + people.str.zfill(6) + 'C').to_numpy(dtype=object)
+
+
+def make_other_column(name, ids, rng):
+    if name == 'student_id':
+        return pd.Series(ids).astype(str).str.zfill(8).to_numpy(dtype=object)
+    if name == 'course':
+        return COURSES[ids % len(COURSES)]
+    if name == 'cohort':
+        return COHORTS[ids % len(COHORTS)]
+    if name == 'graduation_date':
+        days = pd.Series(ids % 28 + 1).astype(str).str.zfill(2)
+        return (days + '/03/2024').to_numpy(dtype=object)
+    if name == 'score':
+        return np.round(rng.random(len(ids)) * 100, 2)
+    # Extra columns alternate between whole numbers and floats:
+    if int(name.rsplit('_', 1)[1]) % 2:
+        return rng.integers(0, 1000000, len(ids))
+    return np.round(rng.random(len(ids)) * 1000, 3)
+
+
+# Frame of rows x columns, of which about pii_ratio are PII columns (at
+# least one). Returns the frame and the names of its PII columns:
+def make_frame(rows, columns=8, pii_ratio=0.25, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(rows)
+    pii_count = min(max(1, round(columns * pii_ratio)), columns)
+    pii_names = (PII_COLUMNS + [f'pii_{i}' for i in range(columns)])[
+        :pii_count]
+    other_names = (OTHER_COLUMNS + [f'field_{i}' for i in range(columns)])[
+        :columns - pii_count]
+    data = {}
+    # Non-PII and PII columns are interleaved, as in real files:
+    for i in range(max(len(pii_names), len(other_names))):
+        if i < len(other_names):
+            data[other_names[i]] = make_other_column(other_names[i], ids,
+                                                     rng)
+        if i < len(pii_names):
+            data[pii_names[i]] = make_pii_column(
+                pii_names[i] if pii_names[i] in PII_COLUMNS else 'name',
+                ids, rng)
+    return pd.DataFrame(data), pii_names
+
+
+# The frame as file bytes in the given format:
+def to_bytes(df, file_format):
+    if file_format == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    if file_format == 'json':
+        return df.to_json(orient='records').encode('utf-8')
+    if file_format == 'ndjson':
+        return df.to_json(orient='records', lines=True).encode('utf-8')
+    if file_format == 'parquet':
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    raise ValueError(f'Unknown format {file_format}.')
+
+
+# File bytes and PII column names of a synthetic dataset:
+def make_dataset(rows, columns=8, pii_ratio=0.25, file_format='csv',
+                 seed=0):
+    df, pii_fields = make_frame(rows, columns, pii_ratio, seed)
+    return to_bytes(df, file_format), pii_fields
+
+
+# The dataset as transformation_handler is given it by the extractor:
+def parse_dataset(data, file_format):
+    if file_format == 'csv':
+        return data.decode('utf-8')
+    if file_format == 'json':
+        return json.loads(data)
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=8)
+    parser.add_argument('--pii-ratio', type=float, default=0.25)
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args(argv)
+    data, pii_fields = make_dataset(args.rows, args.columns, args.pii_ratio,
+                                    args.format, args.seed)
+    with open(args.output, 'wb') as output_file:
+        output_file.write(data)
+    print(json.dumps({'output': args.output, 'bytes': len(data),
+                      'pii_fields': pii_fields}))
+
+
+if __name__ == '__main__':
+    main()
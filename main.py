@@ -1,7 +1,19 @@
 import json
-from src.extractor import extraction_handler
-from src.transformer import transformation_handler
-import logging
+import sys
+from src.extractor import (extraction_handler,
+                           stream_extraction_handler,
+                           get_file_format,
+                           get_stream_format,
+                           is_compressed_file,
+                           is_ndjson_file)
+from src.transformer import (transformation_handler,
+                             stream_transformation_handler,
+                             parallel_transformation_handler)
+from src.masking import get_constant_fields
+from src.loader import (upload_handler,
+                        DEFAULT_PART_SIZE,
+                        DEFAULT_MAX_CONCURRENCY)
+from src.instrumentation import measure, setup_logging
 
 # main function:
 # 1. main: takes JSON as argument
@@ -11,20 +23,21 @@ import logging
 # 5. transform: change column contents to '***'
 # 6. transform: reformats to original filetype
 # 7. main: output
-
-
-# Setting up logging
-def setup_logging():
-    logger = logging.getLogger()
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-    logger.setLevel(logging.DEBUG)
-    handler = logging.FileHandler('log.txt', mode='w')
-    formatter = logging.Formatter('%(asctime)s - %(name)s\
-                                  - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
+# With "streaming": true in the JSON, CSV and JSON files are read from S3
+# and obfuscated in chunks, and the output is returned as a generator of
+# bytes. NDJSON (.ndjson, .jsonl) files are streamed unless run in parallel.
+# With "parallel": true in the JSON, one CSV, NDJSON or parquet file is split
+# into partitions that are obfuscated on all cores (or "max_workers").
+# "pii_fields" is a list of fields masked with '***', or a dictionary of
+# field to masking strategy, such as {"email_address": "hmac"}.
+# With "destination": "s3://..." in the JSON, the output is uploaded there
+# with a multipart upload instead of being returned.
+# Compressed files (such as .csv.gz or .ndjson.zst) are always streamed, and
+# decompressed as they are read. Output to a destination with a compressed
+# extension is compressed as it is uploaded, or with "output_compression"
+# ("gzip", "bz2", "xz", "zstd" or "none") and "compression_level".
+# "file_to_obfuscate" and "destination" can also be local paths (read
+# memory-mapped) or other fsspec URLs such as memory://.
 
 
 class DataTransformer:
@@ -33,24 +46,90 @@ class DataTransformer:
         self.json_loaded = self.load_json(json_file)
         self.s3_url = self.json_loaded['file_to_obfuscate']
         self.pii_fields = self.json_loaded['pii_fields']
-        # extracted data:
-        self.__data_to_be_transformed = self.__extraction_handler(self.s3_url)
+        self.parallel = self.json_loaded.get('parallel', False)
+        self.max_workers = self.json_loaded.get('max_workers')
+        self.streaming = self.json_loaded.get('streaming', False) or (
+            type(self.s3_url) is str and (
+                is_compressed_file(self.s3_url) or
+                (not self.parallel and is_ndjson_file(self.s3_url))))
+        # output location and multipart upload settings:
+        self.destination = self.json_loaded.get('destination')
+        self.part_size = self.json_loaded.get('part_size', DEFAULT_PART_SIZE)
+        self.max_concurrency = self.json_loaded.get(
+            'max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        self.compression = self.json_loaded.get('output_compression')
+        self.compression_level = self.json_loaded.get('compression_level')
+        # extracted data (unread S3 body when streaming):
+        if self.streaming:
+            self.__data_to_be_transformed = self.__stream_handler(
+                self.s3_url)
+        elif self.parallel:
+            self.__data_to_be_transformed = self.__raw_extraction_handler(
+                self.s3_url)
+        else:
+            self.__data_to_be_transformed = self.__extraction_handler(
+                self.s3_url)
 
     def load_json(self, json_file):
-        help = json.loads(json_file)
+        with measure('json_parse', bytes=len(json_file)):
+            help = json.loads(json_file)
         return help
 
+    # PII columns of parquet files are not downloaded, unless their masking
+    # strategy depends on the value:
     def __extraction_handler(self, s3_url):
-        return extraction_handler(s3_url)
+        return extraction_handler(
+            s3_url, skip_columns=get_constant_fields(self.pii_fields))
+
+    # Unparsed bytes, to be split into partitions:
+    def __raw_extraction_handler(self, s3_url):
+        return extraction_handler(
+            s3_url, skip_columns=get_constant_fields(self.pii_fields),
+            raw=True)
+
+    def __stream_handler(self, s3_url):
+        return stream_extraction_handler(s3_url)
 
     def _transformation_handler(self, body_data, pii_fields):
         return transformation_handler(body_data, pii_fields)
 
+    def _stream_transformation_handler(self, body_stream, pii_fields):
+        return stream_transformation_handler(
+            body_stream, pii_fields,
+            file_format=get_stream_format(self.s3_url))
+
+    def _parallel_transformation_handler(self, body_data, pii_fields):
+        return parallel_transformation_handler(
+            body_data, pii_fields, get_file_format(self.s3_url),
+            max_workers=self.max_workers)
+
+    def _upload_handler(self, anonymised_data, destination):
+        return upload_handler(anonymised_data, destination,
+                              part_size=self.part_size,
+                              max_concurrency=self.max_concurrency,
+                              compression=self.compression,
+                              compression_level=self.compression_level)
+
     def anonymise(self):
-        anonymised_data = self._transformation_handler(
-            self.__data_to_be_transformed,
-            self.pii_fields)
-        return anonymised_data
+        if self.streaming:
+            anonymised_data = self._stream_transformation_handler(
+                self.__data_to_be_transformed,
+                self.pii_fields)
+        elif self.parallel:
+            anonymised_data = self._parallel_transformation_handler(
+                self.__data_to_be_transformed,
+                self.pii_fields)
+        else:
+            anonymised_data = self._transformation_handler(
+                self.__data_to_be_transformed,
+                self.pii_fields)
+        if self.destination is None or anonymised_data is None:
+            return anonymised_data
+        # Parts are uploaded while the stream is still being transformed:
+        upload = self._upload_handler(anonymised_data, self.destination)
+        if upload is not None:
+            upload['destination'] = self.destination
+        return upload
 
 
 def main(json_file):
@@ -67,9 +146,7 @@ def main(json_file):
         return
 
 
+# Run from a shell, see src/cli.py:
 if __name__ == '__main__':
-    main(
-            """{"file_to_obfuscate":
-            "s3://my_ingestion_bucket/example/file1.csv",
-            "pii_fields": ["name", "email_address"]}"""
-        )
+    from src.cli import main as cli_main
+    sys.exit(cli_main())
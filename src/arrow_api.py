@@ -0,0 +1,121 @@
+import itertools
+import logging
+import sys
+from src.instrumentation import StageTimer, measure
+from src.lazy_imports import lazy_import
+from src.masking import get_strategies, mask_column
+from src.parquet_engine import get_masked_schema, match_pii_columns
+
+pa = lazy_import('pyarrow')
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# ARROW API
+# Masks data already held in memory as Arrow, for callers such as Spark,
+# Polars or pandas jobs that would otherwise write a file only to have it
+# parsed again. Takes a pyarrow Table or RecordBatch, a RecordBatchReader
+# or any iterable of record batches, or any object with the Arrow
+# PyCapsule interface (__arrow_c_stream__ or __arrow_c_array__), such as a
+# Polars DataFrame. PII columns are replaced and every other column is
+# passed on as the same arrays, so their buffers are never copied. PII
+# fields are matched as for files, including patterns and struct fields
+# (see field_plan).
+#
+# Tables and record batches are returned as the same type, and streams as
+# a RecordBatchReader masked as it is read. pandas DataFrames are converted
+# with pyarrow first and returned as a Table.
+
+
+# Masked schema and PII column strategies of a schema. Gives None if the
+# strategies cannot be used:
+def get_arrow_plan(schema, pii_fields):
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    pii_columns, plan = match_pii_columns(schema, strategies)
+    plan.log_missing()
+    return get_masked_schema(schema, pii_columns), pii_columns
+
+
+# Table or record batch with the PII columns replaced, the rest are the
+# same arrays:
+def mask_columns(data, masked_schema, pii_columns):
+    arrays = [mask_column(pii_columns[name], data, name, data.num_rows)
+              if name in pii_columns else data.column(index)
+              for index, name in enumerate(data.schema.names)]
+    return type(data).from_arrays(arrays, schema=masked_schema)
+
+
+# Masks a pyarrow Table or RecordBatch:
+def mask_arrow_table(data, pii_fields):
+    arrow_plan = get_arrow_plan(data.schema, pii_fields)
+    if arrow_plan is None:
+        return
+    with measure('mask', rows=data.num_rows):
+        return mask_columns(data, *arrow_plan)
+
+
+# Masks record batches as they are read. Takes a RecordBatchReader, or an
+# iterable of record batches and their schema (taken from the first batch
+# if not given). Returns a RecordBatchReader:
+def mask_arrow_batches(batches, pii_fields, schema=None):
+    if schema is None:
+        schema = getattr(batches, 'schema', None)
+    batches = iter(batches)
+    if schema is None:
+        first = next(batches, None)
+        if first is None:
+            logger.error('Input data file has no content.')
+            return
+        schema = first.schema
+        batches = itertools.chain([first], batches)
+    arrow_plan = get_arrow_plan(schema, pii_fields)
+    if arrow_plan is None:
+        return
+    return pa.RecordBatchReader.from_batches(
+        arrow_plan[0], iter_masked_batches(batches, *arrow_plan))
+
+
+# Masks each batch, timing the mask stage:
+def iter_masked_batches(batches, masked_schema, pii_columns):
+    timer = StageTimer('mask')
+    rows = 0
+    try:
+        for batch in batches:
+            with timer:
+                masked = mask_columns(batch, masked_schema, pii_columns)
+            rows += batch.num_rows
+            yield masked
+    finally:
+        timer.record(rows=rows)
+
+
+# pandas DataFrame, if pandas has been imported:
+def is_pandas_frame(data):
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(data, pandas.DataFrame)
+
+
+# Masks Arrow data of any of the supported kinds:
+def arrow_transformation(data, pii_fields):
+    if len(pii_fields) == 0:
+        logger.info('No PII fields given.')
+    if isinstance(data, (pa.Table, pa.RecordBatch)):
+        return mask_arrow_table(data, pii_fields)
+    if is_pandas_frame(data):
+        return mask_arrow_table(
+            pa.Table.from_pandas(data, preserve_index=False), pii_fields)
+    if isinstance(data, pa.RecordBatchReader):
+        return mask_arrow_batches(data, pii_fields)
+    # Arrow PyCapsule interface, such as a Polars DataFrame:
+    if hasattr(data, '__arrow_c_stream__'):
+        return mask_arrow_batches(pa.RecordBatchReader.from_stream(data),
+                                  pii_fields)
+    if hasattr(data, '__arrow_c_array__'):
+        return mask_arrow_table(pa.record_batch(data), pii_fields)
+    if hasattr(data, '__iter__') and not isinstance(data, (str, bytes)):
+        return mask_arrow_batches(data, pii_fields)
+    logger.error('Unsupported data type.')
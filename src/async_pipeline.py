@@ -0,0 +1,309 @@
+import asyncio
+import io
+import json
+import logging
+import time
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+from src.compression import (compress_chunks,
+                             get_output_codec,
+                             open_decompressed,
+                             split_codec)
+from src.extractor import (get_region,
+                           get_stream_format,
+                           is_compressed_file,
+                           is_ndjson_file,
+                           is_supported_file,
+                           parse_body)
+from src.filesystems import is_s3_url
+from src.transformer import setup_logging, transform_data, transform_stream
+from src.loader import split_s3_url, iter_output_chunks, DEFAULT_PART_SIZE
+from src.batch import get_destination_url, is_source_file, summarise
+from src.instrumentation import (get_stage_totals,
+                                 log_stage_totals,
+                                 measure,
+                                 reset_stage_totals)
+from src.cache import (get_cache_stats,
+                       load_token_caches,
+                       log_cache_stats,
+                       save_token_caches)
+
+
+# ASYNC PIPELINE
+# Downloads, obfuscates and uploads many S3 objects from one event loop.
+# Network waits overlap across objects (and across byte ranges of large
+# objects), while parsing and masking run in an executor so they do not
+# block the loop. NDJSON and compressed objects (such as file1.csv.gz) are
+# downloaded whole like the rest, then masked by the stream engines (see
+# transformer) as they are decompressed, in the executor.
+#
+# Sources and destinations must be S3 URLs: local paths and other fsspec
+# URLs are rejected with a ValueError, and are obfuscated by batch (see
+# filesystems) instead.
+
+DEFAULT_MAX_IN_FLIGHT = 256
+# Large objects are downloaded as concurrent ranges of this size:
+RANGE_SIZE = 8 * 1024 * 1024
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+def create_client(max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    session = get_session()
+    return session.create_client(
+        's3', region_name=get_region(),
+        config=AioConfig(max_pool_connections=max_in_flight))
+
+
+async def read_body(response):
+    async with response['Body'] as stream:
+        return await stream.read()
+
+
+# Reads an object, the first range request also gives the object size, so
+# small objects take one request and large ones fetch the rest in parallel:
+async def async_get_bytes(client, target_bucket, filepath,
+                          range_size=RANGE_SIZE):
+    try:
+        response = await client.get_object(
+            Bucket=target_bucket, Key=filepath,
+            Range=f'bytes=0-{range_size - 1}')
+    except ClientError as err:
+        # Empty objects cannot be read with a range:
+        if err.response['Error']['Code'] == 'InvalidRange':
+            return b''
+        raise
+    first_range = await read_body(response)
+    total_size = len(first_range)
+    if 'ContentRange' in response:
+        total_size = int(response['ContentRange'].split('/')[-1])
+    if total_size <= len(first_range):
+        return first_range
+
+    async def get_range(start, end):
+        response = await client.get_object(
+            Bucket=target_bucket, Key=filepath, Range=f'bytes={start}-{end}')
+        return await read_body(response)
+
+    ranges = await asyncio.gather(*(
+        get_range(start, min(start + range_size, total_size) - 1)
+        for start in range(len(first_range), total_size, range_size)))
+    return b''.join([first_range, *ranges])
+
+
+# Sources and destinations other than S3 cannot be used:
+def check_s3_urls(*urls):
+    for url in urls:
+        if url is not None and not is_s3_url(url):
+            raise ValueError(f'{url} is not an S3 URL, local and fsspec '
+                             f'files are obfuscated by batch_obfuscate.')
+
+
+async def async_get_data(client, target_bucket, filepath):
+    body = await async_get_bytes(client, target_bucket, filepath)
+    return parse_body(filepath, body)
+
+
+# Writes output in one request, or concurrent parts if it is large:
+async def async_put_bytes(client, target_bucket, filepath, body,
+                          part_size=DEFAULT_PART_SIZE):
+    if len(body) <= part_size:
+        await client.put_object(Bucket=target_bucket, Key=filepath,
+                                Body=body)
+        return {'parts': 0, 'bytes': len(body)}
+    response = await client.create_multipart_upload(
+        Bucket=target_bucket, Key=filepath)
+    upload_id = response['UploadId']
+
+    async def upload_part(part_number, start):
+        response = await client.upload_part(
+            Bucket=target_bucket, Key=filepath, UploadId=upload_id,
+            PartNumber=part_number, Body=body[start:start + part_size])
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    try:
+        parts = await asyncio.gather(*(
+            upload_part(part_number, start) for part_number, start in
+            enumerate(range(0, len(body), part_size), start=1)))
+        await client.complete_multipart_upload(
+            Bucket=target_bucket, Key=filepath, UploadId=upload_id,
+            MultipartUpload={'Parts': list(parts)})
+    except Exception:
+        await client.abort_multipart_upload(
+            Bucket=target_bucket, Key=filepath, UploadId=upload_id)
+        raise
+    return {'parts': len(parts), 'bytes': len(body)}
+
+
+# Stream of a downloaded body, decompressed as it is read if the extension
+# names a codec:
+def open_body(filepath, body):
+    codec = split_codec(filepath)[1]
+    if codec is not None:
+        return open_decompressed(io.BytesIO(body), codec)
+    return io.BytesIO(body)
+
+
+# CPU-bound part of the pipeline, run in the executor. Module level so it
+# can also be sent to a process pool. NDJSON and compressed files can only
+# be read as a stream. Output is compressed with codec, if given:
+def transform_object(filepath, body, pii_fields, to_bytes, codec=None):
+    if is_ndjson_file(filepath) or is_compressed_file(filepath):
+        output = b''.join(transform_stream(
+            open_body(filepath, body), pii_fields,
+            file_format=get_stream_format(filepath)))
+    else:
+        anonymised_data = transform_data(parse_body(filepath, body),
+                                         pii_fields)
+        if anonymised_data is None or not to_bytes:
+            return anonymised_data
+        output = b''.join(iter_output_chunks(anonymised_data))
+    if not output:
+        return
+    if codec is not None:
+        output = b''.join(compress_chunks([output], codec))
+    return output
+
+
+async def async_process_object(client, s3_url, pii_fields,
+                               destination_url=None, executor=None):
+    start = time.perf_counter()
+    check_s3_urls(s3_url, destination_url)
+    s3_bucket, s3_filepath = split_s3_url(s3_url)
+    # Stages overlap with other files, and are timed as wall time:
+    with measure('s3_fetch') as metric:
+        body = await async_get_bytes(client, s3_bucket, s3_filepath)
+        metric['bytes'] = len(body)
+    # Output is compressed with the codec of the destination's extension:
+    codec = None if destination_url is None else \
+        get_output_codec(destination_url)
+    loop = asyncio.get_running_loop()
+    anonymised_data = await loop.run_in_executor(
+        executor, transform_object, s3_filepath, body, pii_fields,
+        destination_url is not None, codec)
+    if anonymised_data is None:
+        raise ValueError('Transformation gave no output.')
+    result = {'source': s3_url, 'status': 'ok'}
+    if destination_url is None:
+        result['data'] = anonymised_data
+        if type(anonymised_data) in (bytes, memoryview):
+            result['bytes'] = len(anonymised_data)
+    else:
+        output_bucket, output_filepath = split_s3_url(destination_url)
+        with measure('upload') as metric:
+            upload = await async_put_bytes(client, output_bucket,
+                                           output_filepath, anonymised_data)
+            metric['bytes'] = upload['bytes']
+        result['destination'] = destination_url
+        result['bytes'] = upload['bytes']
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+# Lists the files under an S3 prefix that can be obfuscated, whole or
+# streamed:
+async def async_list_sources(client, s3_prefix):
+    s3_bucket, prefix = split_s3_url(s3_prefix)
+    paginator = client.get_paginator('list_objects_v2')
+    sources = []
+    async for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            if is_source_file(item['Key']):
+                sources.append(f"s3://{s3_bucket}/{item['Key']}")
+    return sources
+
+
+async def async_batch_obfuscate(pii_fields, s3_urls=None, s3_prefix=None,
+                                destination=None,
+                                max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                                executor=None, client=None):
+    if client is None:
+        async with create_client(max_in_flight) as client:
+            return await async_batch_obfuscate(
+                pii_fields, s3_urls, s3_prefix, destination, max_in_flight,
+                executor, client)
+    start = time.perf_counter()
+    check_s3_urls(s3_prefix, destination)
+    load_token_caches()
+    reset_stage_totals()
+    if s3_prefix is not None:
+        s3_urls = await async_list_sources(client, s3_prefix)
+    elif s3_urls is None:
+        raise ValueError('No files or prefix given to obfuscate.')
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def process(s3_url):
+        destination_url = None
+        if destination is not None:
+            destination_url = get_destination_url(s3_url, destination,
+                                                  s3_prefix)
+        async with in_flight:
+            try:
+                return await async_process_object(
+                    client, s3_url, pii_fields, destination_url, executor)
+            except Exception as err:
+                logger.error(f'Could not obfuscate {s3_url}: {err}')
+                return {'source': s3_url, 'status': 'error',
+                        'error': str(err)}
+
+    results = await asyncio.gather(*(process(url) for url in s3_urls))
+    summary = summarise(list(results), time.perf_counter() - start)
+    logger.info(f"Obfuscated {summary['succeeded']} of {summary['files']} "
+                f"files at {summary['files_per_sec']:.1f} files/sec.")
+    # Caches are only shared when the executor runs in this process:
+    summary['token_caches'] = get_cache_stats()
+    log_cache_stats()
+    save_token_caches()
+    summary['stages'] = get_stage_totals()
+    log_stage_totals()
+    return {'results': list(results), 'summary': summary}
+
+
+# Asyncio version of extraction_handler:
+async def async_extraction_handler(s3_url, client=None):
+    logger = setup_logging()
+    try:
+        if type(s3_url) is not str:
+            logger.error("File path not given correctly.")
+            return
+        if not is_supported_file(s3_url):
+            logger.error("File is not csv or json or parquet format.")
+            return
+        if not is_s3_url(s3_url):
+            logger.error("Only S3 URLs can be read by the async pipeline.")
+            return
+        s3_bucket, s3_filepath = split_s3_url(s3_url)
+        if client is None:
+            async with create_client() as client:
+                return await async_get_data(client, s3_bucket, s3_filepath)
+        return await async_get_data(client, s3_bucket, s3_filepath)
+    except ClientError as err:
+        if err.response["Error"]["Code"] == "InternalServiceError":
+            logger.error("Internal service error detected.")
+        if err.response["Error"]["Code"] == "NoSuchBucket":
+            logger.error("Bucket not found.")
+        if err.response["Error"]["Code"] == "NoSuchKey":
+            logger.error("File not found.")
+    except Exception as err:
+        logger.error(f"An unexpected error has occurred: {str(err)}")
+        return err
+
+
+# Async batch entry point, takes the same JSON as batch_handler, with
+# "max_in_flight" in place of "max_workers":
+def async_batch_handler(json_file):
+    logger = setup_logging()
+    try:
+        json_loaded = json.loads(json_file)
+        return asyncio.run(async_batch_obfuscate(
+            json_loaded['pii_fields'],
+            s3_urls=json_loaded.get('files_to_obfuscate'),
+            s3_prefix=json_loaded.get('prefix_to_obfuscate'),
+            destination=json_loaded.get('destination'),
+            max_in_flight=json_loaded.get('max_in_flight',
+                                          DEFAULT_MAX_IN_FLIGHT)))
+    except Exception as error:
+        logger.error('An unexpected error has occurred: %s', error)
+        return
@@ -0,0 +1,375 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.compression import get_output_codec, split_codec, with_codec
+from src.extractor import (get_client, get_data, get_file_data,
+                           get_file_format, get_stream, is_supported_file,
+                           is_compressed_file, is_ndjson_file,
+                           DEFAULT_MAX_POOL_CONNECTIONS,
+                           FILE_FORMATS)
+from src.filesystems import (get_file_version,
+                             is_s3_url,
+                             list_files,
+                             open_input,
+                             strip_protocol)
+from src.transformer import (setup_logging,
+                             transform_data,
+                             transform_stream,
+                             STREAM_READ_SIZE)
+from src.masking import get_constant_fields
+from src.instrumentation import (get_stage_totals,
+                                 log_stage_totals,
+                                 reset_stage_totals)
+from src.cache import (get_cache_stats,
+                       load_token_caches,
+                       log_cache_stats,
+                       save_token_caches)
+from src.loader import upload_handler, split_s3_url, DEFAULT_PART_SIZE
+from src.manifest import (get_config_hash,
+                          get_version,
+                          head_sources,
+                          load_manifest,
+                          save_manifest)
+
+
+# BATCH FUNCTIONS
+# Obfuscates many S3 objects in one invocation. One S3 client and one
+# logging set-up are shared by a bounded pool of worker threads, as are the
+# token caches of the masking strategies. With OBFUSCATOR_TOKEN_CACHE_FILE
+# set, the caches are loaded before the batch and saved after it. With a
+# manifest, files unchanged since the last run are skipped (see manifest).
+# NDJSON and compressed files are streamed through, and output is
+# compressed as it is uploaded (see compression). Sources and destinations
+# can also be local paths or other fsspec URLs (see filesystems). With an
+# input format, files are read as that format whatever their extension, so
+# objects without a usable one can be obfuscated, and with stream, CSV and
+# JSON files are streamed through rather than read whole.
+
+DEFAULT_MAX_WORKERS = 8
+
+# Logs to the handlers set up by batch_handler:
+logger = logging.getLogger(__name__)
+
+
+# Files that can be obfuscated, whole or streamed. With an input format,
+# every file is read as it:
+def is_source_file(filepath, input_format=None):
+    if input_format is not None:
+        return not filepath.endswith('/')
+    return (is_supported_file(filepath) or is_ndjson_file(filepath) or
+            is_compressed_file(filepath))
+
+
+def check_input_format(input_format):
+    if input_format is not None and input_format not in FILE_FORMATS:
+        raise ValueError(f'Input format "{input_format}" not recognised.')
+
+
+# Lists the supported files under an S3 prefix, with their listing
+# entries (size, ETag and so on). Other prefixes are listed as directories:
+def list_source_objects(client, s3_prefix, input_format=None):
+    if not is_s3_url(s3_prefix):
+        return [(url, info) for url, info in list_files(s3_prefix)
+                if is_source_file(url, input_format)]
+    s3_bucket, prefix = split_s3_url(s3_prefix)
+    paginator = client.get_paginator('list_objects_v2')
+    sources = []
+    for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            if is_source_file(item['Key'], input_format):
+                sources.append((f"s3://{s3_bucket}/{item['Key']}", item))
+    return sources
+
+
+# Lists the supported files under an S3 prefix, with their sizes:
+def list_sources(client, s3_prefix):
+    return [(s3_url, item.get('Size', item.get('size')))
+            for s3_url, item in list_source_objects(client, s3_prefix)]
+
+
+# Output URL, keeping the path of the file under the source prefix:
+def get_destination_url(s3_url, destination, s3_prefix=None):
+    if s3_prefix is not None and s3_url.startswith(s3_prefix):
+        relative_path = s3_url[len(s3_prefix):].lstrip('/')
+    elif is_s3_url(s3_url):
+        relative_path = split_s3_url(s3_url)[1]
+    else:
+        relative_path = strip_protocol(s3_url).lstrip('/')
+    return destination.rstrip('/') + '/' + relative_path
+
+
+# Unread stream of an S3 object, or of a local or fsspec file:
+def open_source_stream(client, s3_url):
+    if not is_s3_url(s3_url):
+        return open_input(s3_url)
+    s3_bucket, s3_filepath = split_s3_url(s3_url)
+    return get_stream(client, s3_bucket, s3_filepath)
+
+
+# Data of an S3 object, without the PII parquet columns that are not
+# needed, or of a local or fsspec file. With raw, the bytes are returned
+# unparsed:
+def read_source(client, s3_url, pii_fields, raw=False):
+    if not is_s3_url(s3_url):
+        return get_file_data(s3_url, raw=raw)
+    s3_bucket, s3_filepath = split_s3_url(s3_url)
+    return get_data(client, s3_bucket, s3_filepath,
+                    skip_columns=get_constant_fields(pii_fields), raw=raw)
+
+
+# Whether a file of a format is streamed through rather than read whole.
+# NDJSON and compressed files are always streamed, as are files read as a
+# given input format, which cannot be parsed by their extension. Parquet
+# is always read whole:
+def is_streamed(s3_url, file_format, input_format=None, stream=False):
+    if file_format in (None, 'parquet'):
+        return False
+    return (stream or input_format is not None or file_format == 'ndjson' or
+            split_codec(s3_url)[1] is not None)
+
+
+# Extracts, obfuscates and outputs a single file, errors are raised:
+def process_object(client, s3_url, pii_fields, destination_url=None,
+                   compression=None, compression_level=None,
+                   chunk_size=STREAM_READ_SIZE, part_size=DEFAULT_PART_SIZE,
+                   input_format=None, stream=False):
+    start = time.perf_counter()
+    check_input_format(input_format)
+    if not is_source_file(s3_url, input_format):
+        raise ValueError(f"Unsupported file type: {s3_url}")
+    file_format = input_format or get_file_format(s3_url)
+    # NDJSON is streamed through, record by record, and compressed files
+    # are decompressed as they are streamed:
+    if is_streamed(s3_url, file_format, input_format, stream):
+        anonymised_data = transform_stream(
+            open_source_stream(client, s3_url), pii_fields,
+            file_format=file_format, chunk_size=chunk_size)
+        if destination_url is None:
+            anonymised_data = b''.join(anonymised_data) or None
+    # Parquet given as the input format is read as bytes:
+    elif input_format == 'parquet':
+        anonymised_data = transform_data(
+            read_source(client, s3_url, pii_fields, raw=True), pii_fields)
+    else:
+        anonymised_data = transform_data(
+            read_source(client, s3_url, pii_fields), pii_fields)
+    if anonymised_data is None:
+        raise ValueError('Transformation gave no output.')
+    result = {'source': s3_url, 'status': 'ok'}
+    if destination_url is None:
+        result['data'] = anonymised_data
+        if type(anonymised_data) in (bytes, memoryview):
+            result['bytes'] = len(anonymised_data)
+    else:
+        upload = upload_handler(anonymised_data, destination_url,
+                                client=client, part_size=part_size,
+                                compression=compression,
+                                compression_level=compression_level)
+        if upload is None:
+            raise ValueError('Obfuscated output was not uploaded.')
+        result['destination'] = destination_url
+        result['bytes'] = upload['bytes']
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+# Runs process_object with its options, returning the error instead of
+# raising it:
+def process_object_safely(client, s3_url, pii_fields, destination_url,
+                          **options):
+    try:
+        return process_object(client, s3_url, pii_fields, destination_url,
+                              **options)
+    except Exception as err:
+        logger.error(f'Could not obfuscate {s3_url}: {err}')
+        return {'source': s3_url, 'status': 'error', 'error': str(err)}
+
+
+# Throughput over the whole batch:
+def summarise(results, seconds):
+    succeeded = [r for r in results if r['status'] == 'ok']
+    skipped = sum(1 for r in results if r['status'] == 'skipped')
+    output_bytes = sum(r.get('bytes', 0) for r in succeeded)
+    return {
+        'files': len(results),
+        'succeeded': len(succeeded),
+        'skipped': skipped,
+        'failed': len(results) - len(succeeded) - skipped,
+        'bytes': output_bytes,
+        'seconds': seconds,
+        'files_per_sec': len(results) / seconds if seconds else 0.0,
+        'mb_per_sec': output_bytes / 1e6 / seconds if seconds else 0.0,
+    }
+
+
+# Work of a batch: each source with its destination URL and version, and
+# whether it is unchanged since the last run. s3_prefix is one prefix or a
+# list of them. Versions (ETag and size) come from the listing of
+# prefixes, and from HeadObject for URLs if there is a manifest or with
+# head_urls. With an input format, every file under a prefix is listed.
+# Returns the jobs, the loaded manifest and the hash of the masking
+# configuration:
+def plan_batch(client, pii_fields, s3_urls=None, s3_prefix=None,
+               destination=None, manifest=None, compression=None,
+               head_urls=False, input_format=None, compression_level=None):
+    if manifest is not None and destination is None:
+        raise ValueError('A manifest needs a destination to obfuscate to.')
+    if s3_urls is None and s3_prefix is None:
+        raise ValueError('No files or prefix given to obfuscate.')
+    check_input_format(input_format)
+    if compression is not None:
+        codec = get_output_codec('', compression)
+    prefixes = [s3_prefix] if isinstance(s3_prefix, str) else s3_prefix
+    sources = []
+    for prefix in prefixes or []:
+        sources += [(url, prefix, get_version(item) if is_s3_url(url)
+                     else get_file_version(item))
+                    for url, item in list_source_objects(client, prefix,
+                                                         input_format)]
+    if s3_urls:
+        # Files given as URLs are checked with HeadObject:
+        versions = {}
+        if manifest is not None or head_urls:
+            versions = head_sources(client, s3_urls)
+        sources += [(url, None, versions.get(url)) for url in s3_urls]
+    config_hash = None
+    if manifest is not None:
+        manifest = load_manifest(manifest, client)
+        config_hash = get_config_hash(
+            pii_fields, compression=compression,
+            compression_level=compression_level, input_format=input_format)
+    jobs = []
+    for s3_url, prefix, version in sources:
+        destination_url = None
+        if destination is not None:
+            destination_url = get_destination_url(s3_url, destination,
+                                                  prefix)
+            if compression is not None:
+                destination_url = with_codec(destination_url, codec)
+        jobs.append({'source': s3_url, 'destination': destination_url,
+                     'version': version,
+                     'unchanged': manifest is not None and
+                     manifest.is_unchanged(s3_url, version, config_hash,
+                                           destination_url)})
+    return jobs, manifest, config_hash
+
+
+# Files and bytes a batch would obfuscate. Files that could not be found
+# have no size:
+def summarise_plan(jobs):
+    planned = [job for job in jobs if not job['unchanged']]
+    sizes = [job['version']['size'] for job in planned
+             if job['version'] is not None]
+    return {
+        'files': len(jobs),
+        'planned': len(planned),
+        'skipped': len(jobs) - len(planned),
+        'bytes': sum(sizes),
+        'unknown_sizes': len(planned) - len(sizes),
+    }
+
+
+# With a manifest (a local path or S3 URL), files whose source and masking
+# configuration are unchanged since the last run are skipped. With
+# compression, outputs are given the extension of its codec. chunk_size is
+# the size of the reads of streamed files, and part_size the size of the
+# parts uploaded to S3. input_format is the format every file is read as,
+# whatever its extension, and with stream CSV and JSON files are streamed
+# through. With dry_run, the planned work is returned and nothing is
+# obfuscated. progress is called with the result of each file as it
+# finishes, and the number of files:
+def batch_obfuscate(pii_fields, s3_urls=None, s3_prefix=None,
+                    destination=None, max_workers=DEFAULT_MAX_WORKERS,
+                    client=None, manifest=None, compression=None,
+                    compression_level=None, chunk_size=STREAM_READ_SIZE,
+                    part_size=DEFAULT_PART_SIZE, dry_run=False,
+                    progress=None, input_format=None, stream=False):
+    start = time.perf_counter()
+    # One client for all workers, with a connection for each of them:
+    if client is None:
+        client = get_client(
+            max_pool_connections=max(max_workers,
+                                     DEFAULT_MAX_POOL_CONNECTIONS))
+    jobs, manifest, config_hash = plan_batch(
+        client, pii_fields, s3_urls, s3_prefix, destination, manifest,
+        compression, head_urls=dry_run, input_format=input_format,
+        compression_level=compression_level)
+    if dry_run:
+        summary = summarise_plan(jobs)
+        logger.info(f"Planned {summary['planned']} of {summary['files']} "
+                    f"files, {summary['bytes']} bytes, "
+                    f"{summary['skipped']} unchanged.")
+        return {'plan': jobs, 'summary': summary}
+    load_token_caches()
+    reset_stage_totals()
+    results = [None] * len(jobs)
+    for index, job in enumerate(jobs):
+        if job['unchanged']:
+            results[index] = {'source': job['source'], 'status': 'skipped',
+                              'destination': job['destination']}
+            if progress is not None:
+                progress(results[index], len(jobs))
+    options = {'compression': compression,
+               'compression_level': compression_level,
+               'chunk_size': chunk_size, 'part_size': part_size,
+               'input_format': input_format, 'stream': stream}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_object_safely, client,
+                                   job['source'], pii_fields,
+                                   job['destination'], **options): index
+                   for index, job in enumerate(jobs)
+                   if not job['unchanged']}
+        # Results are kept in the order of the jobs:
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(results[futures[future]], len(jobs))
+    if manifest is not None:
+        for job, result in zip(jobs, results):
+            if result['status'] == 'ok':
+                manifest.record(job['source'], job['version'], config_hash,
+                                job['destination'])
+        save_manifest(manifest, client)
+    summary = summarise(results, time.perf_counter() - start)
+    logger.info(f"Obfuscated {summary['succeeded']} of {summary['files']} "
+                f"files at {summary['files_per_sec']:.1f} files/sec, "
+                f"{summary['skipped']} unchanged.")
+    summary['token_caches'] = get_cache_stats()
+    log_cache_stats()
+    save_token_caches()
+    summary['stages'] = get_stage_totals()
+    log_stage_totals()
+    return {'results': results, 'summary': summary}
+
+
+# Batch entry point, takes a JSON with either "files_to_obfuscate" (a list
+# of S3 URLs or local paths) or "prefix_to_obfuscate" (an S3 prefix or a
+# directory, or a list of them), and "pii_fields".
+# An optional "manifest" skips files unchanged since the last run,
+# "output_compression" and "compression_level" set how outputs are
+# compressed, "chunk_size" and "part_size" how they are read and uploaded,
+# "input_format" the format files are read as and "stream" whether CSV and
+# JSON files are streamed, and "dry_run" returns the planned work without
+# doing it:
+def batch_handler(json_file):
+    logger = setup_logging()
+    try:
+        json_loaded = json.loads(json_file)
+        return batch_obfuscate(
+            json_loaded['pii_fields'],
+            s3_urls=json_loaded.get('files_to_obfuscate'),
+            s3_prefix=json_loaded.get('prefix_to_obfuscate'),
+            destination=json_loaded.get('destination'),
+            max_workers=json_loaded.get('max_workers', DEFAULT_MAX_WORKERS),
+            manifest=json_loaded.get('manifest'),
+            compression=json_loaded.get('output_compression'),
+            compression_level=json_loaded.get('compression_level'),
+            chunk_size=json_loaded.get('chunk_size', STREAM_READ_SIZE),
+            part_size=json_loaded.get('part_size', DEFAULT_PART_SIZE),
+            dry_run=json_loaded.get('dry_run', False),
+            input_format=json_loaded.get('input_format'),
+            stream=json_loaded.get('stream', False))
+    except Exception as error:
+        logger.error('An unexpected error has occurred: %s', error)
+        return
@@ -0,0 +1,104 @@
+import io
+import mmap
+import os
+import tempfile
+import threading
+
+
+# SPILL BUFFERS
+# Byte buffers that stay in memory while small and move to a temporary file
+# above a threshold. The contents are read back through a memoryview, of
+# the bytearray in memory or of an mmap of the file, so the extractor, the
+# transformer and the writer can share one copy of the data.
+
+DEFAULT_SPILL_THRESHOLD = 256 * 1024 * 1024
+
+
+# Threshold and directory can be set for the environment, for example to
+# use the ephemeral storage volume of an ECS task:
+def get_spill_threshold():
+    return int(os.environ.get('OBFUSCATOR_SPILL_THRESHOLD',
+                              DEFAULT_SPILL_THRESHOLD))
+
+
+def get_spill_dir():
+    return os.environ.get('OBFUSCATOR_SPILL_DIR') or None
+
+
+class SpillBuffer(io.RawIOBase):
+    def __init__(self, threshold=None, spill_dir=None):
+        self.threshold = (get_spill_threshold() if threshold is None
+                          else threshold)
+        self.spill_dir = get_spill_dir() if spill_dir is None else spill_dir
+        self.size = 0
+        self.__memory = bytearray()
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    @property
+    def spilled(self):
+        return self.__file is not None
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.size
+
+    def __len__(self):
+        return self.size
+
+    # Moves the contents to a temporary file, deleted when it is closed:
+    def __spill(self):
+        self.__file = tempfile.TemporaryFile(dir=self.spill_dir)
+        self.__file.write(self.__memory)
+        self.__file.flush()
+        self.__memory = bytearray()
+
+    # Sets the size up front, so ranges can be written in any order:
+    def reserve(self, size):
+        with self.__lock:
+            if not self.spilled and size > self.threshold:
+                self.__spill()
+            if self.spilled:
+                os.ftruncate(self.__file.fileno(), max(size, self.size))
+            elif size > len(self.__memory):
+                self.__memory.extend(bytes(size - len(self.__memory)))
+            self.size = max(size, self.size)
+
+    # Writes data at an offset, safe to call from several threads:
+    def write_at(self, offset, data):
+        end = offset + len(data)
+        with self.__lock:
+            if not self.spilled and end > self.threshold:
+                self.__spill()
+            if not self.spilled:
+                if end > len(self.__memory):
+                    self.__memory.extend(bytes(end - len(self.__memory)))
+                self.__memory[offset:end] = data
+            self.size = max(end, self.size)
+            file = self.__file
+        if file is not None:
+            os.pwrite(file.fileno(), data, offset)
+        return len(data)
+
+    def write(self, data):
+        return self.write_at(self.size, data)
+
+    # Contents without a copy. Once the buffer has been read like this it
+    # should not be written to again:
+    def getbuffer(self):
+        if not self.spilled:
+            return memoryview(self.__memory)[:self.size]
+        if self.size == 0:
+            return memoryview(b'')
+        self.__file.flush()
+        # The mapping stays valid after the file is closed and deleted:
+        mapped = mmap.mmap(self.__file.fileno(), self.size,
+                           access=mmap.ACCESS_READ)
+        return memoryview(mapped)
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+        super().close()
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# TOKEN CACHES
+# Values already pseudonymised by a masking strategy, with their tokens, so
+# a repeated value (a course, a cohort, a customer ID seen in many files)
+# is transformed once. Each cache has a memory cap and evicts the least
+# recently used values. Caches are kept for the life of the process, one
+# for each strategy and set of options, so they are shared by every chunk
+# and file of a batch run. They can be saved to a local file and loaded by
+# the next run.
+#
+# A saved cache holds PII values next to their tokens, and should only be
+# written to encrypted local storage that the obfuscator alone can read.
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+# Estimated bytes of an entry beyond the characters of its value and token
+# (the two string objects, the dictionary slot and the linked list node of
+# the OrderedDict):
+ENTRY_OVERHEAD = 200
+CACHE_FILE_VERSION = 1
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Memory cap and cache file can be set for the environment:
+def get_cache_bytes():
+    return int(os.environ.get('OBFUSCATOR_TOKEN_CACHE_BYTES',
+                              DEFAULT_CACHE_BYTES))
+
+
+def get_cache_file():
+    return os.environ.get('OBFUSCATOR_TOKEN_CACHE_FILE') or None
+
+
+# Value to token cache with LRU eviction, safe to share between threads:
+class TokenCache:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = get_cache_bytes() if max_bytes is None \
+            else max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__tokens = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__tokens)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    # Tokens of the values found, as a dictionary, and the values not found:
+    def lookup(self, values):
+        found = {}
+        missing = []
+        with self.__lock:
+            get = self.__tokens.get
+            move_to_end = self.__tokens.move_to_end
+            for value in values:
+                token = get(value)
+                if token is None:
+                    missing.append(value)
+                else:
+                    move_to_end(value)
+                    found[value] = token
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    # Adds values and their tokens, evicting the least recently used values
+    # once over the memory cap. Values already cached (such as misses of the
+    # same value in two threads) replace their entry and its size:
+    def store(self, values, tokens):
+        with self.__lock:
+            cached = self.__tokens
+            for value, token in zip(values, tokens):
+                previous = cached.pop(value, None)
+                if previous is not None:
+                    self.size -= len(value) + len(previous) + ENTRY_OVERHEAD
+                cached[value] = token
+                self.size += len(value) + len(token) + ENTRY_OVERHEAD
+            while self.size > self.max_bytes and self.__tokens:
+                value, token = self.__tokens.popitem(last=False)
+                self.size -= len(value) + len(token) + ENTRY_OVERHEAD
+                self.evictions += 1
+
+    # (value, token) pairs, least recently used first:
+    def items(self):
+        with self.__lock:
+            return list(self.__tokens.items())
+
+    def stats(self):
+        return {'entries': len(self), 'bytes': self.size,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate}
+
+
+# The shared cache of a strategy, by a name for the strategy and options
+# that does not give away any key:
+def get_token_cache(namespace):
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = TokenCache()
+        return _caches[namespace]
+
+
+def clear_token_caches():
+    with _caches_lock:
+        _caches.clear()
+
+
+# Hit rate and size of each shared cache:
+def get_cache_stats():
+    with _caches_lock:
+        caches = dict(_caches)
+    return {namespace: cache.stats() for namespace, cache in caches.items()}
+
+
+# Loads saved caches, gives error and loads nothing if the file cannot be
+# read. Returns the number of values loaded:
+def load_token_caches(path=None):
+    path = path or get_cache_file()
+    if path is None or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, 'r', encoding='utf-8') as cache_file:
+            saved = json.load(cache_file)
+        if saved.get('version') != CACHE_FILE_VERSION:
+            raise ValueError('unknown version')
+        loaded = 0
+        for namespace, items in saved['caches'].items():
+            get_token_cache(namespace).store([value for value, _ in items],
+                                             [token for _, token in items])
+            loaded += len(items)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.error(f'Token cache file {path} could not be loaded: {e}')
+        return 0
+    logger.info(f'Loaded {loaded} cached tokens from {path}.')
+    return loaded
+
+
+# Saves the caches, readable by this user only. The file is replaced in one
+# step, so a run that fails part way leaves the last complete file:
+def save_token_caches(path=None):
+    path = path or get_cache_file()
+    if path is None:
+        return
+    with _caches_lock:
+        caches = dict(_caches)
+    saved = {'version': CACHE_FILE_VERSION,
+             'caches': {namespace: cache.items()
+                        for namespace, cache in caches.items()}}
+    directory = os.path.dirname(os.path.abspath(path))
+    temporary_path = None
+    try:
+        handle, temporary_path = tempfile.mkstemp(dir=directory,
+                                                  suffix='.tmp')
+        with os.fdopen(handle, 'w', encoding='utf-8') as cache_file:
+            json.dump(saved, cache_file)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.error(f'Token cache file {path} could not be saved: {e}')
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return
+    logger.info(f'Saved cached tokens to {path}.')
+    return path
+
+
+# Logs the hit rate of each shared cache:
+def log_cache_stats():
+    for namespace, stats in get_cache_stats().items():
+        logger.info(f"Token cache {namespace}: {stats['hit_rate']:.1%} hit "
+                    f"rate, {stats['entries']} values, "
+                    f"{stats['evictions']} evicted.")
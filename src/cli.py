@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import sys
+import time
+from src.batch import (batch_obfuscate,
+                       is_source_file,
+                       DEFAULT_MAX_WORKERS)
+from src.compression import DEFAULT_LEVELS, NO_COMPRESSION
+from src.extractor import FILE_FORMATS
+from src.filesystems import is_local_url, strip_protocol
+from src.instrumentation import get_stage_totals, setup_logging
+from src.loader import DEFAULT_PART_SIZE, MIN_PART_SIZE
+from src.masking import DEFAULT_STRATEGY, STRATEGIES
+from src.transformer import STREAM_READ_SIZE
+
+
+# COMMAND LINE
+# Obfuscates files from a shell, with the batch functions (see batch):
+#     python -m src.cli s3://my_ingestion_bucket/new_data/ \
+#         --pii-fields name email_address=hmac \
+#         --destination s3://my_output_bucket/new_data/ --workers 32
+# Sources are S3 URLs, local paths or other fsspec URLs, of files or of
+# prefixes (directories) to obfuscate every supported file under. PII
+# fields and the other options can also be given in a JSON config file,
+# with the keys of the batch JSON; options on the command line take
+# precedence. --input-format reads every file as one format, for objects
+# without a usable extension, --default-strategy sets the strategy of PII
+# fields given without one, and --stream streams CSV and JSON files through
+# rather than reading them whole. Progress (files, rows and MB/s) is
+# written to stderr as files finish, and a summary to stdout. With
+# --dry-run, the files that would be obfuscated are listed with their
+# sizes, and nothing is read or written.
+#
+# Exits with status 1 if any file could not be obfuscated.
+
+# Multipliers of size suffixes, such as 8M:
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# Seconds between progress lines when stderr is not a terminal:
+PROGRESS_INTERVAL = 5.0
+
+
+# Size in bytes, with an optional K, M or G suffix:
+def parse_size(text):
+    text = text.strip().upper().removesuffix('IB').removesuffix('B')
+    multiplier = 1
+    if text and text[-1] in SIZE_UNITS:
+        multiplier = SIZE_UNITS[text[-1]]
+        text = text[:-1]
+    try:
+        size = int(float(text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid size: {text!r}')
+    if size <= 0:
+        raise argparse.ArgumentTypeError('size must be positive')
+    return size
+
+
+# PII fields as a list, or a dictionary if any is given a strategy as
+# field=strategy or there is a default strategy for the rest:
+def parse_pii_fields(values, default_strategy=None):
+    if default_strategy is None and not any('=' in value
+                                            for value in values):
+        return list(values)
+    pii_fields = {}
+    for value in values:
+        field, _, strategy = value.partition('=')
+        pii_fields[field] = strategy or default_strategy or DEFAULT_STRATEGY
+    return pii_fields
+
+
+# PII fields of a config, with a list given the default strategy:
+def with_default_strategy(pii_fields, default_strategy):
+    if default_strategy is None or not isinstance(pii_fields, list):
+        return pii_fields
+    return dict.fromkeys(pii_fields, default_strategy)
+
+
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    if not isinstance(config, dict):
+        raise ValueError(f'Config {path} is not a JSON object.')
+    return config
+
+
+# Whether a source is a prefix (or directory) rather than a file. With an
+# input format, a source without a supported extension is a file unless it
+# ends with a slash:
+def is_prefix(source, input_format=None):
+    if is_local_url(source):
+        return os.path.isdir(strip_protocol(source))
+    return source.endswith('/') or not is_source_file(source, input_format)
+
+
+# Sources split into files and prefixes:
+def split_sources(sources, input_format=None):
+    files = [source for source in sources
+             if not is_prefix(source, input_format)]
+    prefixes = [source for source in sources
+                if is_prefix(source, input_format)]
+    return files, prefixes
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1000:
+            break
+        size /= 1000
+    else:
+        unit = 'TB'
+    return f'{size:,.0f} {unit}' if unit == 'B' else f'{size:,.1f} {unit}'
+
+
+# Writes a progress line as each file finishes. On a terminal the line is
+# rewritten in place, otherwise one is written every interval:
+class Progress:
+    def __init__(self, stream=None, interval=PROGRESS_INTERVAL):
+        self.stream = sys.stderr if stream is None else stream
+        self.interval = interval
+        self.is_terminal = self.stream.isatty()
+        self.start = time.perf_counter()
+        self.last_line = None
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.total = 0
+
+    def __call__(self, result, total):
+        self.done += 1
+        self.total = total
+        if result['status'] == 'error':
+            self.failed += 1
+            self.clear()
+            print(f"Failed: {result['source']}: {result['error']}",
+                  file=self.stream)
+        elif result['status'] == 'skipped':
+            self.skipped += 1
+        else:
+            self.bytes += result.get('bytes', 0)
+        now = time.perf_counter()
+        if self.is_terminal or self.done == total or \
+                self.last_line is None or \
+                now - self.last_line >= self.interval:
+            self.write(now)
+
+    def get_line(self, now):
+        seconds = now - self.start
+        rows = get_stage_totals().get('mask', {}).get('rows', 0)
+        rate = self.bytes / 1e6 / seconds if seconds else 0.0
+        return (f'{self.done}/{self.total} files, {rows:,} rows, '
+                f'{format_bytes(self.bytes)}, {rate:.1f} MB/s, '
+                f'{self.failed} failed, {self.skipped} unchanged')
+
+    def write(self, now):
+        self.last_line = now
+        line = self.get_line(now)
+        if self.is_terminal:
+            self.stream.write('\r\033[K' + line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    # Ends the line being rewritten on a terminal:
+    def clear(self):
+        if self.is_terminal and self.last_line is not None:
+            self.stream.write('\n')
+
+    def finish(self):
+        self.clear()
+
+
+def print_plan(output, stream=None):
+    for job in output['plan']:
+        size = 'not found' if job['version'] is None else \
+            format_bytes(job['version']['size'])
+        status = 'unchanged' if job['unchanged'] else size
+        destination = job['destination'] or '(no destination)'
+        print(f"{job['source']} -> {destination} [{status}]", file=stream)
+    summary = output['summary']
+    print(f"Would obfuscate {summary['planned']} of {summary['files']} "
+          f"files, {format_bytes(summary['bytes'])} estimated, "
+          f"{summary['skipped']} unchanged.", file=stream)
+    if summary['unknown_sizes']:
+        print(f"{summary['unknown_sizes']} files could not be found.",
+              file=stream)
+
+
+def print_summary(summary, stream=None):
+    print(f"Obfuscated {summary['succeeded']} of {summary['files']} files "
+          f"({summary['skipped']} unchanged, {summary['failed']} failed), "
+          f"{format_bytes(summary['bytes'])} in {summary['seconds']:.1f}s, "
+          f"{summary['mb_per_sec']:.1f} MB/s.", file=stream)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m src.cli',
+        description='Obfuscate PII fields in CSV, JSON, NDJSON and parquet '
+                    'files.')
+    parser.add_argument('sources', nargs='*',
+                        help='S3 URLs, local paths or fsspec URLs of files, '
+                             'or prefixes (directories) to obfuscate')
+    parser.add_argument('-f', '--pii-fields', nargs='+', metavar='FIELD',
+                        help='PII fields, as field or field=strategy')
+    parser.add_argument('--default-strategy', choices=sorted(STRATEGIES),
+                        help=f'strategy of PII fields given without one '
+                             f'(default {DEFAULT_STRATEGY})')
+    parser.add_argument('--input-format', choices=FILE_FORMATS,
+                        help='format to read every file as, for files '
+                             'without a usable extension (default: by '
+                             'extension)')
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction,
+                        help='stream CSV and JSON files through rather than '
+                             'reading them whole (NDJSON and compressed '
+                             'files are always streamed)')
+    parser.add_argument('-c', '--config',
+                        help='JSON file of options, with the keys of the '
+                             'batch JSON')
+    parser.add_argument('-o', '--destination',
+                        help='URL or directory to write outputs to')
+    parser.add_argument('-w', '--workers', type=int,
+                        help=f'files obfuscated at once (default '
+                             f'{DEFAULT_MAX_WORKERS})')
+    parser.add_argument('--chunk-size', type=parse_size,
+                        help=f'read size of streamed files, such as 8M '
+                             f'(default {STREAM_READ_SIZE})')
+    parser.add_argument('--part-size', type=parse_size,
+                        help=f'S3 upload part size, at least '
+                             f'{MIN_PART_SIZE} (default {DEFAULT_PART_SIZE})')
+    parser.add_argument('--output-compression',
+                        choices=sorted(DEFAULT_LEVELS) + [NO_COMPRESSION],
+                        help='codec outputs are compressed with')
+    parser.add_argument('--compression-level', type=int)
+    parser.add_argument('--manifest',
+                        help='skip files unchanged since the last run with '
+                             'this manifest')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the planned work without doing it')
+    parser.add_argument('--report',
+                        help='file to write the result of each file to, as '
+                             'JSON')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not write progress')
+    return parser
+
+
+# Options of batch_obfuscate, from the config file with the command line
+# over it:
+def get_options(args, config):
+    options = {
+        'pii_fields': config.get('pii_fields'),
+        'destination': config.get('destination'),
+        'max_workers': config.get('max_workers', DEFAULT_MAX_WORKERS),
+        'manifest': config.get('manifest'),
+        'compression': config.get('output_compression'),
+        'compression_level': config.get('compression_level'),
+        'chunk_size': config.get('chunk_size', STREAM_READ_SIZE),
+        'part_size': config.get('part_size', DEFAULT_PART_SIZE),
+        'input_format': config.get('input_format'),
+        'stream': config.get('stream', False),
+    }
+    default_strategy = args.default_strategy or \
+        config.get('default_strategy')
+    overrides = {
+        'pii_fields': args.pii_fields and parse_pii_fields(args.pii_fields,
+                                                           default_strategy),
+        'destination': args.destination,
+        'max_workers': args.workers,
+        'manifest': args.manifest,
+        'compression': args.output_compression,
+        'compression_level': args.compression_level,
+        'chunk_size': args.chunk_size,
+        'part_size': args.part_size,
+        'input_format': args.input_format,
+        'stream': args.stream,
+    }
+    options.update({key: value for key, value in overrides.items()
+                    if value is not None})
+    options['pii_fields'] = with_default_strategy(options['pii_fields'],
+                                                  default_strategy)
+    files, prefixes = split_sources(args.sources, options['input_format'])
+    files += config.get('files_to_obfuscate') or []
+    config_prefixes = config.get('prefix_to_obfuscate') or []
+    if isinstance(config_prefixes, str):
+        config_prefixes = [config_prefixes]
+    prefixes += config_prefixes
+    options['s3_urls'] = files or None
+    options['s3_prefix'] = prefixes or None
+    return options
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    try:
+        config = load_config(args.config) if args.config else {}
+    except (OSError, ValueError) as e:
+        parser.error(f'config could not be read: {e}')
+    options = get_options(args, config)
+    if not options['pii_fields']:
+        parser.error('PII fields are needed, with --pii-fields or a config')
+    if options['s3_urls'] is None and options['s3_prefix'] is None:
+        parser.error('no sources given to obfuscate')
+    if options['destination'] is None and not args.dry_run:
+        parser.error('a destination is needed, with --destination or a '
+                     'config')
+    if options['part_size'] < MIN_PART_SIZE:
+        parser.error(f'part size must be at least {MIN_PART_SIZE}')
+    logger = setup_logging()
+    progress = None if args.quiet or args.dry_run else Progress()
+    try:
+        output = batch_obfuscate(dry_run=args.dry_run, progress=progress,
+                                 **options)
+    except Exception as error:
+        logger.error('An unexpected error has occurred: %s', error)
+        print(f'error: {error}', file=sys.stderr)
+        return 1
+    finally:
+        if progress is not None:
+            progress.finish()
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as report_file:
+            json.dump(output, report_file, indent=2, default=str)
+    if args.dry_run:
+        print_plan(output)
+        return 0
+    print_summary(output['summary'])
+    return 1 if output['summary']['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
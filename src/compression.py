@@ -0,0 +1,151 @@
+import bz2
+import gzip
+import importlib.util
+import io
+import lzma
+import zlib
+from src.lazy_imports import lazy_import
+
+# zstd needs the optional zstandard package:
+zstandard = lazy_import('zstandard')
+
+
+# COMPRESSION FUNCTIONS
+# Compressed CSV, JSON and NDJSON files (file1.csv.gz, file1.json.zst,
+# file1.ndjson.bz2) are decompressed as they are read, a block at a time,
+# and streamed through the format engines, so the whole file is never
+# decompressed in memory. The codec is chosen by the extension, or by the
+# Content-Encoding of the S3 object for files without one.
+#
+# Output is compressed as it is uploaded, with the codec of the extension
+# of the destination, or the codec and level given. gzip, bz2 and xz use
+# the standard library; zstd is used if zstandard is installed.
+
+# Codec of each compressed file extension:
+CODEC_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+# Extension given to output compressed with each codec:
+EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+# Codec of each S3 Content-Encoding:
+CONTENT_ENCODINGS = {
+    'gzip': 'gzip',
+    'x-gzip': 'gzip',
+    'bzip2': 'bz2',
+    'x-bzip2': 'bz2',
+    'xz': 'xz',
+    'zstd': 'zstd',
+}
+# Levels used when none is given, the defaults of each library:
+DEFAULT_LEVELS = {'gzip': 6, 'bz2': 9, 'xz': 6, 'zstd': 3}
+# Output compression option that turns compression off:
+NO_COMPRESSION = 'none'
+
+
+class CompressionError(ValueError):
+    pass
+
+
+# Whether a codec can be used here:
+def is_available(codec):
+    if codec == 'zstd':
+        return importlib.util.find_spec('zstandard') is not None
+    return codec in DEFAULT_LEVELS
+
+
+# Gives error if a codec is unknown or cannot be used here:
+def check_codec(codec):
+    if codec not in DEFAULT_LEVELS:
+        raise CompressionError(f'Compression "{codec}" not recognised.')
+    if not is_available(codec):
+        raise CompressionError(f'Compression "{codec}" needs the zstandard '
+                               f'package.')
+
+
+# File path without its compressed extension, and the codec of it (None if
+# the file is not compressed):
+def split_codec(filepath):
+    for extension, codec in CODEC_EXTENSIONS.items():
+        if filepath.endswith(extension):
+            return filepath[:-len(extension)], codec
+    return filepath, None
+
+
+# File path without its compressed extension:
+def strip_codec(filepath):
+    return split_codec(filepath)[0]
+
+
+# Codec of a Content-Encoding, or None:
+def get_encoding_codec(content_encoding):
+    if not content_encoding:
+        return None
+    return CONTENT_ENCODINGS.get(content_encoding.strip().lower())
+
+
+# Output path with the extension of a codec in place of any it had:
+def with_codec(filepath, codec):
+    filepath = strip_codec(filepath)
+    if codec is None:
+        return filepath
+    return filepath + EXTENSIONS[codec]
+
+
+# Codec output is compressed with: the compression given ("none" for
+# none), else the codec of the destination's extension:
+def get_output_codec(destination, compression=None):
+    if compression == NO_COMPRESSION:
+        return None
+    if compression is None:
+        return split_codec(destination)[1]
+    check_codec(compression)
+    return compression
+
+
+# Readable file that decompresses a stream as it is read:
+def open_decompressed(stream, codec):
+    check_codec(codec)
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if codec == 'bz2':
+        return bz2.BZ2File(stream, mode='rb')
+    if codec == 'xz':
+        return lzma.LZMAFile(stream, mode='rb')
+    return zstandard.ZstdDecompressor().stream_reader(
+        stream, read_across_frames=True)
+
+
+# Whole body decompressed in memory:
+def decompress_bytes(body, codec):
+    with open_decompressed(io.BytesIO(body), codec) as stream:
+        return stream.read()
+
+
+# Incremental compressor with compress and flush methods:
+def get_compressor(codec, level=None):
+    check_codec(codec)
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if codec == 'gzip':
+        # wbits of 31 writes a gzip header and trailer:
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if codec == 'bz2':
+        return bz2.BZ2Compressor(level)
+    if codec == 'xz':
+        return lzma.LZMACompressor(preset=level)
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+# Compresses chunks of bytes as they are produced:
+def compress_chunks(chunks, codec, level=None):
+    compressor = get_compressor(codec, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
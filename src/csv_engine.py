@@ -0,0 +1,353 @@
+import logging
+import re
+from src.instrumentation import measure
+from src.field_plan import get_field_plan
+from src.masking import get_strategies
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# CSV ENGINE
+# Masks CSV at the byte level. Each record is split into fields once, the
+# fields at the PII column indices are replaced and the record is joined
+# back together, so every other field, quote and line ending is copied
+# through exactly as it was read. Nothing is type-inferred, so IDs keep
+# their leading zeros and dates and floats keep their formatting. Quoted
+# fields may contain commas, escaped quotes and newlines. Strategies that
+# depend on the value are given each distinct field of a block once.
+
+# Bytes read from a stream at a time:
+READ_SIZE = 1024 * 1024
+# Masked fields remembered for each PII column before the cache is cleared.
+# Values are also kept by the strategy's token cache, across files:
+FIELD_CACHE_SIZE = 1000000
+
+
+# Splits a record into fields, keeping commas inside quoted fields. A field
+# is complete once it holds an even number of quotes, as escaped quotes
+# ("") come in pairs:
+def split_quoted(record):
+    fields = []
+    field = None
+    for piece in record.split(b','):
+        field = piece if field is None else field + b',' + piece
+        if field.count(b'"') % 2 == 0:
+            fields.append(field)
+            field = None
+    if field is not None:
+        fields.append(field)
+    return fields
+
+
+def split_fields(record):
+    if b'"' in record:
+        return split_quoted(record)
+    return record.split(b',')
+
+
+# Column name of a header field, without its quotes:
+def get_field_name(field):
+    field = field.decode('utf-8', errors='replace')
+    if len(field) >= 2 and field[0] == field[-1] == '"':
+        field = field[1:-1].replace('""', '"')
+    return field
+
+
+# Value of a field without its quotes, or None if it is empty:
+def decode_field(field):
+    if not field:
+        return None
+    if field[:1] == b'"' and field[-1:] == b'"' and len(field) >= 2:
+        field = field[1:-1].replace(b'""', b'"')
+    return field.decode('utf-8', errors='replace')
+
+
+# A masked value as a field, quoted if it needs to be. None is empty:
+def encode_field(value):
+    if value is None:
+        return b''
+    field = value.encode('utf-8')
+    if any(character in field for character in (b',', b'"', b'\r', b'\n')):
+        field = b'"' + field.replace(b'"', b'""') + b'"'
+    return field
+
+
+# A field, either quoted (with "" for a quote) or without quotes, commas or
+# line endings:
+FIELD = rb'(?:[^,"\r\n]*|"[^"]*(?:""[^"]*)*")'
+# The rest of a record, after the last PII field:
+RECORD_END = rb'(?:,[^"\r\n]*(?:"[^"]*"[^"\r\n]*)*)?\r?\n'
+
+
+# Builds a pattern matching one whole record, with a group for each PII
+# field and for each stretch of bytes around them. re.split then gives the
+# record as pieces that can be rejoined with the PII pieces replaced.
+# Blank lines are not records, so they are never matched and are passed
+# through as they are by the line masking:
+def get_record_pattern(indices):
+    pattern = b''
+    position = 0
+    for index in indices:
+        separator = b',' if position else b''
+        pattern += (b'(' + separator +
+                    b''.join(FIELD + b',' for _ in range(position, index)) +
+                    b')(' + FIELD + b')')
+        position = index + 1
+    return re.compile(rb'(?!\r?\n)' + pattern + b'(' + RECORD_END + b')')
+
+
+# Masks complete records, fed in as they are read. Output is returned as
+# bytes with one line ending per record:
+class CSVMasker:
+    def __init__(self, pii_fields):
+        self.pii_fields = pii_fields
+        self.strategies = get_strategies(pii_fields)
+        self.columns = None
+        self.indices = []
+        self.rows = 0
+        self.__remainder = b''
+        self.__pending = None
+
+    # Reads the column names and finds the indices of the PII columns:
+    def __read_header(self, record):
+        fields = split_fields(record.rstrip(b'\r'))
+        if fields and fields[0].startswith(b'\xef\xbb\xbf'):
+            fields[0] = fields[0][3:]
+        self.columns = [get_field_name(field) for field in fields]
+        plan = get_field_plan(self.strategies, self.columns)
+        plan.log_missing()
+        self.indices = [index for index, name in enumerate(self.columns)
+                        if name in plan.matches]
+        self.__strategies = [
+            self.strategies[plan.matches[self.columns[index]]]
+            for index in self.indices]
+        # Constant fields of each PII column, None where the strategy
+        # depends on the value:
+        self.__masks = [encode_field(strategy.value)
+                        if strategy.is_constant else None
+                        for strategy in self.__strategies]
+        self.__replacements = list(zip(self.indices, self.__masks))
+        self.__constant = None not in self.__masks
+        self.__caches = [{} for _ in self.indices]
+        # Fields after the last PII column are not split:
+        self.__maxsplit = max(self.indices, default=0) + 1
+        self.__pattern = get_record_pattern(self.indices)
+
+    def __mask_record(self, record):
+        if self.columns is None:
+            self.__read_header(record)
+            return record
+        self.rows += 1
+        if not self.indices:
+            return record
+        line_ending = b''
+        if record.endswith(b'\r'):
+            record, line_ending = record[:-1], b'\r'
+        if b'"' in record:
+            fields = split_quoted(record)
+        else:
+            fields = record.split(b',', self.__maxsplit)
+        length = len(fields)
+        for number, index in enumerate(self.indices):
+            if index < length:
+                fields[index] = self.__replace(number, [fields[index]])[0]
+        return b','.join(fields) + line_ending
+
+    # Masked fields of the PII column at indices[number]. Each distinct
+    # field is masked once, and remembered for the rest of the file:
+    def __replace(self, number, fields):
+        mask = self.__masks[number]
+        if mask is not None:
+            return [mask] * len(fields)
+        cache = self.__caches[number]
+        distinct = set(fields)
+        if len(cache) + len(distinct) > FIELD_CACHE_SIZE:
+            cache.clear()
+        missing = [field for field in distinct if field not in cache]
+        if missing:
+            values = self.__strategies[number].transform(
+                [decode_field(field) for field in missing])
+            cache.update(zip(missing, map(encode_field, values)))
+        return [cache[field] for field in fields]
+
+    # Masks the PII columns of split records, a column at a time:
+    def __replace_rows(self, rows):
+        for number, index in enumerate(self.indices):
+            # Short rows are masked where the field is present:
+            column_rows = [fields for fields in rows if index < len(fields)]
+            values = self.__replace(
+                number, [fields[index] for fields in column_rows])
+            for fields, value in zip(column_rows, values):
+                fields[index] = value
+
+    # Masks whole lines one at a time. A line that leaves a quoted field
+    # open is held until the lines that close it have been read:
+    def __mask_lines(self, lines):
+        plain = self.columns is not None and self.__pending is None
+        maxsplit = self.__maxsplit if plain else 0
+        replacements = self.__replacements if plain else []
+        constant = self.__constant if plain else True
+        output = []
+        # Split records left for strategies that depend on the value:
+        split_rows = []
+        rows = 0
+        for line in lines:
+            # Most lines have no quotes, and are split on commas only:
+            if plain and line and line[-1] != 13 and b'"' not in line:
+                fields = line.split(b',', maxsplit)
+                if constant:
+                    length = len(fields)
+                    for index, mask in replacements:
+                        if index < length:
+                            fields[index] = mask
+                    output.append(b','.join(fields))
+                else:
+                    output.append(fields)
+                    split_rows.append(fields)
+                rows += 1
+                continue
+            if self.__pending is not None:
+                self.__pending.append(line)
+                self.__quotes += line.count(b'"')
+                if self.__quotes % 2:
+                    continue
+                line = b'\n'.join(self.__pending)
+                self.__pending = None
+            elif not line.rstrip(b'\r'):
+                # Blank lines are not records, and are passed through:
+                output.append(line)
+                continue
+            elif b'"' in line and line.count(b'"') % 2:
+                self.__pending = [line]
+                self.__quotes = line.count(b'"')
+                plain = False
+                continue
+            output.append(self.__mask_record(line))
+            plain = self.columns is not None
+            maxsplit = self.__maxsplit
+            replacements = self.__replacements
+            constant = self.__constant
+        self.rows += rows
+        if split_rows:
+            self.__replace_rows(split_rows)
+            output = [b','.join(line) if type(line) is list else line
+                      for line in output]
+        if not output:
+            return b''
+        return b'\n'.join(output) + b'\n'
+
+    # Masks records matched by the record pattern. Matching stops at the
+    # first record that does not fit, which is returned unmasked:
+    def __mask_matched_records(self, block):
+        pieces = self.__pattern.split(block)
+        stride = 2 * len(self.indices) + 2
+        records = (len(pieces) - 1) // stride
+        # Text between matches, empty while records follow each other:
+        for matched, between in enumerate(pieces[0::stride]):
+            if between:
+                break
+        else:
+            matched = records
+        cut = matched * stride
+        rest = b''.join(pieces[cut:])
+        pieces = pieces[:cut]
+        for number in range(len(self.indices)):
+            pieces[2 + 2 * number::stride] = self.__replace(
+                number, pieces[2 + 2 * number::stride])
+        self.rows += matched
+        return b''.join(pieces), rest
+
+    # Masks a block of whole lines, the record pattern or plain splitting is
+    # used where it can be, and line by line masking for the rest:
+    def __mask_block(self, block):
+        output = []
+        # The header, and any quoted field left open, are read first:
+        start = 0
+        while start < len(block) and (self.columns is None or
+                                      self.__pending is not None):
+            end = block.index(b'\n', start)
+            output.append(self.__mask_lines([block[start:end]]))
+            start = end + 1
+        block = block[start:]
+        if not block:
+            return b''.join(output)
+        if block.count(b'"') < block.count(b'\n'):
+            # Quotes are rare, so most lines are split on commas only:
+            output.append(self.__mask_lines(block[:-1].split(b'\n')))
+        else:
+            masked, block = self.__mask_matched_records(block)
+            output.append(masked)
+            if block:
+                output.append(self.__mask_lines(block[:-1].split(b'\n')))
+        return b''.join(output)
+
+    def feed(self, data):
+        data = self.__remainder + bytes(data)
+        end = data.rfind(b'\n') + 1
+        self.__remainder = data[end:]
+        return self.__mask_block(data[:end])
+
+    # Masks what is left, the final line is given a line ending:
+    def finish(self):
+        output = b''
+        if self.__remainder:
+            output = self.__mask_block(self.__remainder + b'\n')
+            self.__remainder = b''
+        if self.__pending is not None:
+            # A quote that is never closed, masked as far as it goes:
+            line = b'\n'.join(self.__pending)
+            self.__pending = None
+            output += self.__mask_record(line) + b'\n'
+        return output
+
+
+# Masks CSV held in memory, returns CSV bytes:
+def csv_transformation(data, pii_fields):
+    if len(data) == 0:
+        logger.error('Input file is blank.')
+        return
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    masker = CSVMasker(strategies)
+    # Fields are split, masked and joined in one pass:
+    with measure('mask', bytes=len(data)) as metric:
+        output = masker.feed(data) + masker.finish()
+        metric['rows'] = masker.rows
+    if masker.columns is None:
+        logger.error('Input file is blank.')
+        return
+    if masker.rows == 0:
+        logger.error('Input data file has no content.')
+        return
+    return output
+
+
+# Masks CSV read from a stream, yields CSV bytes as each read is masked:
+def csv_stream_transformation(stream, pii_fields, read_size=READ_SIZE):
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    masker = CSVMasker(strategies)
+    # Output is held back until a row is found, so a file with only a
+    # header gives no output:
+    held = []
+    while True:
+        data = stream.read(read_size)
+        output = masker.feed(data) if data else masker.finish()
+        if output:
+            if masker.rows == 0:
+                held.append(output)
+            else:
+                if held:
+                    output = b''.join(held) + output
+                    held = []
+                yield output
+        if not data:
+            break
+    if masker.columns is None:
+        logger.error('Input file is blank.')
+    elif masker.rows == 0:
+        logger.error('Input data file has no content.')
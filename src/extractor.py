@@ -1,70 +1,218 @@
-import boto3
-import logging
 from botocore.exceptions import ClientError
 import json
-from io import BytesIO
+import os
+import threading
+from src.compression import (get_encoding_codec,
+                             open_decompressed,
+                             split_codec,
+                             strip_codec)
+from src.filesystems import is_s3_url, open_input, read_bytes
+from src.instrumentation import measure, setup_logging
+from src.lazy_imports import lazy_import
+from src.range_reader import get_object_bytes, get_parquet_source
 
-
-# Setting up logging
-def setup_logging():
-    logger = logging.getLogger()
-    # Remove all handlers associated with the root logger:
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-    logger.setLevel(logging.DEBUG)
-    handler = logging.FileHandler('log.txt', mode='w')
-    formatter = logging.Formatter('%(asctime)s - %(name)s\
-                                  - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
+# boto3 is imported when the first client is created:
+boto3 = lazy_import('boto3')
+botocore_config = lazy_import('botocore.config')
 
 
 # EXTRACTION FUNCTIONS
 
+# File extensions that can be obfuscated:
+SUPPORTED_EXTENSIONS = ('.csv', '.json', '.pqt', '.parquet')
+
+
+def is_supported_file(filepath):
+    return filepath.endswith(SUPPORTED_EXTENSIONS)
+
+
+# Newline-delimited JSON can only be read as a stream:
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+
+def is_ndjson_file(filepath):
+    return strip_codec(filepath).endswith(NDJSON_EXTENSIONS)
+
+
+# Compressed CSV, JSON and NDJSON files (such as file1.csv.gz) can only be
+# read as a stream:
+def is_compressed_file(filepath):
+    base_path, codec = split_codec(filepath)
+    return codec is not None and get_stream_format(base_path) is not None
+
+
+# Format of a file from its extension, or None if it is not supported.
+# Compressed files have the format of the extension before the codec's:
+def get_file_format(filepath):
+    if is_parquet_file(filepath):
+        return 'parquet'
+    filepath = strip_codec(filepath)
+    if filepath.endswith('.csv'):
+        return 'csv'
+    if filepath.endswith('.json'):
+        return 'json'
+    if is_ndjson_file(filepath):
+        return 'ndjson'
+    return None
+
+
+# Formats a file can be read as, whatever its extension:
+FILE_FORMATS = ('csv', 'json', 'ndjson', 'parquet')
+
+
+# Format a stream is read as, or None if the file cannot be streamed:
+def get_stream_format(filepath):
+    file_format = get_file_format(filepath)
+    return None if file_format == 'parquet' else file_format
+
+
 # Connect to S3 client:
-def get_client():
-    s3 = boto3.client("s3", region_name="eu-west-2")
-    return s3
+# Clients are cached for the life of the process, keyed by region, endpoint,
+# credentials and connection settings, so warm invocations and batch workers
+# reuse the same connection pool. boto3 clients are safe to share between
+# threads.
+DEFAULT_REGION = 'eu-west-2'
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_MODE = 'adaptive'
 
+_clients = {}
+_clients_lock = threading.Lock()
 
-# Read data from S3 bucket:
-def get_data(client, target_bucket, filepath):
-    response = client.get_object(
-        Bucket=target_bucket,
-        Key=filepath)
+
+# Region from the standard AWS environment variables, else the default:
+def get_region():
+    return (os.environ.get('AWS_REGION') or
+            os.environ.get('AWS_DEFAULT_REGION') or
+            DEFAULT_REGION)
+
+
+def get_client(region_name=None, endpoint_url=None,
+               max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+               max_attempts=DEFAULT_MAX_ATTEMPTS,
+               retry_mode=DEFAULT_RETRY_MODE):
+    if region_name is None:
+        region_name = get_region()
+    if endpoint_url is None:
+        endpoint_url = os.environ.get('AWS_ENDPOINT_URL_S3')
+    # Credentials given through the environment select their own client:
+    key = (region_name, endpoint_url, max_pool_connections, max_attempts,
+           retry_mode, os.environ.get('AWS_PROFILE'),
+           os.environ.get('AWS_ACCESS_KEY_ID'))
+    with _clients_lock:
+        if key not in _clients:
+            config = botocore_config.Config(
+                max_pool_connections=max_pool_connections,
+                retries={'max_attempts': max_attempts, 'mode': retry_mode})
+            session = boto3.session.Session(region_name=region_name)
+            _clients[key] = session.client(
+                "s3", endpoint_url=endpoint_url, config=config)
+        return _clients[key]
+
+
+# Drops cached clients, for example after credentials have changed:
+def clear_client_cache():
+    with _clients_lock:
+        _clients.clear()
+
+
+def is_parquet_file(filepath):
+    return filepath[-4:] == '.pqt' or filepath[-8:] == '.parquet'
+
+
+# Read data from S3 bucket, large objects are read in concurrent ranges.
+# Parquet columns in skip_columns (the PII columns) are not downloaded:
+# With raw, the body is returned as bytes without being parsed:
+def get_data(client, target_bucket, filepath, skip_columns=None, raw=False):
+    if skip_columns is not None and is_parquet_file(filepath):
+        return get_parquet_source(client, target_bucket, filepath,
+                                  skip_columns)
+    with measure('s3_fetch') as metric:
+        body = get_object_bytes(client, target_bucket, filepath)
+        metric['bytes'] = len(body)
+    return decode_body(filepath, body, raw)
+
+
+# Read a local or fsspec file, local files are memory-mapped:
+def get_file_data(url, raw=False):
+    with measure('file_read') as metric:
+        body = read_bytes(url)
+        metric['bytes'] = len(body)
+    return decode_body(url, body, raw)
+
+
+# Parsed contents of a file, unless raw. Parquet is decoded as it is
+# masked:
+def decode_body(filepath, body, raw=False):
+    if raw or is_parquet_file(filepath):
+        return body
+    with measure('decode', bytes=len(body)) as metric:
+        data_body = parse_body(filepath, body)
+        if type(data_body) is list:
+            metric['rows'] = len(data_body)
+    return data_body
+
+
+# Convert the raw file contents to the type used by the transformer:
+def parse_body(filepath, body):
     # Read CSV files:
     if filepath[-4:] == '.csv':
-        data_body = response['Body'].read().decode('utf-8')
+        data_body = str(body, 'utf-8')
     # Read JSON files:
     elif filepath[-5:] == '.json':
-        data_body = json.loads(response['Body'].read())
-    # Read parquet binary format files:
-    elif filepath[-4:] == '.pqt' or filepath[-8:] == '.parquet':
-        buffer = BytesIO(response['Body'].read())
-        data_body = buffer.getvalue()
+        if type(body) is memoryview:
+            body = str(body, 'utf-8')
+        data_body = json.loads(body)
+    # Read parquet binary format files, passed on without a copy:
+    elif is_parquet_file(filepath):
+        data_body = body
+    else:
+        raise ValueError(f"Unsupported file type: {filepath}")
     return data_body
 
 
-def extraction_handler(s3_url):
+# Open S3 object as a stream, without reading the body into memory.
+# Compressed objects, by extension or Content-Encoding, are decompressed as
+# the stream is read:
+def get_stream(client, target_bucket, filepath):
+    response = client.get_object(
+        Bucket=target_bucket,
+        Key=filepath)
+    codec = split_codec(filepath)[1] or \
+        get_encoding_codec(response.get('ContentEncoding'))
+    if codec is not None:
+        return open_decompressed(response['Body'], codec)
+    return response['Body']
+
+
+def extraction_handler(s3_url, skip_columns=None, raw=False):
     logger = setup_logging()
     try:
         if type(s3_url) is str:
+            # Raw bytes, for any format that can be obfuscated. Compressed
+            # files can only be streamed:
+            raw = raw and get_file_format(s3_url) is not None and \
+                not is_compressed_file(s3_url)
+            # If not expected extension, return error:
+            if not raw and not is_supported_file(s3_url):
+                logger.error("File is not csv or json or parquet format.")
+                return
+            # Local paths and other fsspec URLs are read without S3:
+            if not is_s3_url(s3_url):
+                return get_file_data(s3_url, raw=raw)
             # Connect to S3 client:
             client = get_client()
             # Create required information from URL:
             s3_bucket = s3_url.split('/')[2]
             s3_filepath = '/'.join(s3_url.split('/')[3:])
-            # Check file extension is expected, if so, read the data:
-            if (s3_url[-4:] == '.csv' or s3_url[-5:] == '.json' or
-               s3_url[-4:] == '.pqt' or s3_url[-8:] == '.parquet'):
-                data_to_be_transformed = get_data(
-                    client, s3_bucket, s3_filepath)
-                return data_to_be_transformed
-            # If not expected extension, return error:
-            else:
-                logger.error("File is not csv or json or parquet format.")
-                return
+            if raw:
+                return get_data(client, s3_bucket, s3_filepath, skip_columns,
+                                raw=True)
+            if skip_columns is not None:
+                return get_data(client, s3_bucket, s3_filepath, skip_columns)
+            data_to_be_transformed = get_data(
+                client, s3_bucket, s3_filepath)
+            return data_to_be_transformed
         # if file path is not string, return error:
         else:
             logger.error("File path not given correctly.")
@@ -79,7 +227,45 @@ def extraction_handler(s3_url):
         # If the file does not exist:
         if err.response["Error"]["Code"] == "NoSuchKey":
             logger.error("File not found.")
+    # If a local or fsspec file does not exist:
+    except FileNotFoundError:
+        logger.error("File not found.")
     # All other errors:
     except Exception as err:
         logger.error(f"An unexpected error has occurred: {str(err)}")
         return err
+
+
+# Streaming extraction, returns the unread S3 body for chunked processing:
+def stream_extraction_handler(s3_url):
+    logger = setup_logging()
+    try:
+        if type(s3_url) is str:
+            # CSV, JSON and NDJSON files can be streamed:
+            if get_stream_format(s3_url) is not None and \
+                    not is_s3_url(s3_url):
+                return open_input(s3_url)
+            if get_stream_format(s3_url) is not None:
+                client = get_client()
+                s3_bucket = s3_url.split('/')[2]
+                s3_filepath = '/'.join(s3_url.split('/')[3:])
+                return get_stream(client, s3_bucket, s3_filepath)
+            else:
+                logger.error("File is not csv or json format, "
+                             "cannot be streamed.")
+                return
+        else:
+            logger.error("File path not given correctly.")
+            return
+    except ClientError as err:
+        if err.response["Error"]["Code"] == "InternalServiceError":
+            logger.error("Internal service error detected.")
+        if err.response["Error"]["Code"] == "NoSuchBucket":
+            logger.error("Bucket not found.")
+        if err.response["Error"]["Code"] == "NoSuchKey":
+            logger.error("File not found.")
+    except FileNotFoundError:
+        logger.error("File not found.")
+    except Exception as err:
+        logger.error(f"An unexpected error has occurred: {str(err)}")
+        return err
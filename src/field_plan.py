@@ -0,0 +1,154 @@
+import fnmatch
+import functools
+import logging
+import re
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# FIELD PLANS
+# PII fields are matched against the field paths of a file: column names,
+# and for nested JSON objects and parquet structs the names on the path
+# joined with dots. A PII field can be:
+#     "email_address"       the field of that name, as before
+#     "contact.email"       a nested field, by its path
+#     "*email*"             a glob (*, ? and [...]), * matching dots too
+#     "re:^phone_[0-9]+$"   a regular expression, matched against the path
+#     "i:Email_Address"     any of these ignoring case ("i:*email*")
+# A path that a PII field names exactly takes that field's strategy, others
+# take the first pattern that matches. A nested object or struct that is
+# matched is masked whole.
+#
+# The PII fields are compiled once into a matcher, and the plan of a file
+# (the PII field of each matching path) is cached by its list of paths, the
+# fingerprint of its layout. Files and row groups with the same columns
+# reuse the plan without matching again.
+
+# Plans kept, by PII fields and list of paths:
+PLAN_CACHE_SIZE = 256
+# Paths whose match is remembered by each matcher:
+MATCH_CACHE_SIZE = 65536
+REGEX_PREFIX = 're:'
+IGNORE_CASE_PREFIX = 'i:'
+GLOB_CHARACTERS = frozenset('*?[')
+
+
+# Whether a PII field is a pattern rather than a field name:
+def is_pattern(field):
+    return (field.startswith((REGEX_PREFIX, IGNORE_CASE_PREFIX)) or
+            not GLOB_CHARACTERS.isdisjoint(field))
+
+
+# Compiles a pattern to a regular expression matched against whole paths:
+def compile_pattern(field):
+    flags = 0
+    if field.startswith(IGNORE_CASE_PREFIX):
+        field = field[len(IGNORE_CASE_PREFIX):]
+        flags = re.IGNORECASE
+    if field.startswith(REGEX_PREFIX):
+        return re.compile(field[len(REGEX_PREFIX):], flags)
+    if GLOB_CHARACTERS.isdisjoint(field):
+        return re.compile(re.escape(field), flags)
+    return re.compile(fnmatch.translate(field), flags)
+
+
+# The PII field of each matching path, and the PII fields that matched
+# nothing:
+class FieldPlan:
+    def __init__(self, matches, missing):
+        self.matches = matches
+        self.missing = missing
+
+    # If given PII field was not found in data, give error:
+    def log_missing(self):
+        for field in self.missing:
+            logger.error(f'PII field "{field}" not found in file.')
+
+    # Strategy of each matching path, from the strategies of the PII fields:
+    def select(self, strategies):
+        return {path: strategies[field]
+                for path, field in self.matches.items()}
+
+
+class FieldMatcher:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.exact = {}
+        self.patterns = []
+        for field in self.fields:
+            self.exact.setdefault(field, field)
+            if is_pattern(field):
+                self.patterns.append((compile_pattern(field), field))
+        # PII fields given as top-level names only, matched by lookup:
+        self.is_flat = not self.patterns and \
+            not any('.' in field for field in self.fields)
+        # Paths with PII fields named below them:
+        self.__parents = set()
+        for field in self.fields:
+            names = field.split('.')
+            self.__parents.update('.'.join(names[:index])
+                                  for index in range(1, len(names)))
+        self.__matches = {}
+
+    # PII field of a path, or None:
+    def match(self, path):
+        try:
+            return self.__matches[path]
+        except KeyError:
+            pass
+        field = self.exact.get(path)
+        if field is None:
+            for pattern, pattern_field in self.patterns:
+                if pattern.fullmatch(path):
+                    field = pattern_field
+                    break
+        if len(self.__matches) < MATCH_CACHE_SIZE:
+            self.__matches[path] = field
+        return field
+
+    # Whether fields below a path can match, so it is worth searching:
+    def has_nested(self, path):
+        return bool(self.patterns) or path in self.__parents
+
+    def plan(self, paths):
+        return get_plan(self, tuple(paths))
+
+
+# One matcher for each set of PII fields:
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def get_field_matcher(fields):
+    return FieldMatcher(fields)
+
+
+# Matcher of PII fields given as a list or dictionary:
+def get_matcher(pii_fields):
+    return get_field_matcher(tuple(pii_fields))
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def get_plan(matcher, paths):
+    matches = {}
+    for path in paths:
+        field = matcher.match(path)
+        if field is not None:
+            matches[path] = field
+    found = set(matches.values())
+    return FieldPlan(matches, [field for field in matcher.fields
+                               if field not in found])
+
+
+# Plan of the paths of a file, for PII fields given as a list or
+# dictionary:
+def get_field_plan(pii_fields, paths):
+    return get_matcher(pii_fields).plan(paths)
+
+
+# The PII fields of the matching paths, given the same way as pii_fields
+# and named by path, for workers that plan the same file again:
+def select_paths(pii_fields, plan):
+    if isinstance(pii_fields, dict):
+        return {path: pii_fields[field]
+                for path, field in plan.matches.items()}
+    return list(plan.matches)
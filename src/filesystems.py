@@ -0,0 +1,165 @@
+import mmap
+import os
+import tempfile
+from src.compression import open_decompressed, split_codec
+from src.lazy_imports import lazy_import
+
+# fsspec is only imported for URLs other than S3 and local paths:
+fsspec = lazy_import('fsspec')
+
+
+# FILESYSTEMS
+# Sources and destinations other than S3. s3:// URLs keep their own path
+# (concurrent ranged GETs, PII parquet columns left undownloaded and
+# multipart uploads, see extractor and loader). Local paths, plain or
+# file://, are memory-mapped when read whole, so only the pages that are
+# used are read from disk and nothing is copied, and are read and written
+# through large buffers when streamed. Any other fsspec URL (memory://,
+# gcs://, abfs:// and so on, with their packages installed) is read and
+# written through fsspec.
+#
+# Files are read as the S3 objects are: whole, or as a stream decompressed
+# by the codec of the extension (see compression).
+
+S3_PROTOCOLS = ('s3',)
+LOCAL_PROTOCOLS = ('file', 'local')
+# Buffer of local files that are streamed:
+LOCAL_BUFFER_SIZE = 1024 * 1024
+
+
+# Protocol of a URL, paths without one are local:
+def get_protocol(url):
+    if '://' not in url:
+        return 'file'
+    return url.split('://', 1)[0].lower()
+
+
+def is_s3_url(url):
+    return get_protocol(url) in S3_PROTOCOLS
+
+
+def is_local_url(url):
+    return get_protocol(url) in LOCAL_PROTOCOLS
+
+
+# URL without its protocol:
+def strip_protocol(url):
+    return url.split('://', 1)[1] if '://' in url else url
+
+
+# fsspec filesystem of a URL, and the path on it:
+def get_filesystem(url):
+    return fsspec.core.url_to_fs(url)
+
+
+# Local file as a read-only memoryview. Pages are read from disk as they
+# are used:
+def map_file(path):
+    with open(path, 'rb') as local_file:
+        # Empty files cannot be mapped:
+        if os.fstat(local_file.fileno()).st_size == 0:
+            return b''
+        mapped = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+    # Files are mostly read from start to end, so read ahead:
+    if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return memoryview(mapped)
+
+
+# Contents of a file, a memoryview of local files:
+def read_bytes(url):
+    if is_local_url(url):
+        return map_file(strip_protocol(url))
+    filesystem, path = get_filesystem(url)
+    return filesystem.cat_file(path)
+
+
+# Readable stream of a file, decompressed as it is read if the extension
+# names a codec:
+def open_input(url):
+    if is_local_url(url):
+        stream = open(strip_protocol(url), 'rb', buffering=LOCAL_BUFFER_SIZE)
+    else:
+        filesystem, path = get_filesystem(url)
+        stream = filesystem.open(path, 'rb')
+    codec = split_codec(url)[1]
+    if codec is not None:
+        return open_decompressed(stream, codec)
+    return stream
+
+
+# Size and version of a file, for the manifest. Files without an ETag use
+# their modified time:
+def get_file_version(info):
+    version = info.get('ETag') or info.get('mtime') or info.get('created')
+    return {'etag': str(version).strip('"'), 'size': info.get('size')}
+
+
+# Size and version of a file, or None if it cannot be found:
+def head_file(url):
+    filesystem, path = get_filesystem(url)
+    try:
+        return get_file_version(filesystem.info(path))
+    except FileNotFoundError:
+        return None
+
+
+# Files under a directory, with their info (size, modified time and so
+# on), as URLs of the same form as the directory:
+def list_files(url):
+    filesystem, path = get_filesystem(url)
+    path = path.rstrip('/')
+    files = filesystem.find(path, detail=True)
+    return [(url.rstrip('/') + name[len(path):], info)
+            for name, info in sorted(files.items())]
+
+
+# Writes output to a local or fsspec file. Has the write, close and abort
+# methods of MultipartUploader, so it can take its place. Local output is
+# written to a temporary file that replaces the destination when closed,
+# so a failed run never leaves a partial file:
+class FileWriter:
+    def __init__(self, url):
+        self.url = url
+        self.bytes_written = 0
+        self.__temporary_path = None
+        if is_local_url(url):
+            path = os.path.abspath(strip_protocol(url))
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            handle, self.__temporary_path = tempfile.mkstemp(
+                dir=directory, suffix='.tmp')
+            self.__file = os.fdopen(handle, 'wb',
+                                    buffering=LOCAL_BUFFER_SIZE)
+            self.__path = path
+        else:
+            self.__filesystem, self.__path = get_filesystem(url)
+            self.__file = self.__filesystem.open(self.__path, 'wb')
+
+    def write(self, data):
+        written = self.__file.write(data)
+        self.bytes_written += written
+        return written
+
+    def close(self):
+        try:
+            self.__file.close()
+            if self.__temporary_path is not None:
+                os.replace(self.__temporary_path, self.__path)
+                self.__temporary_path = None
+            return {'parts': 0, 'bytes': self.bytes_written}
+        except Exception:
+            self.abort()
+            raise
+
+    # Removes what has been written:
+    def abort(self):
+        if self.__temporary_path is not None:
+            self.__file.close()
+            if os.path.exists(self.__temporary_path):
+                os.remove(self.__temporary_path)
+            self.__temporary_path = None
+        elif not self.__file.closed:
+            self.__file.close()
+            if self.__filesystem.exists(self.__path):
+                self.__filesystem.rm(self.__path)
@@ -0,0 +1,199 @@
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# INSTRUMENTATION
+# Logging is set up once per process: the first handler called opens
+# log.txt, and later calls leave it as it is, so a worker that handles many
+# requests does not reopen the file each time. The file is watched, and
+# opened again if it is moved or deleted (by logrotate, for example).
+# Set OBFUSCATOR_LOG_FORMAT=json for one JSON object per line.
+#
+# Each stage of a request (json_parse, s3_fetch, decode, mask, encode,
+# upload) records its wall time, bytes, rows and the peak RSS of the
+# process so far. Metrics are logged, with the metric attached to the log
+# record, or passed to a callback set with set_metrics_callback. Totals for
+# each stage are kept for the life of the process.
+
+LOG_FILE = 'log.txt'
+LOG_FORMAT_VARIABLE = 'OBFUSCATOR_LOG_FORMAT'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_logging_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_metrics_callback = None
+_stage_totals = {}
+
+
+# Log records as JSON, with the metric of a stage record included:
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'name': record.name,
+                 'level': record.levelname, 'message': record.getMessage()}
+        metric = getattr(record, 'metric', None)
+        if metric is not None:
+            entry['metric'] = metric
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_formatter():
+    if os.environ.get(LOG_FORMAT_VARIABLE, '').lower() == 'json':
+        return JSONFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def is_configured(handler):
+    return getattr(handler, 'obfuscator_handler', False)
+
+
+# Setting up logging, once per process. Handlers set up by others are
+# replaced the first time:
+def setup_logging():
+    root = logging.getLogger()
+    with _logging_lock:
+        if not any(is_configured(handler) for handler in root.handlers):
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            root.setLevel(logging.DEBUG)
+            handler = logging.handlers.WatchedFileHandler(LOG_FILE,
+                                                          mode='w')
+            handler.obfuscator_handler = True
+            handler.setFormatter(get_formatter())
+            root.addHandler(handler)
+    return root
+
+
+# Peak resident set size of the process in MB, None where it is not known:
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux:
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+# Function called with each stage metric (a dictionary) instead of logging
+# it. None logs metrics again:
+def set_metrics_callback(callback):
+    global _metrics_callback
+    _metrics_callback = callback
+
+
+def record_metric(metric):
+    metric['peak_rss_mb'] = peak_rss_mb()
+    with _metrics_lock:
+        totals = _stage_totals.setdefault(metric['stage'], {
+            'count': 0, 'seconds': 0.0, 'bytes': 0, 'rows': 0,
+            'peak_rss_mb': None})
+        totals['count'] += 1
+        totals['seconds'] += metric['seconds']
+        totals['bytes'] += metric['bytes'] or 0
+        totals['rows'] += metric['rows'] or 0
+        totals['peak_rss_mb'] = metric['peak_rss_mb']
+    callback = _metrics_callback
+    if callback is None:
+        logger.info(f"Stage {metric['stage']}: {metric['seconds']:.3f}s, "
+                    f"{metric['bytes']} bytes, {metric['rows']} rows.",
+                    extra={'metric': metric})
+        return
+    try:
+        callback(metric)
+    except Exception as e:
+        logger.error(f'Metrics callback failed: {e}')
+
+
+# Wall time of a stage that may run in several steps, each timed by using
+# the timer as a context manager, and recorded once when done:
+class StageTimer:
+    def __init__(self, stage, **details):
+        self.metric = {'stage': stage, 'seconds': 0.0, 'bytes': None,
+                       'rows': None, **details}
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+        return self.metric
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metric['seconds'] += time.perf_counter() - self.__start
+        return False
+
+    def record(self, **details):
+        self.metric.update(details)
+        record_metric(self.metric)
+
+
+# Times one step as a stage. The metric is yielded so bytes and rows can
+# be set once they are known:
+@contextmanager
+def measure(stage, **details):
+    timer = StageTimer(stage, **details)
+    try:
+        with timer as metric:
+            yield metric
+    except Exception as e:
+        timer.record(error=type(e).__name__)
+        raise
+    timer.record()
+
+
+# Passes chunks of bytes through, timing the work of producing them. For
+# output of one row a line, rows are counted as the lines after
+# header_lines:
+def measure_stream(stage, chunks, header_lines=None, **details):
+    timer = StageTimer(stage, **details)
+    size = 0
+    lines = 0
+    iterator = iter(chunks)
+    try:
+        while True:
+            with timer:
+                chunk = next(iterator, None)
+            if chunk is None:
+                break
+            size += len(chunk)
+            if header_lines is not None:
+                lines += chunk.count(b'\n')
+            yield chunk
+    finally:
+        if header_lines is None:
+            timer.record(bytes=size)
+        else:
+            timer.record(bytes=size, rows=max(lines - header_lines, 0))
+
+
+# Totals for each stage since the process started (or was reset):
+def get_stage_totals():
+    with _metrics_lock:
+        return {stage: dict(totals) for stage, totals in
+                _stage_totals.items()}
+
+
+def reset_stage_totals():
+    with _metrics_lock:
+        _stage_totals.clear()
+
+
+def log_stage_totals():
+    for stage, totals in get_stage_totals().items():
+        logger.info(f"Stage {stage} total: {totals['seconds']:.3f}s over "
+                    f"{totals['count']} runs, {totals['bytes']} bytes, "
+                    f"{totals['rows']} rows.")
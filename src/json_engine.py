@@ -0,0 +1,278 @@
+import codecs
+import json
+import logging
+from src.field_plan import get_matcher
+from src.masking import get_strategies
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# JSON ENGINE
+# Streams JSON records from a file-like object, masks the PII keys of each
+# record in place and writes the records back out as they are read. Both a
+# top-level JSON array and newline-delimited JSON (NDJSON) are supported.
+# No DataFrame is built, and only one read of input and one batch of output
+# are held in memory at a time.
+
+READ_SIZE = 64 * 1024
+# Output is yielded in batches of about this many characters:
+OUTPUT_BATCH_SIZE = 1024 * 1024
+# Records masked together, so each distinct value in them is transformed
+# once:
+RECORD_BATCH_SIZE = 1024
+
+_whitespace = ' \t\n\r'
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+# Yields the records of a top-level JSON array, reading as it goes. The
+# array is checked as json.loads would: records are separated by exactly
+# one comma, and only whitespace may follow the closing bracket:
+def iter_json_array(stream, read_size=READ_SIZE):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    finished = False
+    # What may come next: the opening bracket, the first record (or the
+    # closing bracket), a comma (or the closing bracket), a record after a
+    # comma, or nothing once the array is closed:
+    expected = 'open'
+
+    def read_more():
+        nonlocal buffer, position, finished
+        chunk = stream.read(read_size)
+        if not chunk:
+            finished = True
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+    while True:
+        while position < len(buffer) and buffer[position] in _whitespace:
+            position += 1
+        if position >= len(buffer):
+            if finished:
+                if expected == 'closed':
+                    return
+                if expected != 'open':
+                    raise JSONStreamError('JSON array is not closed.')
+                raise JSONStreamError('Input file is blank.')
+            read_more()
+            continue
+        character = buffer[position]
+        if expected == 'closed':
+            raise JSONStreamError('JSON array is followed by other data.')
+        if expected == 'open':
+            if character != '[':
+                raise JSONStreamError('JSON is not a list of records.')
+            expected = 'first'
+            position += 1
+            continue
+        if character == ']':
+            if expected == 'record':
+                raise JSONStreamError('JSON array has a trailing comma.')
+            expected = 'closed'
+            position += 1
+            continue
+        if expected == 'comma':
+            if character != ',':
+                raise JSONStreamError('JSON records are not separated by a '
+                                      'comma.')
+            expected = 'record'
+            position += 1
+            continue
+        if character == ',':
+            raise JSONStreamError('JSON array has a missing record.')
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if finished:
+                raise
+            read_more()
+            continue
+        # A value at the very end of the buffer may be cut short:
+        if end >= len(buffer) and not finished:
+            read_more()
+            continue
+        position = end
+        expected = 'comma'
+        yield record
+
+
+# Yields the records of newline-delimited JSON, one per non-blank line:
+def iter_ndjson(stream, read_size=READ_SIZE):
+    remainder = b''
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if remainder.strip():
+        yield json.loads(remainder)
+
+
+# Finds the PII values of a JSON value, under objects and arrays, adding
+# the object and key holding each to places by path. Objects and arrays
+# searched are copied first if copy is set:
+def find_pii_values(value, path, matcher, places, copy=False):
+    if isinstance(value, dict):
+        if copy:
+            value = dict(value)
+        for key, item in value.items():
+            item_path = f'{path}.{key}' if path else key
+            field = matcher.match(item_path)
+            if field is not None:
+                places.setdefault(item_path, (field, []))[1].append(
+                    (value, key))
+            elif isinstance(item, (dict, list)) and \
+                    matcher.has_nested(item_path):
+                value[key] = find_pii_values(item, item_path, matcher,
+                                             places, copy)
+    elif isinstance(value, list):
+        if copy:
+            value = list(value)
+        for index, item in enumerate(value):
+            if isinstance(item, (dict, list)):
+                value[index] = find_pii_values(item, path, matcher, places,
+                                               copy)
+    return value
+
+
+# Replaces the PII values of records in place, a field at a time, or of
+# copies of them if copy is set. Takes the strategies from get_strategies.
+# Nested and pattern PII fields are found by searching each record (see
+# field_plan):
+def mask_records(records, strategies, copy=False):
+    matcher = get_matcher(strategies)
+    if not matcher.is_flat:
+        places = {}
+        records = find_pii_values(records, '', matcher, places, copy)
+        for field, holders in places.values():
+            values = strategies[field].apply_values(
+                [holder[key] for holder, key in holders])
+            for (holder, key), value in zip(holders, values):
+                holder[key] = value
+        return records
+    if copy:
+        records = [dict(record) if isinstance(record, dict) else record
+                   for record in records]
+    for field, strategy in strategies.items():
+        holders = [record for record in records
+                   if isinstance(record, dict) and field in record]
+        if holders:
+            values = strategy.apply_values([record[field]
+                                            for record in holders])
+            for record, value in zip(holders, values):
+                record[field] = value
+    return records
+
+
+# Replaces the PII values of a record, in place:
+def mask_record(record, pii_fields):
+    mask_records([record], get_strategies(pii_fields))
+    return record
+
+
+# Paths of the fields of a record that PII fields can match. Only the
+# top-level keys for PII fields given as top-level names:
+def get_record_paths(record, matcher, path=''):
+    if isinstance(record, list):
+        return [item_path for item in record
+                for item_path in get_record_paths(item, matcher, path)]
+    if not isinstance(record, dict):
+        return []
+    if matcher.is_flat:
+        return list(record)
+    paths = []
+    for key, item in record.items():
+        item_path = f'{path}.{key}' if path else key
+        paths.append(item_path)
+        if isinstance(item, (dict, list)) and \
+                matcher.has_nested(item_path) and \
+                matcher.match(item_path) is None:
+            paths += get_record_paths(item, matcher, item_path)
+    return paths
+
+
+def check_pii_fields(record, pii_fields):
+    matcher = get_matcher(pii_fields)
+    paths = get_record_paths(record, matcher) \
+        if isinstance(record, dict) else []
+    matcher.plan(dict.fromkeys(paths)).log_missing()
+
+
+# Appends records to the output as JSON, with a separator before each one
+# unless it is the first of the file. Returns the characters added:
+def write_records(output, records, separator, first):
+    size = 0
+    for record in records:
+        if not first:
+            output.append(separator)
+        first = False
+        record_json = json.dumps(record)
+        output.append(record_json)
+        size += len(record_json)
+    return size
+
+
+# Reads, masks and writes records, yielding the output as bytes:
+def json_stream_transformation(stream, pii_fields, ndjson=False,
+                               batch_size=OUTPUT_BATCH_SIZE,
+                               record_batch_size=RECORD_BATCH_SIZE):
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    if ndjson:
+        records = iter_ndjson(stream)
+        opening, separator, closing = '', '\n', '\n'
+    else:
+        records = iter_json_array(stream)
+        opening, separator, closing = '[', ', ', ']'
+    output = [opening]
+    output_size = 0
+    count = 0
+    batch = []
+    yielded = False
+    try:
+        for record in records:
+            if count == 0:
+                check_pii_fields(record, pii_fields)
+            batch.append(record)
+            count += 1
+            if len(batch) < record_batch_size:
+                continue
+            output_size += write_records(
+                output, mask_records(batch, strategies), separator,
+                count == len(batch))
+            batch = []
+            if output_size >= batch_size:
+                yield ''.join(output).encode('utf-8')
+                yielded = True
+                output = []
+                output_size = 0
+    except (JSONStreamError, json.JSONDecodeError) as err:
+        if isinstance(err, json.JSONDecodeError):
+            err = 'Input file is not valid JSON.'
+        logger.error(str(err))
+        # Output already sent on must not be left looking complete:
+        if yielded:
+            raise
+        return
+    if count == 0:
+        logger.error('Input data file has no content.')
+        return
+    write_records(output, mask_records(batch, strategies), separator,
+                  count == len(batch))
+    output.append(closing)
+    yield ''.join(output).encode('utf-8')
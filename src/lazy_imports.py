@@ -0,0 +1,64 @@
+import importlib
+import sys
+import threading
+import types
+
+
+# LAZY IMPORTS
+# pandas, numpy, pyarrow and boto3 take most of the start-up time of a cold
+# process (a Lambda cold start, for example), but each file format only
+# needs some of them. Modules are imported as lazy modules instead, which
+# import the real module the first time one of their attributes is used:
+#     pa = lazy_import('pyarrow')
+# so a CSV file never loads pyarrow or pandas.
+
+_import_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_LazyModule__module'] = None
+
+    def load(self):
+        module = self.__module
+        if module is None:
+            with _import_lock:
+                module = self.__module
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    # Attributes are copied so later lookups are as fast as
+                    # on the real module, any set since are kept:
+                    attributes = dict(module.__dict__)
+                    attributes.update(
+                        (name, value) for name, value in self.__dict__.items()
+                        if name not in ('__name__', '__doc__', '__spec__',
+                                        '__loader__', '__package__'))
+                    self.__dict__.update(attributes)
+                    self.__dict__['_LazyModule__module'] = module
+        return module
+
+    # Only called for attributes not found, the first time and for any
+    # attribute added to the real module after it was loaded:
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __dir__(self):
+        return dir(self.load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__module is not None else 'not loaded'
+        return f'<lazy module {self.__name__!r} ({state})>'
+
+
+# The module if it has already been imported, otherwise a lazy module:
+def lazy_import(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+# Whether a module has been imported, by a lazy module or otherwise:
+def is_loaded(name):
+    return name in sys.modules
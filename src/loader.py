@@ -0,0 +1,191 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.compression import get_compressor, get_output_codec
+from src.extractor import get_client
+from src.filesystems import FileWriter, is_s3_url
+from src.instrumentation import StageTimer
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# LOADING FUNCTIONS
+# Obfuscated output is written to S3 with a multipart upload. Parts are
+# uploaded by a thread pool while the next part is still being produced,
+# and at most max_concurrency + 1 parts are held in memory at a time.
+
+# S3 parts must be at least 5 MiB, except for the last one:
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+# Splits an S3 URL into bucket and key:
+def split_s3_url(s3_url):
+    s3_bucket = s3_url.split('/')[2]
+    s3_filepath = '/'.join(s3_url.split('/')[3:])
+    return s3_bucket, s3_filepath
+
+
+class MultipartUploader:
+    def __init__(self, client, bucket, key,
+                 part_size=DEFAULT_PART_SIZE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(
+                f'Part size must be at least {MIN_PART_SIZE} bytes.')
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.bytes_written = 0
+        self.__buffer = bytearray()
+        self.__futures = []
+        self.__upload_id = None
+        self.__executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # Bounds the parts waiting for, or in, an upload thread:
+        self.__slots = threading.BoundedSemaphore(max_concurrency + 1)
+
+    # Takes any bytes-like data. Parts are sliced from it directly, only
+    # the remainder that does not fill a part is buffered:
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        self.bytes_written += len(view)
+        offset = 0
+        if self.__buffer:
+            offset = min(self.part_size - len(self.__buffer), len(view))
+            self.__buffer += view[:offset]
+            if len(self.__buffer) == self.part_size:
+                self.__submit_part(bytes(self.__buffer))
+                self.__buffer.clear()
+        while len(view) - offset >= self.part_size:
+            self.__submit_part(bytes(view[offset:offset + self.part_size]))
+            offset += self.part_size
+        self.__buffer += view[offset:]
+        return len(view)
+
+    def __submit_part(self, part):
+        if self.__upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key)
+            self.__upload_id = response['UploadId']
+        # Stop early if an earlier part has already failed:
+        for future in self.__futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        part_number = len(self.__futures) + 1
+        self.__slots.acquire()
+        future = self.__executor.submit(self.__upload_part, part_number, part)
+        self.__futures.append(future)
+
+    def __upload_part(self, part_number, part):
+        try:
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=self.key, PartNumber=part_number,
+                UploadId=self.__upload_id, Body=part)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self.__slots.release()
+
+    # Uploads what is left and completes the upload:
+    def close(self):
+        try:
+            # Small outputs never start a multipart upload:
+            if self.__upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key,
+                                       Body=bytes(self.__buffer))
+                self.__buffer.clear()
+                return {'parts': 0, 'bytes': self.bytes_written}
+            if self.__buffer:
+                self.__submit_part(bytes(self.__buffer))
+                self.__buffer.clear()
+            parts = [future.result() for future in self.__futures]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key,
+                UploadId=self.__upload_id,
+                MultipartUpload={'Parts': parts})
+            return {'parts': len(parts), 'bytes': self.bytes_written}
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.__executor.shutdown(wait=True)
+
+    # Abandons the upload so S3 does not keep the uploaded parts:
+    def abort(self):
+        for future in self.__futures:
+            future.cancel()
+        self.__executor.shutdown(wait=True)
+        if self.__upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.__upload_id)
+            self.__upload_id = None
+
+
+# Obfuscated output as chunks of bytes, whatever form it was returned in:
+def iter_output_chunks(anonymised_data):
+    if type(anonymised_data) in (bytes, bytearray, memoryview):
+        yield anonymised_data
+    elif type(anonymised_data) is list:
+        yield json.dumps(anonymised_data).encode('utf-8')
+    else:
+        for chunk in anonymised_data:
+            yield chunk
+
+
+# Output is compressed as it is uploaded with the codec of the destination's
+# extension (such as .csv.gz), or with compression ("none" for none) and
+# compression_level if given (see compression). Destinations that are not
+# S3 URLs, local paths or other fsspec URLs, are written to as files:
+def upload_handler(anonymised_data, s3_url, client=None,
+                   part_size=DEFAULT_PART_SIZE,
+                   max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                   compression=None, compression_level=None):
+    codec = get_output_codec(s3_url, compression)
+    compressor = None if codec is None else \
+        get_compressor(codec, compression_level)
+    if is_s3_url(s3_url):
+        if client is None:
+            client = get_client()
+        s3_bucket, s3_filepath = split_s3_url(s3_url)
+        uploader = MultipartUploader(client, s3_bucket, s3_filepath,
+                                     part_size=part_size,
+                                     max_concurrency=max_concurrency)
+    else:
+        uploader = FileWriter(s3_url)
+    # Only writes (and compression) are timed, streamed output is timed as
+    # it is masked:
+    timer = StageTimer('upload')
+    output_bytes = 0
+    try:
+        for chunk in iter_output_chunks(anonymised_data):
+            output_bytes += len(chunk)
+            with timer:
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                uploader.write(chunk)
+        if output_bytes and compressor is not None:
+            with timer:
+                uploader.write(compressor.flush())
+    except Exception:
+        uploader.abort()
+        raise
+    # Nothing is uploaded if the transformation gave no output:
+    if output_bytes == 0:
+        uploader.abort()
+        logger.error(f'No obfuscated output to upload to {s3_url}.')
+        return
+    with timer:
+        result = uploader.close()
+    timer.record(bytes=result['bytes'])
+    if codec is not None:
+        result['compression'] = codec
+        result['uncompressed_bytes'] = output_bytes
+        logger.info(f'Uploaded {result["bytes"]} bytes ({output_bytes} '
+                    f'before {codec}) to {s3_url}.')
+    else:
+        logger.info(f'Uploaded {result["bytes"]} bytes to {s3_url}.')
+    return result
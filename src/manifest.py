@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from src.filesystems import head_file, is_s3_url
+from src.loader import split_s3_url
+from src.masking import DEFAULT_STRATEGY, get_strategies, parse_strategy
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# MANIFEST
+# Records what each source file was obfuscated from and to, so a batch run
+# can skip files that have not changed since the last run. An entry holds
+# the source's ETag and size, a hash of the masking configuration and the
+# output location. A file is obfuscated again if any of them differ: the
+# source was replaced, the PII fields, a strategy or its key changed (the
+# hash includes each strategy's cache namespace, which follows its key), the
+# output compression, compression level or input format changed, or the
+# output is to go somewhere else.
+#
+# ETags and sizes come from the listing of a prefix, or from HeadObject for
+# a list of URLs, so unchanged files cost no download. The manifest is a
+# JSON file, local or in S3, written once the run is finished.
+
+MANIFEST_VERSION = 1
+# HeadObject requests made at once for a list of URLs:
+HEAD_CONCURRENCY = 32
+
+
+# Hash of the PII fields and their strategies, and of the options that
+# change the output (compression, compression_level and input_format).
+# Options that are not set are left out, so hashes of runs without them
+# stay the same:
+def get_config_hash(pii_fields, **options):
+    if not isinstance(pii_fields, dict):
+        pii_fields = dict.fromkeys(pii_fields, DEFAULT_STRATEGY)
+    strategies = get_strategies(pii_fields) or {}
+    config = {'version': MANIFEST_VERSION, 'pii_fields': {
+        field: [parse_strategy(spec),
+                strategies[field].get_namespace()
+                if field in strategies else None]
+        for field, spec in pii_fields.items()}}
+    config.update({name: value for name, value in options.items()
+                   if value is not None})
+    text = json.dumps(config, sort_keys=True,
+                      default=lambda value: type(value).__name__)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+# ETag and size of a listed or head object:
+def get_version(item):
+    return {'etag': item['ETag'].strip('"'),
+            'size': item.get('Size', item.get('ContentLength'))}
+
+
+# ETag and size of each S3 URL, None for objects that cannot be read.
+# Local and fsspec files have their modified time in place of an ETag:
+def head_sources(client, s3_urls):
+    def head(s3_url):
+        if not is_s3_url(s3_url):
+            return head_file(s3_url)
+        s3_bucket, s3_filepath = split_s3_url(s3_url)
+        try:
+            return get_version(client.head_object(Bucket=s3_bucket,
+                                                  Key=s3_filepath))
+        except ClientError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=HEAD_CONCURRENCY) as executor:
+        return dict(zip(s3_urls, executor.map(head, s3_urls)))
+
+
+class Manifest:
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = entries or {}
+
+    def is_unchanged(self, s3_url, version, config_hash, destination_url):
+        entry = self.entries.get(s3_url)
+        return (entry is not None and version is not None and
+                entry['etag'] == version['etag'] and
+                entry['size'] == version['size'] and
+                entry['config'] == config_hash and
+                entry['destination'] == destination_url)
+
+    def record(self, s3_url, version, config_hash, destination_url):
+        if version is None:
+            return
+        self.entries[s3_url] = {**version, 'config': config_hash,
+                                'destination': destination_url}
+
+    def to_json(self):
+        return json.dumps({'version': MANIFEST_VERSION,
+                           'entries': self.entries})
+
+
+# Loads the manifest from a local path or an S3 URL. A manifest that does
+# not exist is empty. One that cannot be read gives error and is empty, so
+# every file is obfuscated again:
+def load_manifest(path, client):
+    try:
+        if path.startswith('s3://'):
+            s3_bucket, s3_filepath = split_s3_url(path)
+            body = client.get_object(Bucket=s3_bucket,
+                                     Key=s3_filepath)['Body'].read()
+        elif os.path.exists(path):
+            with open(path, 'rb') as manifest_file:
+                body = manifest_file.read()
+        else:
+            return Manifest(path)
+        saved = json.loads(body)
+        if saved.get('version') != MANIFEST_VERSION:
+            raise ValueError('unknown version')
+        return Manifest(path, saved['entries'])
+    except ClientError as err:
+        if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return Manifest(path)
+        logger.error(f'Manifest {path} could not be loaded: {err}')
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        logger.error(f'Manifest {path} could not be loaded: {e}')
+    return Manifest(path)
+
+
+# Saves the manifest. A local file is replaced in one step, so a run that
+# fails part way leaves the last complete manifest:
+def save_manifest(manifest, client):
+    body = manifest.to_json()
+    path = manifest.path
+    temporary_path = None
+    try:
+        if path.startswith('s3://'):
+            s3_bucket, s3_filepath = split_s3_url(path)
+            client.put_object(Bucket=s3_bucket, Key=s3_filepath,
+                              Body=body.encode('utf-8'))
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            handle, temporary_path = tempfile.mkstemp(dir=directory,
+                                                      suffix='.tmp')
+            with os.fdopen(handle, 'w', encoding='utf-8') as manifest_file:
+                manifest_file.write(body)
+            os.replace(temporary_path, path)
+    except (OSError, ClientError) as e:
+        logger.error(f'Manifest {path} could not be saved: {e}')
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return
+    logger.info(f'Saved manifest of {len(manifest.entries)} files to '
+                f'{path}.')
+    return path
@@ -0,0 +1,390 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import struct
+from src.cache import TokenCache, get_token_cache
+from src.field_plan import get_field_plan
+from src.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# MASKING FUNCTIONS
+# PII values are replaced with a single shared constant, so no Python
+# object is created per row and non-PII columns are never copied.
+#
+# PII fields can be given as a list, masked with '***', or as a dictionary
+# of field name to masking strategy, for example
+# {"name": "mask", "email_address": "hmac"}. A strategy is a name, or a
+# dictionary with the name under "strategy" and its options, for example
+# {"strategy": "hash", "length": 8}. Strategies that depend on the value
+# work on whole columns: each distinct value is transformed once, and the
+# result is kept in a token cache shared by every strategy with the same
+# options (see cache).
+
+MASK = '***'
+
+# Environment variable holding the key of the hmac strategy:
+HMAC_KEY_VARIABLE = 'OBFUSCATOR_HMAC_KEY'
+
+
+# Dictionary-encoded constant column: one category and a code per row:
+def constant_categorical(length, mask=MASK):
+    codes = np.zeros(length, dtype=np.int8)
+    return pd.Categorical.from_codes(codes, categories=[mask])
+
+
+# Constant pyarrow string array, built in C++ without Python objects. The
+# mask is put in an array from its bytes, as converting a Python string
+# makes pyarrow import pandas:
+def constant_array(length, mask=MASK):
+    data = mask.encode('utf-8')
+    value = pa.StringArray.from_buffers(
+        1, pa.py_buffer(struct.pack('<ii', 0, len(data))),
+        pa.py_buffer(data))
+    return pa.repeat(value[0], length)
+
+
+# Text of a value, for strategies that work on strings:
+def to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+# Column as a pyarrow string array, types that cannot be cast (such as
+# structs and lists) are converted value by value:
+def to_string_array(array):
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_string(array.type):
+        return array
+    try:
+        return array.cast(pa.string())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return pa.array([to_text(value) for value in array.to_pylist()],
+                        type=pa.string())
+
+
+# Masking strategy, the same for every value. Subclasses that depend on the
+# value set is_constant to False and define transform_value:
+class Strategy:
+    is_constant = True
+    # Whether the output can hold nulls where the input did not:
+    nullable = False
+
+    def __init__(self, value=MASK):
+        self.value = value
+        self.__cache = None
+
+    # Name of the shared token cache of this strategy and its options, or
+    # None for a cache of its own:
+    def get_namespace(self):
+        return None
+
+    @property
+    def cache(self):
+        if self.__cache is None:
+            namespace = self.get_namespace()
+            self.__cache = TokenCache() if namespace is None else \
+                get_token_cache(namespace)
+        return self.__cache
+
+    # Transforms one string:
+    def transform_value(self, value):
+        return self.value
+
+    # Transforms a list of distinct strings, strategies can do this in a
+    # tighter loop than one call per value:
+    def transform_batch(self, values):
+        return [self.transform_value(value) for value in values]
+
+    # Transforms a list of strings (or None), each distinct value once.
+    # Nulls stay null unless the strategy is constant:
+    def transform(self, values, distinct=False):
+        if self.is_constant:
+            return [self.value] * len(values)
+        tokens, missing = self.cache.lookup(
+            [value for value in (values if distinct else set(values))
+             if value is not None])
+        if missing:
+            new_tokens = self.transform_batch(missing)
+            self.cache.store(missing, new_tokens)
+            tokens.update(zip(missing, new_tokens))
+        return [None if value is None else tokens[value] for value in values]
+
+    # Constant column of this strategy's value:
+    def repeat(self, length):
+        if self.value is None:
+            return pa.nulls(length, type=pa.string())
+        return constant_array(length, self.value)
+
+    # Masks a pyarrow column. Distinct values are transformed once and
+    # spread back over the column by index, in C++:
+    def apply_array(self, array):
+        if self.is_constant:
+            return self.repeat(len(array))
+        encoded = pc.dictionary_encode(to_string_array(array))
+        dictionary = pa.array(
+            self.transform(encoded.dictionary.to_pylist(), distinct=True),
+            type=pa.string())
+        return pc.take(dictionary, encoded.indices)
+
+    # Masks a pandas column. Distinct values are transformed once and
+    # spread back over the column by their codes:
+    def apply_series(self, series):
+        if self.is_constant and self.value is not None:
+            return constant_categorical(len(series), self.value)
+        if self.is_constant:
+            return pd.Series(None, index=series.index, dtype=object)
+        codes, uniques = pd.factorize(series)
+        # Missing values have code -1, and pick the None at the end:
+        results = np.array(self.transform(
+            [to_text(value) for value in uniques], distinct=True) + [None],
+            dtype=object)
+        return pd.Series(results[codes], index=series.index, dtype=object)
+
+    # Masks a list of JSON values:
+    def apply_values(self, values):
+        if self.is_constant:
+            return [self.value] * len(values)
+        return self.transform([to_text(value) for value in values])
+
+
+class MaskStrategy(Strategy):
+    def __init__(self, mask=MASK):
+        super().__init__(mask)
+
+
+class NullStrategy(Strategy):
+    nullable = True
+
+    def __init__(self):
+        super().__init__(None)
+
+
+# Keyed HMAC-SHA256 as hex, the same value always gives the same pseudonym,
+# so masked columns can still be joined:
+class HMACStrategy(Strategy):
+    is_constant = False
+
+    def __init__(self, key=None, length=64):
+        super().__init__(None)
+        key = key if key is not None else os.environ.get(HMAC_KEY_VARIABLE)
+        if not key:
+            raise ValueError(f'HMAC key not set in {HMAC_KEY_VARIABLE}.')
+        self.length = int(length)
+        # The key is set up once, and copied for each value:
+        self.__hmac = hmac.new(key.encode('utf-8'), digestmod='sha256')
+
+    def transform_batch(self, values):
+        keyed, length = self.__hmac, self.length
+        results = []
+        for value in values:
+            mac = keyed.copy()
+            mac.update(value.encode('utf-8'))
+            results.append(mac.hexdigest()[:length])
+        return results
+
+    def transform_value(self, value):
+        return self.transform_batch([value])[0]
+
+    # Named by an HMAC of a fixed string, so the key is not given away:
+    def get_namespace(self):
+        mac = self.__hmac.copy()
+        mac.update(b'token cache')
+        return f'hmac-{mac.hexdigest()[:16]}-{self.length}'
+
+
+# SHA-256 as hex, truncated. Unkeyed, so short or guessable values can be
+# found by hashing candidates; hmac should be used for those:
+class HashStrategy(Strategy):
+    is_constant = False
+
+    def __init__(self, length=16):
+        super().__init__(None)
+        self.length = int(length)
+
+    def transform_batch(self, values):
+        sha256, length = hashlib.sha256, self.length
+        return [sha256(value.encode('utf-8')).hexdigest()[:length]
+                for value in values]
+
+    def transform_value(self, value):
+        return self.transform_batch([value])[0]
+
+    def get_namespace(self):
+        return f'hash-{self.length}'
+
+
+# Email addresses keep their domain, 'j.smith@email.com' -> '***@email.com':
+class EmailStrategy(Strategy):
+    is_constant = False
+
+    def __init__(self, mask=MASK):
+        super().__init__(None)
+        self.mask = mask
+
+    def transform_value(self, value):
+        _, at, domain = value.rpartition('@')
+        return self.mask + at + domain if at else self.mask
+
+    def get_namespace(self):
+        return f'email-{self.mask}'
+
+
+# Masks the PII fields inside a struct, and keeps the rest of it. Takes the
+# strategy of each nested field by the names on its path below the struct.
+# A field with its own strategy is masked whole, even if fields below it
+# have strategies too:
+class NestedStrategy(Strategy):
+    is_constant = False
+
+    def __init__(self, fields):
+        super().__init__(None)
+        self.fields = {}
+        nested = {}
+        for names, strategy in fields.items():
+            if len(names) == 1:
+                self.fields[names[0]] = strategy
+            else:
+                nested.setdefault(names[0], {})[names[1:]] = strategy
+        for name, nested_fields in nested.items():
+            self.fields.setdefault(name, NestedStrategy(nested_fields))
+
+    # Struct type with the PII fields masked:
+    def mask_type(self, struct_type):
+        return pa.struct([get_masked_field(field, self.fields[field.name])
+                          if field.name in self.fields else field
+                          for field in struct_type])
+
+    # Masks a struct column, chunk by chunk. Nulls of the struct are kept:
+    def apply_array(self, array):
+        masked_type = self.mask_type(array.type)
+        if isinstance(array, pa.ChunkedArray):
+            return pa.chunked_array([self.apply_array(chunk)
+                                     for chunk in array.chunks],
+                                    type=masked_type)
+        children = array.flatten()
+        for index, field in enumerate(array.type):
+            if field.name in self.fields:
+                children[index] = self.fields[field.name].apply_array(
+                    children[index])
+        return pa.StructArray.from_arrays(
+            children, fields=list(masked_type),
+            mask=array.is_null() if array.null_count else None)
+
+
+# Field of the masked schema for a PII field, a string unless it is a
+# struct with PII fields inside it:
+def get_masked_field(field, strategy):
+    if isinstance(strategy, NestedStrategy):
+        return field.with_type(strategy.mask_type(field.type))
+    return pa.field(field.name, pa.string(),
+                    field.nullable or strategy.nullable, field.metadata)
+
+
+# Masked pyarrow column of a PII field. The table of read columns is only
+# needed by strategies that depend on the value:
+def mask_column(strategy, columns, name, length):
+    if strategy.is_constant:
+        return strategy.repeat(length)
+    return strategy.apply_array(columns.column(name))
+
+
+# Masking strategies by the name used in the input JSON:
+STRATEGIES = {
+    'mask': MaskStrategy,
+    'null': NullStrategy,
+    'hmac': HMACStrategy,
+    'hash': HashStrategy,
+    'email': EmailStrategy,
+}
+
+DEFAULT_STRATEGY = 'mask'
+
+
+def register_strategy(name, strategy_class):
+    STRATEGIES[name] = strategy_class
+
+
+# Name and options of a strategy given in the input JSON:
+def parse_strategy(spec):
+    if isinstance(spec, dict):
+        options = dict(spec)
+        return options.pop('strategy', DEFAULT_STRATEGY), options
+    return spec, {}
+
+
+# Builds a strategy from its name or dictionary, or gives error and None:
+def get_strategy(field, spec):
+    if isinstance(spec, Strategy):
+        return spec
+    name, options = parse_strategy(spec)
+    if name not in STRATEGIES:
+        logger.error(f'Masking strategy "{name}" for PII field "{field}" '
+                     f'not recognised.')
+        return
+    try:
+        return STRATEGIES[name](**options)
+    except (TypeError, ValueError) as e:
+        logger.error(f'Masking strategy "{name}" for PII field "{field}" '
+                     f'could not be used: {e}')
+
+
+# Strategy of each PII field, for one run so repeated values are
+# transformed once. Gives None if any strategy cannot be used:
+def get_strategies(pii_fields):
+    if not isinstance(pii_fields, dict):
+        pii_fields = dict.fromkeys(pii_fields, DEFAULT_STRATEGY)
+    strategies = {}
+    for field, spec in pii_fields.items():
+        strategy = get_strategy(field, spec)
+        if strategy is None:
+            return
+        strategies[field] = strategy
+    return strategies
+
+
+# PII fields whose strategy does not depend on the value, so parquet
+# columns of them need not be downloaded:
+def get_constant_fields(pii_fields):
+    if not isinstance(pii_fields, dict):
+        return list(pii_fields)
+    constant_fields = []
+    for field, spec in pii_fields.items():
+        if isinstance(spec, Strategy):
+            strategy_class = type(spec)
+        else:
+            strategy_class = STRATEGIES.get(parse_strategy(spec)[0])
+        if strategy_class is not None and strategy_class.is_constant:
+            constant_fields.append(field)
+    return constant_fields
+
+
+# Shallow copy of the dataframe with the PII columns replaced:
+def mask_dataframe(df, pii_fields):
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    df_anonymised = df.copy(deep=False)
+    plan = get_field_plan(strategies, [str(column)
+                                       for column in df_anonymised.columns])
+    for column in df_anonymised.columns:
+        if str(column) in plan.matches:
+            df_anonymised[column] = strategies[
+                plan.matches[str(column)]].apply_series(df_anonymised[column])
+    return df_anonymised
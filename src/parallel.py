@@ -0,0 +1,329 @@
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from src.csv_engine import CSVMasker, get_field_name, split_fields
+from src.json_engine import (check_pii_fields,
+                             iter_ndjson,
+                             json_stream_transformation,
+                             mask_records)
+from src.field_plan import get_field_plan, select_paths
+from src.masking import NestedStrategy, get_strategies
+from src.parquet_copy import copy_parquet_columns
+from src.parquet_footer import FooterError
+from src.parquet_engine import (get_column_compression,
+                                get_parquet_file,
+                                get_pii_columns,
+                                get_masked_schema,
+                                mask_row_group,
+                                match_pii_columns,
+                                write_row_groups)
+from src.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# PARALLEL FUNCTIONS
+# Obfuscates one large file on all cores. The input is split into
+# partitions that can be masked on their own: CSV at record boundaries
+# (outside quoted fields), NDJSON at line ends and parquet by row group.
+# Partitions are masked in a process pool and the results are put back
+# together in order, with the CSV header or parquet schema written once.
+# Where processes are forked, workers read the input from the memory they
+# inherit, and only offsets are sent to them.
+
+# Bytes of input in each partition:
+DEFAULT_PARTITION_SIZE = 64 * 1024 * 1024
+# Bytes searched at a time for the end of a partition:
+SEARCH_SIZE = 64 * 1024
+
+# Inputs shared with forked workers, by the id of the call:
+_shared = {}
+_shared_ids = itertools.count()
+_shared_lock = threading.Lock()
+
+
+def get_max_workers():
+    return os.cpu_count() or 1
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+# The bytes of a partition, sent with the task or read from the input the
+# worker inherited:
+def get_partition(shared_id, start, end, payload):
+    if payload is not None:
+        return payload
+    return _shared[shared_id][start:end]
+
+
+# Offset of the next newline at or after start, or None:
+def find_newline(array, start):
+    while start < len(array):
+        found = np.flatnonzero(array[start:start + SEARCH_SIZE] == 10)
+        if len(found):
+            return start + int(found[0])
+        start += SEARCH_SIZE
+    return None
+
+
+def count_quotes(array, start, end):
+    return int(np.count_nonzero(array[start:end] == 34))
+
+
+# End of the record that starts at start, the offset after its line ending.
+# Newlines inside quoted fields are skipped, as a record boundary always has
+# an even number of quotes before it:
+def find_record_end(array, start, search_from):
+    position = find_newline(array, search_from)
+    quotes = 0 if position is None else count_quotes(array, start, position)
+    while position is not None and quotes % 2:
+        next_position = find_newline(array, position + 1)
+        if next_position is None:
+            position = None
+        else:
+            quotes += count_quotes(array, position, next_position)
+            position = next_position
+    return len(array) if position is None else position + 1
+
+
+# Partitions of about partition_size bytes, as (start, end) offsets. CSV
+# partitions end at record boundaries, NDJSON partitions at line ends:
+def find_partitions(data, start, partition_size, quoted=True):
+    array = np.frombuffer(data, dtype=np.uint8)
+    partitions = []
+    while start < len(array):
+        target = start + partition_size
+        if target >= len(array):
+            end = len(array)
+        elif quoted:
+            end = find_record_end(array, start, target)
+        else:
+            newline = find_newline(array, target)
+            end = len(array) if newline is None else newline + 1
+        partitions.append((start, end))
+        start = end
+    return partitions
+
+
+# Runs tasks in a process pool and yields their results in order, with at
+# most window tasks in flight so finished partitions are not held for long:
+def ordered_map(executor, function, tasks, window):
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(function, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Input sent with a task when workers are not forked, the partition if the
+# task ends with its offsets, otherwise all of it:
+def get_task_payload(data, task):
+    if len(task) >= 2 and all(type(offset) is int for offset in task[-2:]):
+        return bytes(data[task[-2]:task[-1]])
+    return bytes(data)
+
+
+# Runs tasks in a pool when there is more than one, otherwise in this
+# process. The input is shared with forked workers:
+def run_partitions(data, function, tasks, max_workers):
+    with _shared_lock:
+        shared_id = next(_shared_ids)
+        _shared[shared_id] = data
+    try:
+        if max_workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield function(shared_id, *task, None)
+            return
+        if can_fork():
+            context = multiprocessing.get_context('fork')
+            jobs = [(shared_id, *task, None) for task in tasks]
+        else:
+            context = None
+            jobs = [(shared_id, *task, get_task_payload(data, task))
+                    for task in tasks]
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=context) as executor:
+            yield from ordered_map(executor, function, jobs, 2 * max_workers)
+    finally:
+        _shared.pop(shared_id, None)
+
+
+# CSV
+
+def mask_csv_partition(shared_id, header, pii_fields, start, end, payload):
+    masker = CSVMasker(pii_fields)
+    masker.feed(header)
+    data = get_partition(shared_id, start, end, payload)
+    return masker.feed(data) + masker.finish(), masker.rows
+
+
+def parallel_csv_transformation(data, pii_fields, max_workers,
+                                partition_size=DEFAULT_PARTITION_SIZE):
+    array = np.frombuffer(data, dtype=np.uint8)
+    header_end = find_record_end(array, 0, 0)
+    header = bytes(data[:header_end])
+    if not header.endswith(b'\n'):
+        header += b'\n'
+    columns = [get_field_name(field) for field in
+               split_fields(header.rstrip(b'\r\n').lstrip(b'\xef\xbb\xbf'))]
+    # Missing PII fields are logged once, here, and not by each worker:
+    plan = get_field_plan(pii_fields, columns)
+    plan.log_missing()
+    found_fields = select_paths(pii_fields, plan)
+    tasks = [(header, found_fields, start, end) for start, end in
+             find_partitions(data, header_end, partition_size)]
+    rows = 0
+    # The header is written once, held back until there are rows:
+    held = header
+    for output, partition_rows in run_partitions(
+            data, mask_csv_partition, tasks, max_workers):
+        if rows == 0:
+            held += output
+            if partition_rows:
+                yield held
+        elif output:
+            yield output
+        rows += partition_rows
+    if rows == 0:
+        logger.error('Input data file has no content.')
+
+
+# NDJSON
+
+def mask_ndjson_partition(shared_id, pii_fields, start, end, payload):
+    data = get_partition(shared_id, start, end, payload)
+    records = mask_records(list(iter_ndjson(io.BytesIO(data))),
+                           get_strategies(pii_fields))
+    return ''.join(json.dumps(record) + '\n' for record in records).encode()
+
+
+def parallel_ndjson_transformation(data, pii_fields, max_workers,
+                                   partition_size=DEFAULT_PARTITION_SIZE):
+    # PII fields are checked against the first record, once:
+    first_line_end = find_newline(np.frombuffer(data, dtype=np.uint8), 0)
+    if first_line_end is None:
+        first_line_end = len(data)
+    first_record = next(iter_ndjson(io.BytesIO(
+        bytes(data[:first_line_end]))), None)
+    if first_record is not None:
+        check_pii_fields(first_record, pii_fields)
+    tasks = [(pii_fields, start, end) for start, end in
+             find_partitions(data, 0, partition_size, quoted=False)]
+    written = False
+    for output in run_partitions(data, mask_ndjson_partition, tasks,
+                                 max_workers):
+        if output:
+            written = True
+            yield output
+    if not written:
+        logger.error('Input data file has no content.')
+
+
+# PARQUET
+
+def mask_parquet_row_groups(shared_id, pii_fields, indices, payload):
+    parquet_file = get_parquet_file(
+        _shared[shared_id] if payload is None else payload)
+    pii_columns, _ = match_pii_columns(parquet_file.schema_arrow,
+                                       get_strategies(pii_fields))
+    masked_schema = get_masked_schema(parquet_file.schema_arrow, pii_columns)
+    return [mask_row_group(parquet_file, index, masked_schema, pii_columns)
+            for index in indices]
+
+
+# Whether any PII column is masked from its values (such as hmac), rather
+# than replaced by a constant:
+def reads_pii_values(pii_columns):
+    return any(reads_pii_values(strategy.fields)
+               if isinstance(strategy, NestedStrategy)
+               else not strategy.is_constant
+               for strategy in pii_columns.values())
+
+
+# With constant strategies, non-PII column chunks are copied without
+# decoding, which needs no pool. Otherwise, and for files that cannot be
+# copied, row groups are read and masked in the workers, as the PII columns
+# of the copy would be masked on one core, and written here into one file,
+# as a parquet file has a single footer. Workers match the PII fields to
+# the schema again, from the plan cache of their process:
+def parallel_parquet_transformation(data, pii_fields, max_workers,
+                                    partition_size=DEFAULT_PARTITION_SIZE):
+    parquet_file = get_parquet_file(data)
+    pii_columns = get_pii_columns(parquet_file, pii_fields)
+    if pii_columns is None:
+        return
+    metadata = parquet_file.metadata
+    masked_schema = get_masked_schema(parquet_file.schema_arrow, pii_columns)
+    if not reads_pii_values(pii_columns):
+        try:
+            return copy_parquet_columns(data, parquet_file, pii_columns,
+                                        masked_schema,
+                                        get_column_compression(metadata))
+        except FooterError as e:
+            logger.info(f'Column chunks not copied, decoding instead: {e}')
+    tasks = []
+    indices = []
+    size = 0
+    for index in range(metadata.num_row_groups):
+        indices.append(index)
+        size += metadata.row_group(index).total_byte_size
+        if size >= partition_size:
+            tasks.append((pii_fields, indices))
+            indices, size = [], 0
+    if indices:
+        tasks.append((pii_fields, indices))
+    # Seekable sources can only be shared with forked workers:
+    if hasattr(data, 'seek') and not can_fork():
+        max_workers = 1
+    tables = itertools.chain.from_iterable(run_partitions(
+        data, mask_parquet_row_groups, tasks, max_workers))
+    return write_row_groups(tables, masked_schema, metadata)
+
+
+# Obfuscates one file on up to max_workers cores. CSV and NDJSON give a
+# generator of bytes in order, parquet a memoryview. JSON arrays cannot be
+# split, and are obfuscated on one core:
+def parallel_transformation(data, pii_fields, file_format,
+                            max_workers=None,
+                            partition_size=DEFAULT_PARTITION_SIZE):
+    if len(pii_fields) == 0:
+        logger.info('No PII fields given.')
+    if max_workers is None:
+        max_workers = get_max_workers()
+    # Strategies are checked here, once, and built again in each worker:
+    if get_strategies(pii_fields) is None:
+        return
+    if data is None:
+        logger.error('Unsupported data type.')
+        return
+    if type(data) is str:
+        data = data.encode('utf-8')
+    if file_format == 'parquet':
+        return parallel_parquet_transformation(data, pii_fields, max_workers,
+                                               partition_size)
+    if len(data) == 0:
+        logger.error('Input file is blank.')
+        return
+    if file_format == 'csv':
+        return parallel_csv_transformation(data, pii_fields, max_workers,
+                                           partition_size)
+    if file_format == 'ndjson':
+        return parallel_ndjson_transformation(data, pii_fields, max_workers,
+                                              partition_size)
+    if file_format == 'json':
+        return json_stream_transformation(io.BytesIO(data), pii_fields)
+    logger.error('Unsupported data type.')
@@ -0,0 +1,297 @@
+import copy
+import io
+from src.buffers import SpillBuffer
+from src.lazy_imports import lazy_import
+from src.instrumentation import StageTimer
+from src.masking import mask_column
+from src.parquet_footer import (MAGIC,
+                                FooterError,
+                                I64,
+                                I16,
+                                LIST,
+                                STRUCT,
+                                get_field,
+                                read_footer,
+                                remove_fields,
+                                set_field,
+                                write_footer)
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+
+# PARQUET COPY FUNCTIONS
+# Obfuscates parquet data without decoding the columns that do not change.
+# Column chunks outside the PII columns are copied byte for byte, pages
+# still compressed, and only their offsets in the footer are rewritten. PII
+# column chunks are taken from a small file of the masked strings written
+# with pyarrow, so the work done grows with the PII columns, not the file
+# width.
+# Files this cannot copy (encrypted, empty row groups, chunks in other
+# files) raise FooterError, and are masked by decoding instead.
+
+# FileMetaData fields:
+FILE_VERSION = 1
+FILE_SCHEMA = 2
+FILE_NUM_ROWS = 3
+FILE_ROW_GROUPS = 4
+FILE_KEY_VALUE_METADATA = 5
+FILE_CREATED_BY = 6
+FILE_COLUMN_ORDERS = 7
+FILE_ENCRYPTION = 8
+# RowGroup fields:
+ROW_GROUP_COLUMNS = 1
+ROW_GROUP_NUM_ROWS = 3
+# ColumnChunk fields:
+CHUNK_FILE_PATH = 1
+CHUNK_FILE_OFFSET = 2
+CHUNK_METADATA = 3
+CHUNK_INDEXES = {4, 5, 6, 7}
+CHUNK_ENCRYPTION = {8, 9}
+# ColumnMetaData fields:
+COLUMN_UNCOMPRESSED_SIZE = 6
+COLUMN_COMPRESSED_SIZE = 7
+COLUMN_DATA_PAGE_OFFSET = 9
+COLUMN_INDEX_PAGE_OFFSET = 10
+COLUMN_DICTIONARY_PAGE_OFFSET = 11
+COLUMN_BLOOM_FILTER = {14, 15}
+# SchemaElement fields:
+SCHEMA_NAME = 4
+SCHEMA_NUM_CHILDREN = 5
+
+
+# Bytes between two offsets of parquet bytes (or a memoryview), or of a
+# seekable file such as an S3RangeFile:
+def read_range(source, start, end):
+    if not hasattr(source, 'seek'):
+        return source[start:end]
+    source.seek(start)
+    pieces = []
+    while start < end:
+        piece = source.read(end - start)
+        if not piece:
+            raise FooterError('Parquet file is cut short.')
+        pieces.append(piece)
+        start += len(piece)
+    return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+
+def get_source_size(source):
+    if hasattr(source, 'seek'):
+        return source.seek(0, io.SEEK_END)
+    return len(source)
+
+
+def get_source_footer(source):
+    return read_footer(lambda start, end: read_range(source, start, end),
+                       get_source_size(source))
+
+
+# Schema elements of each top-level field, from the flattened schema where
+# each element is followed by its children:
+def split_schema(elements):
+    fields = []
+    position = 1
+    for _ in range(get_field(elements[0], SCHEMA_NUM_CHILDREN, 0)):
+        end = position
+        remaining = 1
+        while remaining:
+            remaining += get_field(elements[end], SCHEMA_NUM_CHILDREN, 0) - 1
+            end += 1
+        fields.append(elements[position:end])
+        position = end
+    return fields
+
+
+def count_leaves(elements):
+    return sum(1 for element in elements
+               if not get_field(element, SCHEMA_NUM_CHILDREN))
+
+
+# Byte range of a column chunk, from the dictionary page if there is one:
+def get_chunk_range(column_metadata):
+    start = get_field(column_metadata, COLUMN_DATA_PAGE_OFFSET)
+    dictionary_offset = get_field(column_metadata,
+                                  COLUMN_DICTIONARY_PAGE_OFFSET)
+    if dictionary_offset and dictionary_offset < start:
+        start = dictionary_offset
+    return start, start + get_field(column_metadata, COLUMN_COMPRESSED_SIZE)
+
+
+# Parquet bytes written by pyarrow, and their footer:
+def write_template(table, compression, version, row_group_size=None):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=compression, version=version,
+                   row_group_size=row_group_size)
+    data = buffer.getvalue()
+    footer, _ = get_source_footer(data)
+    return data, footer
+
+
+# Column chunks of the masked PII columns of a row group, with the data
+# they point into. PII columns are only read for strategies that depend on
+# the value:
+def get_pii_chunks(parquet_file, index, num_rows, pii_schema, pii_columns,
+                   compression, version):
+    read_columns = [name for name in pii_schema.names
+                    if not pii_columns[name].is_constant]
+    columns = None
+    if read_columns:
+        columns = parquet_file.read_row_group(index, columns=read_columns)
+    table = pa.Table.from_arrays(
+        [mask_column(pii_columns[name], columns, name, num_rows)
+         for name in pii_schema.names], schema=pii_schema)
+    data, footer = write_template(table, compression, version,
+                                  row_group_size=num_rows)
+    row_group = get_field(footer, FILE_ROW_GROUPS)[1][0]
+    return data, get_field(row_group, ROW_GROUP_COLUMNS)[1]
+
+
+# Writes a column chunk's bytes to the sink and returns its ColumnChunk with
+# offsets moved to where it now starts. Page indexes and bloom filters are
+# outside the chunk, and are dropped:
+def copy_chunk(chunk, source, sink):
+    if get_field(chunk, CHUNK_FILE_PATH) is not None or \
+            any(item[0] in CHUNK_ENCRYPTION for item in chunk):
+        raise FooterError('Column chunk cannot be copied.')
+    column_metadata = copy.deepcopy(get_field(chunk, CHUNK_METADATA))
+    start, end = get_chunk_range(column_metadata)
+    position = sink.tell()
+    sink.write(read_range(source, start, end))
+    shift = position - start
+    for field_id in (COLUMN_DATA_PAGE_OFFSET, COLUMN_INDEX_PAGE_OFFSET,
+                     COLUMN_DICTIONARY_PAGE_OFFSET):
+        offset = get_field(column_metadata, field_id)
+        if offset:
+            set_field(column_metadata, field_id, I64, offset + shift)
+    column_metadata = remove_fields(column_metadata, COLUMN_BLOOM_FILTER)
+    chunk = remove_fields(copy.deepcopy(chunk), CHUNK_INDEXES)
+    set_field(chunk, CHUNK_FILE_OFFSET, I64,
+              get_field(chunk, CHUNK_FILE_OFFSET, start) + shift)
+    set_field(chunk, CHUNK_METADATA, STRUCT, column_metadata)
+    return chunk, end - start
+
+
+# Copies the row groups of a parquet file with PII column chunks replaced.
+# Takes parquet bytes (or a memoryview), or a seekable file such as an
+# S3RangeFile, and returns a memoryview of the output:
+def copy_parquet_columns(source, parquet_file, pii_columns, masked_schema,
+                         compression):
+    footer, _ = get_source_footer(source)
+    if get_field(footer, FILE_ENCRYPTION) is not None:
+        raise FooterError('Parquet file is encrypted.')
+    version = parquet_file.metadata.format_version
+    # The output schema and key-value metadata come from an empty file of
+    # the masked schema, written the way pyarrow would write it. The table
+    # is built from no batches, as Schema.empty_table imports pandas:
+    _, template = write_template(
+        pa.Table.from_batches([], schema=masked_schema), compression,
+        version)
+    source_fields = split_schema(get_field(footer, FILE_SCHEMA)[1])
+    template_schema = get_field(template, FILE_SCHEMA)[1]
+    template_fields = split_schema(template_schema)
+    if len(source_fields) != len(template_fields):
+        raise FooterError('Parquet schema does not match.')
+    # Each output column, as the source column or the PII column it is
+    # taken from:
+    schema = [template_schema[0]]
+    plan = []
+    pii_names = []
+    source_leaf = 0
+    pii_leaf = 0
+    for source_field, template_field in zip(source_fields, template_fields):
+        name = get_field(template_field[0], SCHEMA_NAME).decode('utf-8')
+        leaves = count_leaves(source_field)
+        # Structs with PII fields inside them are taken from the masked
+        # file whole, with a chunk for each leaf:
+        if name in pii_columns:
+            schema += template_field
+            pii_leaves = count_leaves(template_field)
+            plan += [(False, pii_leaf + leaf) for leaf in range(pii_leaves)]
+            pii_leaf += pii_leaves
+            pii_names.append(name)
+        elif leaves != count_leaves(template_field) or \
+                get_field(source_field[0], SCHEMA_NAME) != name.encode():
+            raise FooterError('Parquet schema does not match.')
+        else:
+            schema += source_field
+            plan += [(True, source_leaf + leaf) for leaf in range(leaves)]
+        source_leaf += leaves
+    pii_schema = pa.schema([masked_schema.field(name) for name in pii_names])
+    pii_compression = compression if type(compression) is not dict else {
+        path: codec for path, codec in compression.items()
+        if path in pii_names or path.split('.')[0] in pii_names}
+    # Constant PII chunks are the same for row groups of the same length:
+    constant = all(pii_columns[name].is_constant for name in pii_names)
+    pii_chunks = {}
+    # Output spills to a temporary file if it is large:
+    sink = SpillBuffer()
+    sink.write(MAGIC)
+    row_groups = []
+    # PII chunks are timed as masked, and copying chunks as encoded:
+    mask = StageTimer('mask')
+    encode = StageTimer('encode')
+    for ordinal, row_group in enumerate(get_field(footer, FILE_ROW_GROUPS,
+                                                  (STRUCT, []))[1]):
+        num_rows = get_field(row_group, ROW_GROUP_NUM_ROWS)
+        if not num_rows:
+            raise FooterError('Parquet row group is empty.')
+        with mask:
+            if constant and num_rows in pii_chunks:
+                pii_data, pii_column_chunks = pii_chunks[num_rows]
+            else:
+                pii_data, pii_column_chunks = get_pii_chunks(
+                    parquet_file, ordinal, num_rows, pii_schema, pii_columns,
+                    pii_compression, version)
+                if constant:
+                    pii_chunks[num_rows] = pii_data, pii_column_chunks
+        columns = get_field(row_group, ROW_GROUP_COLUMNS)[1]
+        chunks = []
+        start = sink.tell()
+        compressed_size = 0
+        uncompressed_size = 0
+        with encode:
+            for from_source, index in plan:
+                if from_source:
+                    chunk, size = copy_chunk(columns[index], source, sink)
+                else:
+                    chunk, size = copy_chunk(pii_column_chunks[index],
+                                             pii_data, sink)
+                chunks.append(chunk)
+                compressed_size += size
+                uncompressed_size += get_field(get_field(
+                    chunk, CHUNK_METADATA), COLUMN_UNCOMPRESSED_SIZE)
+        row_groups.append([
+            [1, LIST, (STRUCT, chunks)],
+            [2, I64, uncompressed_size],
+            [3, I64, num_rows],
+            [5, I64, start],
+            [6, I64, compressed_size],
+            [7, I16, ordinal],
+        ])
+    metadata = [
+        [FILE_VERSION, *template_field_item(template, FILE_VERSION)],
+        [FILE_SCHEMA, LIST, (STRUCT, schema)],
+        [FILE_NUM_ROWS, I64, get_field(footer, FILE_NUM_ROWS)],
+        [FILE_ROW_GROUPS, LIST, (STRUCT, row_groups)],
+    ]
+    for field_id in (FILE_KEY_VALUE_METADATA, FILE_CREATED_BY,
+                     FILE_COLUMN_ORDERS):
+        item = template_field_item(template, field_id)
+        if item is not None:
+            metadata.append([field_id, *item])
+    sink.write(write_footer(metadata))
+    output = sink.getbuffer()
+    sink.close()
+    num_rows = get_field(footer, FILE_NUM_ROWS)
+    mask.record(rows=num_rows)
+    encode.record(bytes=len(output), rows=num_rows)
+    return output
+
+
+# (type, value) of a field of the template footer, or None:
+def template_field_item(template, field_id):
+    for item in template:
+        if item[0] == field_id:
+            return item[1], item[2]
+    return None
@@ -0,0 +1,209 @@
+import logging
+import json
+from src.field_plan import get_field_plan
+from src.masking import (NestedStrategy,
+                         get_masked_field,
+                         get_strategies,
+                         mask_column)
+from src.buffers import SpillBuffer
+from src.instrumentation import StageTimer
+from src.parquet_copy import copy_parquet_columns
+from src.parquet_footer import FooterError
+from src.lazy_imports import lazy_import
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# PARQUET ENGINE
+# Obfuscates parquet data with the original row groups and compression
+# codecs kept. Non-PII column chunks are copied without being decoded (see
+# parquet_copy). Files that cannot be copied that way are masked one row
+# group at a time with pyarrow: only the non-PII columns are read, and PII
+# columns are replaced by a constant string array. PII columns whose
+# strategy depends on the value (such as hmac) are read as well, and
+# replaced by the masked strings. PII fields inside structs are masked in
+# place, and the rest of the struct is kept.
+
+# Parquet metadata codec names to pyarrow writer codec names:
+CODEC_NAMES = {
+    'UNCOMPRESSED': 'none',
+    'LZ4_RAW': 'lz4',
+    'LZ4': 'lz4',
+}
+
+
+# Compression codec of each column, as written in the original file:
+def get_column_compression(metadata):
+    if metadata.num_row_groups == 0:
+        return 'snappy'
+    row_group = metadata.row_group(0)
+    compression = {}
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        codec = column.compression
+        compression[column.path_in_schema] = CODEC_NAMES.get(
+            codec, codec.lower())
+    return compression
+
+
+# Schema of the output file, PII columns become strings. Takes the PII
+# columns from get_pii_columns:
+def get_masked_schema(schema, pii_columns):
+    fields = [get_masked_field(field, pii_columns[field.name])
+              if field.name in pii_columns else field for field in schema]
+    metadata = schema.metadata
+    # Keep pandas metadata in step with the new column types:
+    if metadata and b'pandas' in metadata:
+        pandas_metadata = json.loads(metadata[b'pandas'])
+        for column in pandas_metadata.get('columns', []):
+            name = column.get('field_name')
+            if name in pii_columns and \
+                    not isinstance(pii_columns[name], NestedStrategy):
+                column['pandas_type'] = 'unicode'
+                column['numpy_type'] = 'object'
+        metadata = dict(metadata)
+        metadata[b'pandas'] = json.dumps(pandas_metadata).encode('utf-8')
+    return pa.schema(fields, metadata=metadata)
+
+
+# Columns of a row group needed to mask it, constant PII columns are not
+# read:
+def read_row_group(parquet_file, index, masked_schema, pii_columns):
+    read_columns = [name for name in masked_schema.names
+                    if name not in pii_columns or
+                    not pii_columns[name].is_constant]
+    return parquet_file.read_row_group(index, columns=read_columns)
+
+
+# Masks the columns read by read_row_group, non-PII columns are passed
+# through:
+def mask_table(row_group, num_rows, masked_schema, pii_columns):
+    arrays = []
+    for name in masked_schema.names:
+        if name in pii_columns:
+            arrays.append(mask_column(pii_columns[name], row_group, name,
+                                      num_rows))
+        else:
+            arrays.append(row_group.column(name))
+    return pa.Table.from_arrays(arrays, schema=masked_schema)
+
+
+# Masks a single row group:
+def mask_row_group(parquet_file, index, masked_schema, pii_columns):
+    num_rows = parquet_file.metadata.row_group(index).num_rows
+    row_group = read_row_group(parquet_file, index, masked_schema,
+                               pii_columns)
+    return mask_table(row_group, num_rows, masked_schema, pii_columns)
+
+
+# Yields each row group masked, timing the decode and mask stages:
+def iter_masked_row_groups(parquet_file, masked_schema, pii_columns):
+    decode = StageTimer('decode')
+    mask = StageTimer('mask')
+    rows = 0
+    for index in range(parquet_file.metadata.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(index).num_rows
+        with decode:
+            row_group = read_row_group(parquet_file, index, masked_schema,
+                                       pii_columns)
+        with mask:
+            table = mask_table(row_group, num_rows, masked_schema,
+                               pii_columns)
+        rows += num_rows
+        yield table
+    decode.record(rows=rows)
+    mask.record(rows=rows)
+
+
+# Opens parquet bytes (or a memoryview), or a seekable file such as an
+# S3RangeFile:
+def get_parquet_file(data):
+    source = data
+    if not hasattr(source, 'seek'):
+        source = pa.BufferReader(source)
+    return pq.ParquetFile(source)
+
+
+# Names on the path to each field of a schema, by path. Fields of structs
+# are included, with the names on their path joined with dots:
+def get_field_paths(fields, names=()):
+    paths = {}
+    for field in fields:
+        field_names = names + (field.name,)
+        paths['.'.join(field_names)] = field_names
+        if pa.types.is_struct(field.type):
+            paths.update(get_field_paths(field.type, field_names))
+    return paths
+
+
+# Strategy of each top-level column with PII, matched with the plan of the
+# schema (see field_plan). Structs with PII fields inside them have a
+# NestedStrategy. Returns the plan as well:
+def match_pii_columns(schema, strategies):
+    paths = get_field_paths(schema)
+    plan = get_field_plan(strategies, paths)
+    pii_columns = NestedStrategy({
+        paths[path]: strategy
+        for path, strategy in plan.select(strategies).items()}).fields
+    return pii_columns, plan
+
+
+# Strategy of each PII column found in the file, or None if the file
+# cannot be masked:
+def get_pii_columns(parquet_file, pii_fields):
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    # If parquet file has no rows, give error:
+    if parquet_file.metadata.num_rows == 0:
+        logger.error('Input data file has no content.')
+        return
+    pii_columns, plan = match_pii_columns(parquet_file.schema_arrow,
+                                          strategies)
+    plan.log_missing()
+    return pii_columns
+
+
+# Writes masked row groups, in order, with the original codecs. Returns a
+# memoryview of the output:
+def write_row_groups(tables, masked_schema, metadata):
+    # Output spills to a temporary file if it is large:
+    sink = SpillBuffer()
+    encode = StageTimer('encode')
+    rows = 0
+    with pq.ParquetWriter(sink, masked_schema,
+                          compression=get_column_compression(metadata),
+                          version=metadata.format_version) as writer:
+        for table in tables:
+            # Each row group is written as one row group:
+            with encode:
+                writer.write_table(table,
+                                   row_group_size=max(table.num_rows, 1))
+            rows += table.num_rows
+    output = sink.getbuffer()
+    sink.close()
+    encode.record(bytes=len(output), rows=rows)
+    return output
+
+
+# Takes parquet bytes (or a memoryview), or a seekable file such as an
+# S3RangeFile. Returns a memoryview of the output:
+def parquet_transformation(data_to_be_transformed, pii_fields):
+    parquet_file = get_parquet_file(data_to_be_transformed)
+    pii_columns = get_pii_columns(parquet_file, pii_fields)
+    if pii_columns is None:
+        return
+    masked_schema = get_masked_schema(parquet_file.schema_arrow, pii_columns)
+    try:
+        return copy_parquet_columns(
+            data_to_be_transformed, parquet_file, pii_columns, masked_schema,
+            get_column_compression(parquet_file.metadata))
+    except FooterError as e:
+        logger.info(f'Column chunks not copied, decoding instead: {e}')
+    tables = iter_masked_row_groups(parquet_file, masked_schema, pii_columns)
+    return write_row_groups(tables, masked_schema, parquet_file.metadata)
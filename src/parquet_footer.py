@@ -0,0 +1,225 @@
+import struct
+
+
+# PARQUET FOOTER FUNCTIONS
+# Reads and writes the parquet footer (the Thrift FileMetaData), so column
+# chunks can be copied between files with their offsets rewritten. Structs
+# are decoded generically with the Thrift compact protocol, as lists of
+# [field_id, type, value], so fields this module does not know about are
+# written back unchanged.
+
+MAGIC = b'PAR1'
+ENCRYPTED_MAGIC = b'PARE'
+
+# Compact protocol types:
+STOP = 0
+TRUE = 1
+FALSE = 2
+BYTE = 3
+I16 = 4
+I32 = 5
+I64 = 6
+DOUBLE = 7
+BINARY = 8
+LIST = 9
+SET = 10
+MAP = 11
+STRUCT = 12
+
+
+class FooterError(ValueError):
+    pass
+
+
+def read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise FooterError('Parquet footer is cut short.')
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def write_varint(value, output):
+    while value > 0x7f:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def zigzag_decode(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def zigzag_encode(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def read_value(data, position, value_type):
+    if value_type in (TRUE, FALSE):
+        # Booleans in containers take a byte, in structs the type is enough:
+        return value_type == TRUE, position
+    if value_type == BYTE:
+        return struct.unpack_from('<b', data, position)[0], position + 1
+    if value_type in (I16, I32, I64):
+        value, position = read_varint(data, position)
+        return zigzag_decode(value), position
+    if value_type == DOUBLE:
+        return struct.unpack_from('<d', data, position)[0], position + 8
+    if value_type == BINARY:
+        length, position = read_varint(data, position)
+        return bytes(data[position:position + length]), position + length
+    if value_type in (LIST, SET):
+        header = data[position]
+        position += 1
+        size, element_type = header >> 4, header & 0x0f
+        if size == 15:
+            size, position = read_varint(data, position)
+        values = []
+        for _ in range(size):
+            if element_type in (TRUE, FALSE):
+                values.append(data[position] == TRUE)
+                position += 1
+            else:
+                value, position = read_value(data, position, element_type)
+                values.append(value)
+        return (element_type, values), position
+    if value_type == MAP:
+        size, position = read_varint(data, position)
+        if size == 0:
+            return (0, 0, []), position
+        types = data[position]
+        position += 1
+        key_type, item_type = types >> 4, types & 0x0f
+        items = []
+        for _ in range(size):
+            key, position = read_value(data, position, key_type)
+            item, position = read_value(data, position, item_type)
+            items.append((key, item))
+        return (key_type, item_type, items), position
+    if value_type == STRUCT:
+        return read_struct(data, position)
+    raise FooterError(f'Unknown Thrift type {value_type}.')
+
+
+def read_struct(data, position=0):
+    fields = []
+    field_id = 0
+    while True:
+        header = data[position]
+        position += 1
+        field_type = header & 0x0f
+        if field_type == STOP:
+            return fields, position
+        delta = header >> 4
+        if delta:
+            field_id += delta
+        else:
+            value, position = read_varint(data, position)
+            field_id = zigzag_decode(value)
+        value, position = read_value(data, position, field_type)
+        fields.append([field_id, field_type, value])
+
+
+def write_value(value, value_type, output):
+    if value_type in (TRUE, FALSE):
+        return
+    if value_type == BYTE:
+        output += struct.pack('<b', value)
+    elif value_type in (I16, I32, I64):
+        write_varint(zigzag_encode(value), output)
+    elif value_type == DOUBLE:
+        output += struct.pack('<d', value)
+    elif value_type == BINARY:
+        write_varint(len(value), output)
+        output += value
+    elif value_type in (LIST, SET):
+        element_type, values = value
+        if len(values) < 15:
+            output.append(len(values) << 4 | element_type)
+        else:
+            output.append(0xf0 | element_type)
+            write_varint(len(values), output)
+        for element in values:
+            if element_type in (TRUE, FALSE):
+                output.append(TRUE if element else FALSE)
+            else:
+                write_value(element, element_type, output)
+    elif value_type == MAP:
+        key_type, item_type, items = value
+        write_varint(len(items), output)
+        if items:
+            output.append(key_type << 4 | item_type)
+            for key, item in items:
+                write_value(key, key_type, output)
+                write_value(item, item_type, output)
+    elif value_type == STRUCT:
+        write_struct(value, output)
+    else:
+        raise FooterError(f'Unknown Thrift type {value_type}.')
+
+
+def write_struct(fields, output=None):
+    if output is None:
+        output = bytearray()
+    last_id = 0
+    for field_id, field_type, value in sorted(fields, key=lambda f: f[0]):
+        if field_type in (TRUE, FALSE):
+            field_type = TRUE if value else FALSE
+        delta = field_id - last_id
+        if 0 < delta <= 15:
+            output.append(delta << 4 | field_type)
+        else:
+            output.append(field_type)
+            write_varint(zigzag_encode(field_id), output)
+        write_value(value, field_type, output)
+        last_id = field_id
+    output.append(STOP)
+    return output
+
+
+# Field helpers, structs are lists of [field_id, type, value]:
+def get_field(fields, field_id, default=None):
+    for item in fields:
+        if item[0] == field_id:
+            return item[2]
+    return default
+
+
+def set_field(fields, field_id, field_type, value):
+    for item in fields:
+        if item[0] == field_id:
+            item[1], item[2] = field_type, value
+            return
+    fields.append([field_id, field_type, value])
+
+
+def remove_fields(fields, field_ids):
+    return [item for item in fields if item[0] not in field_ids]
+
+
+# Footer of a parquet file, as (FileMetaData, offset of the footer). read
+# gives the bytes between two offsets. Encrypted footers cannot be read:
+def read_footer(read, size):
+    if size < 12 or bytes(read(0, 4)) != MAGIC:
+        raise FooterError('Not a parquet file.')
+    tail = bytes(read(size - 8, size))
+    if tail[4:] == ENCRYPTED_MAGIC:
+        raise FooterError('Parquet footer is encrypted.')
+    if tail[4:] != MAGIC:
+        raise FooterError('Not a parquet file.')
+    length = struct.unpack('<I', tail[:4])[0]
+    start = size - 8 - length
+    metadata, _ = read_struct(bytes(read(start, start + length)))
+    return metadata, start
+
+
+# Footer bytes, the FileMetaData, its length and the magic bytes:
+def write_footer(metadata):
+    footer = write_struct(metadata)
+    return bytes(footer) + struct.pack('<I', len(footer)) + MAGIC
@@ -0,0 +1,244 @@
+import bisect
+import io
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from src.buffers import SpillBuffer
+from src.compression import decompress_bytes, get_encoding_codec
+from src.field_plan import get_matcher
+from src.lazy_imports import lazy_import
+
+pq = lazy_import('pyarrow.parquet')
+
+
+# RANGED DOWNLOAD FUNCTIONS
+# Large objects are downloaded as concurrent byte-range GETs, so download
+# time scales with the number of connections instead of a single stream.
+# For parquet only the footer and the column chunks that are needed are
+# fetched. Every range after the first is requested with If-Match on the
+# ETag of the first response, so an object replaced while it is being read
+# raises ObjectChangedError instead of being spliced from two versions.
+
+# The first request reads up to RANGE_SIZE bytes, larger objects are split
+# into ranges of this size:
+RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_RANGE_CONCURRENCY = 8
+# Bytes read from the end of a parquet file to find the footer:
+FOOTER_READ_SIZE = 64 * 1024
+# Column chunks closer together than this are fetched in one request:
+MAX_RANGE_GAP = 64 * 1024
+
+
+class ObjectChangedError(ValueError):
+    pass
+
+
+# Bytes [start, end) of an object, of the version with etag if given:
+def get_range(client, target_bucket, filepath, start, end, etag=None):
+    options = {} if etag is None else {'IfMatch': etag}
+    try:
+        response = client.get_object(
+            Bucket=target_bucket, Key=filepath,
+            Range=f'bytes={start}-{end - 1}', **options)
+    except ClientError as err:
+        if err.response['Error']['Code'] in ('PreconditionFailed', '412'):
+            raise ObjectChangedError(
+                f'{target_bucket}/{filepath} was replaced while it was '
+                f'being read.') from err
+        raise
+    return response['Body'].read()
+
+
+# Object size from the Content-Range header of a ranged response:
+def get_total_size(response, default):
+    content_range = response.get('ContentRange')
+    if isinstance(content_range, str):
+        return int(content_range.split('/')[-1])
+    return default
+
+
+# Splits [start, end) into ranges of at most range_size bytes:
+def split_range(start, end, range_size=RANGE_SIZE):
+    return [(offset, min(offset + range_size, end))
+            for offset in range(start, end, range_size)]
+
+
+# Fetches ranges with a thread pool, results are in the same order:
+def fetch_ranges(client, target_bucket, filepath, ranges,
+                 max_concurrency=DEFAULT_RANGE_CONCURRENCY, etag=None):
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(
+            lambda byte_range: get_range(client, target_bucket, filepath,
+                                         *byte_range, etag=etag),
+            ranges))
+
+
+# Reads a whole object. Small objects take one request and are returned as
+# bytes. The rest of a large object is fetched in concurrent ranges, written
+# in place into a SpillBuffer (on disk if it is large), and returned as a
+# memoryview of that buffer. Objects stored with a Content-Encoding codec
+# (such as gzip) are returned decompressed:
+def get_object_bytes(client, target_bucket, filepath, range_size=RANGE_SIZE,
+                     max_concurrency=DEFAULT_RANGE_CONCURRENCY):
+    try:
+        response = client.get_object(
+            Bucket=target_bucket, Key=filepath,
+            Range=f'bytes=0-{range_size - 1}')
+    except ClientError as err:
+        # Empty objects cannot be read with a range:
+        if err.response['Error']['Code'] == 'InvalidRange':
+            return b''
+        raise
+    first_range = response['Body'].read()
+    codec = get_encoding_codec(response.get('ContentEncoding'))
+    etag = response.get('ETag')
+    total_size = get_total_size(response, len(first_range))
+    if total_size <= len(first_range):
+        if codec is not None:
+            return decompress_bytes(first_range, codec)
+        return first_range
+    buffer = SpillBuffer()
+    buffer.reserve(total_size)
+    buffer.write_at(0, first_range)
+    ranges = split_range(len(first_range), total_size, range_size)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        list(executor.map(
+            lambda byte_range: buffer.write_at(
+                byte_range[0], get_range(client, target_bucket, filepath,
+                                         *byte_range, etag=etag)),
+            ranges))
+    body = buffer.getbuffer()
+    buffer.close()
+    if codec is not None:
+        return decompress_bytes(body, codec)
+    return body
+
+
+# Read-only, seekable file over an S3 object. Reads are served from ranges
+# fetched in advance, anything else is fetched when it is read. With an
+# etag, only that version of the object is read:
+class S3RangeFile(io.RawIOBase):
+    def __init__(self, client, target_bucket, filepath, size, etag=None):
+        self.client = client
+        self.bucket = target_bucket
+        self.key = filepath
+        self.size = size
+        self.etag = etag
+        self.__position = 0
+        self.__starts = []
+        self.__ranges = []
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.__position = max(offset, 0)
+        return self.__position
+
+    def add_range(self, start, data):
+        index = bisect.bisect(self.__starts, start)
+        self.__starts.insert(index, start)
+        self.__ranges.insert(index, data)
+
+    def prefetch(self, ranges, max_concurrency=DEFAULT_RANGE_CONCURRENCY):
+        for (start, end), data in zip(ranges, fetch_ranges(
+                self.client, self.bucket, self.key, ranges,
+                max_concurrency, self.etag)):
+            self.add_range(start, data)
+
+    # Served from the fetched ranges, which may be adjacent pieces of one
+    # large range. Only bytes that were not fetched are requested:
+    def __read(self, start, end):
+        index = bisect.bisect(self.__starts, start) - 1
+        pieces = []
+        position = start
+        while 0 <= index < len(self.__starts):
+            range_start = self.__starts[index]
+            data = self.__ranges[index]
+            if not range_start <= position < range_start + len(data):
+                break
+            pieces.append(data[position - range_start:end - range_start])
+            position += len(pieces[-1])
+            if position >= end:
+                return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+            index += 1
+        pieces.append(get_range(self.client, self.bucket, self.key,
+                                position, end, self.etag))
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    def readinto(self, buffer):
+        end = min(self.__position + len(buffer), self.size)
+        if end <= self.__position:
+            return 0
+        data = self.__read(self.__position, end)
+        buffer[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+
+
+# Whether a column chunk is in a field that skip_columns (PII fields,
+# which can be patterns or nested paths) matches:
+def is_skipped(path_in_schema, matcher):
+    names = path_in_schema.split('.')
+    return any(matcher.match('.'.join(names[:index])) is not None
+               for index in range(1, len(names) + 1))
+
+
+# Byte ranges of the column chunks of every column not in skip_columns,
+# with nearby chunks merged and large ones split for concurrent requests:
+def get_column_chunk_ranges(metadata, skip_columns, range_size=RANGE_SIZE):
+    matcher = get_matcher(sorted(skip_columns))
+    ranges = []
+    for index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(index)
+        for i in range(row_group.num_columns):
+            column = row_group.column(i)
+            if is_skipped(column.path_in_schema, matcher):
+                continue
+            start = column.data_page_offset
+            if (column.has_dictionary_page and
+                    0 < column.dictionary_page_offset < start):
+                start = column.dictionary_page_offset
+            ranges.append((start, start + column.total_compressed_size))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start - merged[-1][1] <= MAX_RANGE_GAP:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return [split for start, end in merged
+            for split in split_range(start, end, range_size)]
+
+
+# Parquet source that only downloads the footer and the column chunks that
+# are kept, the skipped (PII) columns are never downloaded:
+def get_parquet_source(client, target_bucket, filepath, skip_columns,
+                       max_concurrency=DEFAULT_RANGE_CONCURRENCY):
+    response = client.get_object(
+        Bucket=target_bucket, Key=filepath,
+        Range=f'bytes=-{FOOTER_READ_SIZE}')
+    tail = response['Body'].read()
+    size = get_total_size(response, len(tail))
+    etag = response.get('ETag')
+    source = S3RangeFile(client, target_bucket, filepath, size, etag)
+    # Footer is the metadata, its 4 byte length, then b'PAR1':
+    metadata_length = struct.unpack('<I', tail[-8:-4])[0]
+    if metadata_length + 8 > len(tail):
+        tail = get_range(client, target_bucket, filepath,
+                         size - metadata_length - 8, size, etag)
+    source.add_range(size - len(tail), tail)
+    metadata = pq.read_metadata(source)
+    source.prefetch(get_column_chunk_ranges(metadata, set(skip_columns)),
+                    max_concurrency)
+    source.seek(0)
+    return source
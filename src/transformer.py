@@ -1,34 +1,64 @@
-import pandas as pd
-import io
-from io import StringIO, BytesIO
 import logging
-import json
+from src.instrumentation import measure, measure_stream, setup_logging
+from src.parquet_engine import parquet_transformation
+from src.arrow_api import arrow_transformation
+from src.field_plan import get_matcher
+from src.json_engine import (get_record_paths,
+                             json_stream_transformation,
+                             mask_records)
+from src.masking import get_strategies
+from src.parallel import parallel_transformation
+from src.csv_engine import (csv_transformation,
+                            csv_stream_transformation,
+                            READ_SIZE)
 
 
-# Setting up logging
-def setup_logging():
-    logger = logging.getLogger()
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-    logger.setLevel(logging.DEBUG)
-    handler = logging.FileHandler('log.txt', mode='w')
-    formatter = logging.Formatter('%(asctime)s - %(name)s\
-                                  - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
+# Binary data, as bytes or a view of a buffer:
+def is_bytes_like(data):
+    return type(data) in (bytes, bytearray, memoryview)
 
 
-# TRANSFORMATION FUNCTION
+# Logs to the handlers set up by the calling handler:
+logger = logging.getLogger(__name__)
+
+
+# TRANSFORMATION FUNCTIONS
 def transformation_handler(data_to_be_transformed, pii_fields):
-    logger = setup_logging()
+    setup_logging()
+    return transform_data(data_to_be_transformed, pii_fields)
+
+
+# Masks copies of JSON records. Records without a PII field are left
+# without it:
+def json_transformation(records, pii_fields):
+    strategies = get_strategies(pii_fields)
+    if strategies is None:
+        return
+    matcher = get_matcher(strategies)
+    fields = {}
+    for record in records:
+        if isinstance(record, dict):
+            fields.update(dict.fromkeys(get_record_paths(record, matcher)))
+    # If records are all empty, give error:
+    if not fields:
+        logger.error('Input data file has no content.')
+        return
+    # If given PII field was not found in data, give error:
+    matcher.plan(fields).log_missing()
+    with measure('mask', rows=len(records)):
+        return mask_records(records, strategies, copy=True)
+
+
+# Transformation without logging set up, for callers that configure it once
+# and transform many files:
+def transform_data(data_to_be_transformed, pii_fields):
     # Check that pii fields are given, give info if not:
     if len(pii_fields) == 0:
         logger.info('No PII fields given.')
     # Check that the extracted file has data, give error if not:
     if (type(data_to_be_transformed) is str or
        type(data_to_be_transformed) is list or
-       type(data_to_be_transformed) is bytes):
+       is_bytes_like(data_to_be_transformed)):
         if len(data_to_be_transformed) == 0:
             logger.error('Input file is blank.')
             return
@@ -38,50 +68,75 @@ def transformation_handler(data_to_be_transformed, pii_fields):
         if data_to_be_transformed.find(',') == -1:
             logger.error('Comma not used as delimiter in CSV.')
             return
-        # CSV to dataframe, assuming comma separation:
-        df_with_pii = pd.read_csv(StringIO(data_to_be_transformed), sep=",")
-    # JSON to dataframe:
+        # CSV is masked at the byte level, without a dataframe:
+        return csv_transformation(data_to_be_transformed.encode('utf-8'),
+                                  pii_fields)
+    # JSON records are masked as they are, without a dataframe, so fields
+    # outside the PII fields keep their types:
     elif type(data_to_be_transformed) is list:
-        df_with_pii = pd.DataFrame.from_dict(data_to_be_transformed)
-    # Parquet (assumed in binary) to dataframe:
-    elif type(data_to_be_transformed) is bytes:
-        buffer = BytesIO(data_to_be_transformed)
-        df_with_pii = pd.read_parquet(buffer)
+        return json_transformation(data_to_be_transformed, pii_fields)
+    # Parquet (assumed in binary, or a seekable parquet file) is masked row
+    # group by row group:
+    elif (is_bytes_like(data_to_be_transformed) or
+          hasattr(data_to_be_transformed, 'seek')):
+        return parquet_transformation(data_to_be_transformed, pii_fields)
     # If file is none of these data types, give error:
     else:
         logger.error('Unsupported data type.')
         return
-    # If dataframe is empty except headers, give error:
-    if df_with_pii.empty:
-        logger.error('Input data file has no content.')
+
+
+# ARROW TRANSFORMATION FUNCTION
+# Masks Arrow data held in memory (a pyarrow Table, RecordBatch, stream of
+# record batches or object with the Arrow PyCapsule interface) without
+# serialising it. Other columns are passed on without a copy:
+def arrow_transformation_handler(data_to_be_transformed, pii_fields):
+    setup_logging()
+    return arrow_transformation(data_to_be_transformed, pii_fields)
+
+
+# PARALLEL TRANSFORMATION FUNCTION
+# Splits one file into partitions masked on up to max_workers cores (all of
+# them by default). Takes the raw bytes of a CSV, NDJSON or parquet file:
+def parallel_transformation_handler(data_to_be_transformed, pii_fields,
+                                    file_format, max_workers=None):
+    setup_logging()
+    return parallel_transformation(data_to_be_transformed, pii_fields,
+                                   file_format, max_workers)
+
+
+# Number of bytes read from the stream and masked at a time:
+STREAM_READ_SIZE = READ_SIZE
+
+
+# STREAMING TRANSFORMATION FUNCTIONS
+# Reads a CSV, JSON or NDJSON stream chunk by chunk, yields obfuscated bytes:
+def stream_transformation_handler(stream, pii_fields,
+                                  chunk_size=STREAM_READ_SIZE,
+                                  file_format='csv'):
+    setup_logging()
+    yield from transform_stream(stream, pii_fields, file_format, chunk_size)
+
+
+# Streaming transformation without logging set up. JSON records are masked
+# one at a time, without a DataFrame:
+def transform_stream(stream, pii_fields, file_format='csv',
+                     chunk_size=STREAM_READ_SIZE):
+    if len(pii_fields) == 0:
+        logger.info('No PII fields given.')
+    if stream is None:
+        logger.error('Unsupported data type.')
         return
-    # If given PII field was not found in data, give error:
-    for item in pii_fields:
-        if item not in df_with_pii.columns:
-            logger.error(f'PII field "{item}" not found in file.')
-    df_anonymised = pd.DataFrame(columns=df_with_pii.columns)
-    # Transformation of PII columns to '***':
-    for column in df_with_pii.columns:
-        if column in pii_fields:
-            df_anonymised[column] = ['***'] * len(df_with_pii)
-        else:
-            df_anonymised[column] = df_with_pii[column]
-    # Return dataframe to original format:
-    # Dataframe to CSV:
-    if type(data_to_be_transformed) is str:
-        csv_buffer = io.BytesIO()
-        df_anonymised.to_csv(csv_buffer, index=False)
-        output = csv_buffer.getvalue()
-    # Dataframe to JSON:
-    elif type(data_to_be_transformed) is list:
-        json_string = df_anonymised.to_json(orient='records')
-        output = json.loads(json_string)
-    # Dataframe to parquet binary format:
-    elif type(data_to_be_transformed) is bytes:
-        buffer = BytesIO()
-        df_anonymised.to_parquet(buffer, index=False)
-        output = buffer.getvalue()
-    return output
+    # Reading the stream from S3 is timed as part of the mask stage:
+    # NDJSON and CSV rows are counted as lines of output:
+    if file_format in ('json', 'ndjson'):
+        yield from measure_stream('mask', json_stream_transformation(
+            stream, pii_fields, ndjson=(file_format == 'ndjson')),
+            header_lines=0 if file_format == 'ndjson' else None)
+        return
+    # CSV fields outside the PII columns are copied through unchanged:
+    yield from measure_stream('mask', csv_stream_transformation(
+        stream, pii_fields, chunk_size), header_lines=1)
 
 
 if __name__ == '__main__':
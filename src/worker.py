@@ -0,0 +1,333 @@
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED,
+                                ThreadPoolExecutor,
+                                wait)
+from urllib.parse import unquote_plus
+from botocore.exceptions import BotoCoreError, ClientError
+from src.extractor import (boto3,
+                           botocore_config,
+                           get_client,
+                           get_region,
+                           is_compressed_file,
+                           is_supported_file,
+                           is_ndjson_file,
+                           DEFAULT_MAX_POOL_CONNECTIONS)
+from src.instrumentation import log_stage_totals, setup_logging
+from src.batch import get_destination_url, process_object
+from src.cache import load_token_caches, log_cache_stats, save_token_caches
+
+
+# Logs to the handlers set up by worker_handler:
+logger = logging.getLogger(__name__)
+
+
+# WORKER
+# Long-running obfuscation worker fed by an SQS queue. Imports, S3 and SQS
+# clients, logging and token caches are set up once, so each file costs
+# only its own transfer and masking. A message is either an obfuscation
+# request, as taken by main:
+#     {"file_to_obfuscate": "s3://...", "pii_fields": [...],
+#      "destination": "s3://..."}
+# or an S3 event notification (directly or through SNS), whose files are
+# masked with the worker's pii_fields and written under its destination
+# prefix, keeping their keys.
+#
+# Messages are received and deleted in batches. While a file is being
+# masked its message is kept hidden by extending its visibility timeout,
+# so long files are not handed to another worker. Messages that fail are
+# left on the queue, to be retried or moved to a dead-letter queue by the
+# queue's redrive policy. Messages that cannot be read are deleted.
+#
+# Errors from SQS itself (throttling, the network, expired credentials) are
+# logged and the worker keeps polling, after waiting IDLE_WAIT on a failed
+# receive. Messages that could not be deleted are received again, and
+# messages whose visibility could not be extended may be handed to another
+# worker.
+
+DEFAULT_MAX_WORKERS = 4
+# SQS limits on a batch receive, delete or visibility change, and on long
+# polling:
+MAX_BATCH_SIZE = 10
+DEFAULT_WAIT_TIME = 20
+DEFAULT_VISIBILITY_TIMEOUT = 300
+# Seconds between polls of an empty queue while files are being masked,
+# and after a receive has failed:
+IDLE_WAIT = 1
+
+_queue_clients = {}
+_queue_clients_lock = threading.Lock()
+
+
+# SQS client, cached for the life of the process like the S3 clients:
+def get_queue_client(region_name=None, endpoint_url=None):
+    if region_name is None:
+        region_name = get_region()
+    key = (region_name, endpoint_url)
+    with _queue_clients_lock:
+        if key not in _queue_clients:
+            session = boto3.session.Session(region_name=region_name)
+            _queue_clients[key] = session.client(
+                'sqs', endpoint_url=endpoint_url,
+                config=botocore_config.Config(retries={'mode': 'adaptive'}))
+        return _queue_clients[key]
+
+
+class MessageError(ValueError):
+    pass
+
+
+# S3 URLs of the created objects in an S3 event notification. Test events
+# sent when notifications are set up have no records:
+def get_event_urls(event):
+    urls = []
+    for record in event.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated'):
+            continue
+        bucket = record['s3']['bucket']['name']
+        # Keys in events are URL encoded, with '+' for spaces:
+        key = unquote_plus(record['s3']['object']['key'])
+        urls.append(f's3://{bucket}/{key}')
+    return urls
+
+
+# Obfuscation requests in a message body, as dictionaries with
+# file_to_obfuscate, pii_fields and destination:
+def parse_message(body, pii_fields=None, destination=None):
+    try:
+        message = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise MessageError(f'Message is not JSON: {e}')
+    if not isinstance(message, dict):
+        raise MessageError('Message is not a JSON object.')
+    # S3 events published to SNS arrive wrapped in a notification:
+    if message.get('Type') == 'Notification' and 'Message' in message:
+        return parse_message(message['Message'], pii_fields, destination)
+    if 'file_to_obfuscate' in message:
+        if 'pii_fields' not in message:
+            raise MessageError('Request has no pii_fields.')
+        return [message]
+    if 'Records' in message or message.get('Event') == 's3:TestEvent':
+        if pii_fields is None or destination is None:
+            raise MessageError('Worker has no pii_fields or destination for '
+                               'S3 events.')
+        try:
+            urls = get_event_urls(message)
+        except (KeyError, TypeError) as e:
+            raise MessageError(f'S3 event could not be read: {e}')
+        return [{'file_to_obfuscate': url, 'pii_fields': pii_fields,
+                 'destination': get_destination_url(url, destination)}
+                for url in urls
+                if is_supported_file(url) or is_ndjson_file(url) or
+                is_compressed_file(url)]
+    raise MessageError('Message is neither a request nor an S3 event.')
+
+
+# Polls a queue and obfuscates the files of its messages on a pool of
+# threads, with at most max_workers messages in hand at a time:
+class ObfuscationWorker:
+    def __init__(self, queue_url, pii_fields=None, destination=None,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 wait_time=DEFAULT_WAIT_TIME,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+                 client=None, queue_client=None):
+        self.queue_url = queue_url
+        self.pii_fields = pii_fields
+        self.destination = destination
+        self.max_workers = max_workers
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        # One S3 client for all threads, with a connection for each:
+        self.client = client or get_client(
+            max_pool_connections=max(max_workers,
+                                     DEFAULT_MAX_POOL_CONNECTIONS))
+        self.queue_client = queue_client or get_queue_client()
+        self.stopped = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Receipt handle of each message being processed, by its future:
+        self.__in_flight = {}
+        self.__extended = time.monotonic()
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    # Obfuscates every file of a message, errors are raised:
+    def process_message(self, message):
+        requests = parse_message(message['Body'], self.pii_fields,
+                                 self.destination)
+        results = []
+        for request in requests:
+            destination_url = request.get('destination')
+            if destination_url is None:
+                raise MessageError(f"No destination for "
+                                   f"{request['file_to_obfuscate']}.")
+            results.append(process_object(
+                self.client, request['file_to_obfuscate'],
+                request['pii_fields'], destination_url))
+        return results
+
+    # Processes a message, gives whether it can be deleted:
+    def handle_message(self, message):
+        try:
+            for result in self.process_message(message):
+                logger.info(f"Obfuscated {result['source']} to "
+                            f"{result['destination']} in "
+                            f"{result['seconds']:.3f}s.")
+            return True
+        except MessageError as e:
+            logger.error(f"Message {message['MessageId']} deleted, it "
+                         f"could not be read: {e}")
+            return True
+        except Exception as e:
+            logger.error(f"Message {message['MessageId']} failed, it will "
+                         f"be retried: {e}")
+            return False
+
+    # Takes up to count messages and submits them. Gives the number taken,
+    # or None if the queue could not be read:
+    def receive(self, count, wait_time):
+        try:
+            response = self.queue_client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(count, MAX_BATCH_SIZE),
+                WaitTimeSeconds=wait_time,
+                VisibilityTimeout=self.visibility_timeout)
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Messages could not be received: {e}")
+            # Backs off, unless the worker is stopped meanwhile:
+            self.stopped.wait(IDLE_WAIT)
+            return
+        messages = response.get('Messages', [])
+        for message in messages:
+            future = self.__executor.submit(self.handle_message, message)
+            self.__in_flight[future] = message['ReceiptHandle']
+        return len(messages)
+
+    # Deletes the messages of finished work that succeeded:
+    def collect(self, futures):
+        handles = []
+        for future in futures:
+            handle = self.__in_flight.pop(future)
+            if future.result():
+                self.processed += 1
+                handles.append(handle)
+            else:
+                self.failed += 1
+        for start in range(0, len(handles), MAX_BATCH_SIZE):
+            entries = [{'Id': str(i), 'ReceiptHandle': handle}
+                       for i, handle in enumerate(
+                           handles[start:start + MAX_BATCH_SIZE])]
+            try:
+                response = self.queue_client.delete_message_batch(
+                    QueueUrl=self.queue_url, Entries=entries)
+            except (ClientError, BotoCoreError) as e:
+                logger.error(f"Messages could not be deleted, they will be "
+                             f"received again: {e}")
+                continue
+            for failure in response.get('Failed', []):
+                logger.error(f"Message could not be deleted: "
+                             f"{failure.get('Message')}")
+
+    # Keeps messages in hand hidden, once half their timeout has passed:
+    def extend_visibility(self):
+        if time.monotonic() - self.__extended < self.visibility_timeout / 2:
+            return
+        self.__extended = time.monotonic()
+        handles = list(self.__in_flight.values())
+        for start in range(0, len(handles), MAX_BATCH_SIZE):
+            entries = [{'Id': str(i), 'ReceiptHandle': handle,
+                        'VisibilityTimeout': self.visibility_timeout}
+                       for i, handle in enumerate(
+                           handles[start:start + MAX_BATCH_SIZE])]
+            try:
+                response = self.queue_client.change_message_visibility_batch(
+                    QueueUrl=self.queue_url, Entries=entries)
+            except (ClientError, BotoCoreError) as e:
+                logger.error(f"Message visibility could not be extended: "
+                             f"{e}")
+                continue
+            for failure in response.get('Failed', []):
+                logger.error(f"Message visibility could not be extended: "
+                             f"{failure.get('Message')}")
+
+    # Polls until stopped, or until the queue is empty with stop_when_empty.
+    # Work in hand is finished before returning:
+    def run(self, stop_when_empty=False):
+        while not self.stopped.is_set():
+            free = self.max_workers - len(self.__in_flight)
+            received = 0
+            if free > 0:
+                # Long polls only while idle, so finished work is deleted
+                # without waiting:
+                received = self.receive(
+                    free, 0 if self.__in_flight else self.wait_time)
+            # A queue that could not be read is polled again:
+            if stop_when_empty and received == 0 and not self.__in_flight:
+                break
+            received = received or 0
+            if self.__in_flight:
+                # Waits for work to finish while no more can be taken, or
+                # briefly while the queue is empty:
+                if free <= received:
+                    timeout = self.visibility_timeout / 4
+                else:
+                    timeout = 0 if received else IDLE_WAIT
+                done, _ = wait(list(self.__in_flight), timeout=timeout,
+                               return_when=FIRST_COMPLETED)
+                self.collect(done)
+                self.extend_visibility()
+        while self.__in_flight:
+            done, _ = wait(list(self.__in_flight),
+                           timeout=self.visibility_timeout / 4,
+                           return_when=FIRST_COMPLETED)
+            self.collect(done)
+            self.extend_visibility()
+        return {'processed': self.processed, 'failed': self.failed}
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+
+
+# Worker entry point, takes a JSON with "queue_url" and, for S3 events,
+# "pii_fields" and "destination". Runs until SIGTERM or SIGINT:
+def worker_handler(json_file, stop_when_empty=False):
+    logger = setup_logging()
+    try:
+        json_loaded = json.loads(json_file)
+        worker = ObfuscationWorker(
+            json_loaded['queue_url'],
+            pii_fields=json_loaded.get('pii_fields'),
+            destination=json_loaded.get('destination'),
+            max_workers=json_loaded.get('max_workers', DEFAULT_MAX_WORKERS),
+            wait_time=json_loaded.get('wait_time', DEFAULT_WAIT_TIME),
+            visibility_timeout=json_loaded.get('visibility_timeout',
+                                               DEFAULT_VISIBILITY_TIMEOUT))
+    except Exception as error:
+        logger.error('An unexpected error has occurred: %s', error)
+        return
+    # Signals can only be handled in the main thread:
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+    load_token_caches()
+    logger.info(f'Worker polling {worker.queue_url}.')
+    try:
+        summary = worker.run(stop_when_empty=stop_when_empty)
+    finally:
+        worker.close()
+        log_cache_stats()
+        save_token_caches()
+        log_stage_totals()
+    logger.info(f"Worker stopped after {summary['processed']} messages, "
+                f"{summary['failed']} failed.")
+    return summary
+
+
+if __name__ == '__main__':
+    worker_handler(sys.argv[1])
@@ -0,0 +1,45 @@
+import boto3
+import logging
+import os
+import pytest
+from moto import mock_s3, mock_sqs
+
+# Buckets created in the mocked S3 of the s3_client fixture:
+TEST_BUCKETS = ("my_ingestion_bucket", "my_output_bucket")
+
+
+# Contents of the test log, with everything logged so far written out:
+def read_log():
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+    with open('log.txt', 'r') as log_file:
+        return log_file.read()
+
+
+def set_test_credentials():
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+# S3 client of a mocked S3 with empty ingestion and output buckets:
+@pytest.fixture
+def s3_client():
+    set_test_credentials()
+    with mock_s3():
+        client = boto3.client("s3", region_name="eu-west-2")
+        for bucket in TEST_BUCKETS:
+            client.create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={
+                    "LocationConstraint": "eu-west-2"})
+        yield client
+
+
+# SQS client of a mocked SQS, and the URL of an empty queue:
+@pytest.fixture
+def sqs_queue():
+    set_test_credentials()
+    with mock_sqs():
+        client = boto3.client("sqs", region_name="eu-west-2")
+        queue_url = client.create_queue(QueueName="obfuscation")['QueueUrl']
+        yield client, queue_url
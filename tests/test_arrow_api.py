@@ -0,0 +1,106 @@
+from src.transformer import arrow_transformation_handler
+import pandas as pd
+import pyarrow as pa
+from tests.conftest import read_log
+
+
+test_table = pa.table({
+    "student_id": [1234, 1235, 1236],
+    "name": ["John Smith", "Joe Smith", None],
+    "contact": [{"email": "j@email.com", "phone": "0123"},
+                {"email": "jo@email.com", "phone": "0456"},
+                None]
+})
+
+
+# Address of the data buffer of a column's first chunk:
+def data_address(column):
+    if isinstance(column, pa.ChunkedArray):
+        column = column.chunk(0)
+    return column.buffers()[1].address
+
+
+# Exposes a table only through the Arrow PyCapsule stream interface:
+class CapsuleStream():
+    def __init__(self, table):
+        self.table = table
+
+    def __arrow_c_stream__(self, requested_schema=None):
+        return self.table.__arrow_c_stream__(requested_schema)
+
+
+# Test tables and record batches are masked without copying other columns:
+class TestArrowTables():
+    def test_table_is_masked(self):
+        output = arrow_transformation_handler(test_table, ["name"])
+        assert isinstance(output, pa.Table)
+        assert output.column("name").to_pylist() == ["***"] * 3
+        assert output.column("contact").equals(test_table.column("contact"))
+
+    def test_non_pii_columns_are_not_copied(self):
+        output = arrow_transformation_handler(test_table, ["name"])
+        assert data_address(output.column("student_id")) == \
+            data_address(test_table.column("student_id"))
+
+    def test_record_batch_is_returned_as_record_batch(self):
+        batch = test_table.to_batches()[0]
+        output = arrow_transformation_handler(batch, ["name"])
+        assert isinstance(output, pa.RecordBatch)
+        assert output.column("name").to_pylist() == ["***"] * 3
+        assert data_address(output.column("student_id")) == \
+            data_address(batch.column("student_id"))
+
+    def test_struct_fields_are_masked(self):
+        output = arrow_transformation_handler(test_table, ["contact.email"])
+        assert output.column("contact").to_pylist() == [
+            {"email": "***", "phone": "0123"},
+            {"email": "***", "phone": "0456"},
+            None]
+
+    def test_strategies_are_applied(self):
+        output = arrow_transformation_handler(test_table, {"name": "hash"})
+        names = output.column("name").to_pylist()
+        assert names[0] != "John Smith" and names[0] != names[1]
+
+    def test_pandas_frame_is_masked(self):
+        frame = pd.DataFrame({"name": ["John Smith"], "id": [1]})
+        output = arrow_transformation_handler(frame, ["name"])
+        assert output.to_pylist() == [{"name": "***", "id": 1}]
+
+    def test_missing_field_is_logged(self):
+        arrow_transformation_handler(test_table, ["name", "address"])
+        assert 'PII field "address" not found in file.' in read_log()
+
+
+# Test streams of record batches are masked as they are read:
+class TestArrowStreams():
+    def test_reader_is_masked(self):
+        reader = pa.RecordBatchReader.from_batches(
+            test_table.schema, test_table.to_batches(max_chunksize=1))
+        output = arrow_transformation_handler(reader, ["name"])
+        assert isinstance(output, pa.RecordBatchReader)
+        result = output.read_all()
+        assert result.column("name").to_pylist() == ["***"] * 3
+        assert result.column("student_id").equals(
+            test_table.column("student_id"))
+
+    def test_batch_iterable_is_masked(self):
+        batches = iter(test_table.to_batches(max_chunksize=2))
+        output = arrow_transformation_handler(batches, ["contact.phone"])
+        result = output.read_all()
+        assert result.num_rows == 3
+        assert result.column("contact").to_pylist()[0] == \
+            {"email": "j@email.com", "phone": "***"}
+
+    def test_capsule_stream_is_masked(self):
+        output = arrow_transformation_handler(CapsuleStream(test_table),
+                                              ["name"])
+        assert output.read_all().column("name").to_pylist() == ["***"] * 3
+
+    def test_empty_iterable(self):
+        assert arrow_transformation_handler(iter([]), ["name"]) is None
+        assert 'Input data file has no content.' in read_log()
+
+    def test_unsupported_data(self):
+        assert arrow_transformation_handler(42, ["name"]) is None
+        assert 'Unsupported data type.' in read_log()
@@ -0,0 +1,250 @@
+from src.async_pipeline import (async_get_bytes,
+                                async_put_bytes,
+                                async_batch_obfuscate,
+                                async_extraction_handler)
+import asyncio
+import gzip
+import json
+import os
+import pytest
+from botocore.exceptions import ClientError
+from src.loader import MIN_PART_SIZE
+
+test_csv = b"""student_id,name,course,email_address
+1234,'John Smith','Software','j.smith@email.com'
+"""
+
+
+# In-memory stand-in for an aiobotocore S3 client:
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def read(self):
+        return self.data
+
+
+class FakePaginator:
+    def __init__(self, objects):
+        self.objects = objects
+
+    async def paginate(self, Bucket, Prefix):
+        yield {'Contents': [
+            {'Key': key.split('/', 1)[1], 'Size': len(body)}
+            for key, body in sorted(self.objects.items())
+            if key.startswith(f'{Bucket}/{Prefix}')]}
+
+
+class FakeAsyncS3:
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.requests = []
+        self.parts = {}
+
+    async def get_object(self, Bucket, Key, Range=None):
+        self.requests.append(('get_object', Key, Range))
+        if f'{Bucket}/{Key}' not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data = self.objects[f'{Bucket}/{Key}']
+        if Range is None:
+            return {'Body': FakeBody(data)}
+        if len(data) == 0:
+            raise ClientError({'Error': {'Code': 'InvalidRange'}},
+                              'GetObject')
+        start, end = map(int, Range[len('bytes='):].split('-'))
+        end = min(end, len(data) - 1)
+        return {'Body': FakeBody(data[start:end + 1]),
+                'ContentRange': f'bytes {start}-{end}/{len(data)}'}
+
+    async def put_object(self, Bucket, Key, Body):
+        self.requests.append(('put_object', Key, None))
+        self.objects[f'{Bucket}/{Key}'] = bytes(Body)
+
+    async def create_multipart_upload(self, Bucket, Key):
+        return {'UploadId': 'upload'}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.requests.append(('upload_part', Key, PartNumber))
+        self.parts[PartNumber] = bytes(Body)
+        return {'ETag': str(PartNumber)}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                        MultipartUpload):
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        self.objects[f'{Bucket}/{Key}'] = b''.join(
+            self.parts[number] for number in numbers)
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.parts.clear()
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self.objects)
+
+
+# Test object reads and writes:
+class TestAsyncObjectIO():
+    def test_small_object_is_read_in_one_request(self):
+        client = FakeAsyncS3({'bucket/file1.csv': test_csv})
+        data = asyncio.run(async_get_bytes(client, 'bucket', 'file1.csv'))
+        assert data == test_csv
+        assert len(client.requests) == 1
+
+    def test_large_object_is_read_in_ranges(self):
+        body = os.urandom(10 * 1024 + 7)
+        client = FakeAsyncS3({'bucket/file1.pqt': body})
+        data = asyncio.run(async_get_bytes(client, 'bucket', 'file1.pqt',
+                                           range_size=1024))
+        assert data == body
+        assert len(client.requests) == 11
+        assert client.requests[-1][2] == 'bytes=10240-10246'
+
+    def test_empty_object_is_read(self):
+        client = FakeAsyncS3({'bucket/file1.csv': b''})
+        data = asyncio.run(async_get_bytes(client, 'bucket', 'file1.csv'))
+        assert data == b''
+
+    def test_large_output_is_uploaded_in_parts(self):
+        body = os.urandom(MIN_PART_SIZE * 2 + 5)
+        client = FakeAsyncS3()
+        result = asyncio.run(async_put_bytes(client, 'bucket', 'out.csv',
+                                             body, part_size=MIN_PART_SIZE))
+        assert result == {'parts': 3, 'bytes': len(body)}
+        assert client.objects['bucket/out.csv'] == body
+
+
+# Test the async batch pipeline:
+class TestAsyncBatch():
+    def test_prefix_is_obfuscated_to_destination(self):
+        client = FakeAsyncS3({
+            'inbucket/new_data/file1.csv': test_csv,
+            'inbucket/new_data/file2.json': json.dumps(
+                [{"name": "John Smith", "course": "Software"}]).encode(),
+            'inbucket/new_data/notes.txt': b'not data',
+        })
+        output = asyncio.run(async_batch_obfuscate(
+            ["name", "email_address"],
+            s3_prefix="s3://inbucket/new_data/",
+            destination="s3://outbucket/out", max_in_flight=2,
+            client=client))
+        assert output['summary']['files'] == 2
+        assert output['summary']['succeeded'] == 2
+        assert client.objects['outbucket/out/file1.csv'] == b"""student_id,\
+name,course,email_address
+1234,***,'Software',***
+"""
+        assert json.loads(client.objects['outbucket/out/file2.json']) == [
+            {"name": "***", "course": "Software"}]
+
+    def test_errors_are_returned_per_file(self):
+        client = FakeAsyncS3({'inbucket/file1.csv': test_csv})
+        output = asyncio.run(async_batch_obfuscate(
+            ["name"], s3_urls=["s3://inbucket/file1.csv",
+                               "s3://inbucket/missing.csv"],
+            client=client))
+        assert output['results'][0]['data'].startswith(b"student_id,name")
+        assert output['results'][1]['status'] == 'error'
+        assert output['summary']['failed'] == 1
+
+    def test_ndjson_and_compressed_files_are_streamed(self):
+        ndjson = b'{"name": "John Smith", "course": "Software"}\n' * 2
+        client = FakeAsyncS3({
+            'inbucket/new_data/file1.ndjson': ndjson,
+            'inbucket/new_data/file2.csv.gz': gzip.compress(test_csv),
+            'inbucket/new_data/file3.jsonl.gz': gzip.compress(ndjson),
+        })
+        output = asyncio.run(async_batch_obfuscate(
+            ["name"], s3_prefix="s3://inbucket/new_data/",
+            destination="s3://outbucket/out", client=client))
+        assert output['summary']['succeeded'] == 3
+        masked_ndjson = b'{"name": "***", "course": "Software"}\n' * 2
+        assert client.objects['outbucket/out/file1.ndjson'] == masked_ndjson
+        assert gzip.decompress(client.objects[
+            'outbucket/out/file2.csv.gz']) == \
+            test_csv.replace(b"'John Smith'", b"***")
+        assert gzip.decompress(client.objects[
+            'outbucket/out/file3.jsonl.gz']) == masked_ndjson
+
+    def test_local_sources_are_rejected(self, tmp_path):
+        with pytest.raises(ValueError, match="not an S3 URL"):
+            asyncio.run(async_batch_obfuscate(
+                ["name"], s3_prefix=str(tmp_path), client=FakeAsyncS3()))
+        output = asyncio.run(async_batch_obfuscate(
+            ["name"], s3_urls=[str(tmp_path / "file1.csv")],
+            client=FakeAsyncS3()))
+        assert "not an S3 URL" in output['results'][0]['error']
+
+
+# Test the async extraction handler:
+class TestAsyncExtractionHandler():
+    def test_json_is_read_and_parsed(self):
+        client = FakeAsyncS3({'inbucket/file1.json': b'[{"name": "Jo"}]'})
+        data = asyncio.run(async_extraction_handler(
+            "s3://inbucket/file1.json", client))
+        assert data == [{"name": "Jo"}]
+
+    def test_file_not_found(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        asyncio.run(async_extraction_handler("s3://inbucket/file1.csv",
+                                             FakeAsyncS3()))
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert "File not found." in log_contents
+
+    def test_non_correct_file_type(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        asyncio.run(async_extraction_handler("s3://inbucket/file1.jpg",
+                                             FakeAsyncS3()))
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert "File is not csv or json or parquet format." in log_contents
+
+
+# Runs the pipeline with aiobotocore against a moto server, when moto's
+# server dependencies (flask) are installed:
+class TestAsyncPipelineAgainstMoto():
+    def test_batch_against_moto_server(self):
+        pytest.importorskip("flask")
+        import boto3
+        from moto.server import ThreadedMotoServer
+        from aiobotocore.session import get_session
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        server = ThreadedMotoServer(port=5055, verbose=False)
+        server.start()
+        try:
+            endpoint = "http://127.0.0.1:5055"
+            client = boto3.client("s3", region_name="eu-west-2",
+                                  endpoint_url=endpoint)
+            client.create_bucket(
+                Bucket="my_ingestion_bucket",
+                CreateBucketConfiguration={
+                    "LocationConstraint": "eu-west-2"})
+            client.put_object(Bucket="my_ingestion_bucket",
+                              Key="new_data/file1.csv", Body=test_csv)
+
+            async def run():
+                async with get_session().create_client(
+                        "s3", region_name="eu-west-2",
+                        endpoint_url=endpoint) as async_client:
+                    return await async_batch_obfuscate(
+                        ["name"],
+                        s3_prefix="s3://my_ingestion_bucket/new_data/",
+                        destination="s3://my_ingestion_bucket/out/",
+                        client=async_client)
+
+            output = asyncio.run(run())
+            assert output['summary']['succeeded'] == 1
+            result = client.get_object(Bucket="my_ingestion_bucket",
+                                       Key="out/file1.csv")['Body'].read()
+            assert result.startswith(b"student_id,name,course,email_address"
+                                     b"\n1234,***,")
+        finally:
+            server.stop()
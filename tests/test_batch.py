@@ -0,0 +1,297 @@
+from src.batch import (batch_handler,
+                       batch_obfuscate,
+                       get_destination_url,
+                       list_sources)
+import json
+import os
+import pandas as pd
+import pytest
+
+test_csv = b"""student_id,name,course,email_address
+1234,'John Smith','Software','j.smith@email.com'
+"""
+test_json = [{"student_id": 1234, "name": "John Smith",
+              "email_address": "j.smith@email.com"}]
+
+
+# Source files in the mocked buckets of conftest:
+@pytest.fixture
+def s3_client(s3_client):
+    for i in range(3):
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key=f"new_data/file{i}.csv", Body=test_csv)
+    s3_client.put_object(Bucket="my_ingestion_bucket",
+                         Key="new_data/nested/file.json",
+                         Body=json.dumps(test_json))
+    s3_client.put_object(Bucket="my_ingestion_bucket",
+                         Key="new_data/notes.txt", Body=b"not data")
+    return s3_client
+
+
+def get_body(client, key):
+    return client.get_object(Bucket="my_output_bucket",
+                             Key=key)['Body'].read()
+
+
+# Test batch helpers:
+class TestBatchHelpers():
+    def test_list_sources_skips_unsupported_files(self, s3_client):
+        sources = list_sources(s3_client, "s3://my_ingestion_bucket/new_data/")
+        assert [url for url, size in sources] == [
+            "s3://my_ingestion_bucket/new_data/file0.csv",
+            "s3://my_ingestion_bucket/new_data/file1.csv",
+            "s3://my_ingestion_bucket/new_data/file2.csv",
+            "s3://my_ingestion_bucket/new_data/nested/file.json"]
+        assert sources[0][1] == len(test_csv)
+
+    def test_destination_keeps_path_under_prefix(self):
+        assert get_destination_url(
+            "s3://my_ingestion_bucket/new_data/nested/file.json",
+            "s3://my_output_bucket/out/",
+            "s3://my_ingestion_bucket/new_data/") == \
+            "s3://my_output_bucket/out/nested/file.json"
+
+    def test_destination_keeps_full_key_without_prefix(self):
+        assert get_destination_url(
+            "s3://my_ingestion_bucket/new_data/file1.csv",
+            "s3://my_output_bucket") == \
+            "s3://my_output_bucket/new_data/file1.csv"
+
+
+# Test batch obfuscation against moto:
+class TestBatchObfuscate():
+    def test_prefix_is_obfuscated_to_destination(self, s3_client):
+        output = batch_obfuscate(
+            ["name", "email_address"],
+            s3_prefix="s3://my_ingestion_bucket/new_data/",
+            destination="s3://my_output_bucket/out/",
+            max_workers=4, client=s3_client)
+        assert output['summary']['files'] == 4
+        assert output['summary']['succeeded'] == 4
+        assert output['summary']['failed'] == 0
+        assert get_body(s3_client, "out/file1.csv") == b"""student_id,\
+name,course,email_address
+1234,***,'Software',***
+"""
+        assert json.loads(get_body(s3_client, "out/nested/file.json")) == [
+            {"student_id": 1234, "name": "***", "email_address": "***"}]
+
+    def test_url_list_returns_data_and_errors_per_file(self, s3_client):
+        output = batch_obfuscate(
+            ["name"],
+            s3_urls=["s3://my_ingestion_bucket/new_data/file0.csv",
+                     "s3://my_ingestion_bucket/new_data/missing.csv"],
+            client=s3_client)
+        results = output['results']
+        assert results[0]['status'] == 'ok'
+        assert results[0]['data'].startswith(b"student_id,name")
+        assert results[1]['status'] == 'error'
+        assert 'NoSuchKey' in results[1]['error']
+        assert output['summary']['failed'] == 1
+        assert output['summary']['files_per_sec'] > 0
+
+    def test_unsupported_url_is_rejected(self, s3_client):
+        output = batch_obfuscate(
+            ["name"], s3_urls=["s3://my_ingestion_bucket/new_data/notes.txt"],
+            client=s3_client)
+        assert output['results'][0]['error'] == \
+            "Unsupported file type: s3://my_ingestion_bucket/new_data/" \
+            "notes.txt"
+
+    def test_dry_run_plans_without_obfuscating(self, s3_client):
+        output = batch_obfuscate(
+            ["name"], s3_prefix="s3://my_ingestion_bucket/new_data/",
+            s3_urls=["s3://my_ingestion_bucket/new_data/missing.csv"],
+            destination="s3://my_output_bucket/out/", client=s3_client,
+            dry_run=True)
+        assert [job['destination'] for job in output['plan']][-1] == \
+            "s3://my_output_bucket/out/new_data/missing.csv"
+        assert output['summary']['planned'] == 5
+        assert output['summary']['unknown_sizes'] == 1
+        assert output['summary']['bytes'] == sum(
+            job['version']['size'] for job in output['plan'][:4])
+        listing = s3_client.list_objects_v2(Bucket="my_output_bucket")
+        assert listing['KeyCount'] == 0
+
+    def test_progress_is_called_for_each_file(self, s3_client):
+        calls = []
+        batch_obfuscate(
+            ["name"], s3_prefix="s3://my_ingestion_bucket/new_data/",
+            destination="s3://my_output_bucket/out/", client=s3_client,
+            progress=lambda result, total: calls.append(total))
+        assert calls == [4] * 4
+
+    def test_ndjson_is_streamed(self, s3_client):
+        body = b"".join(json.dumps(record).encode() + b"\n"
+                        for record in test_json * 3)
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key="new_data/file.ndjson", Body=body)
+        output = batch_obfuscate(
+            ["name"],
+            s3_urls=["s3://my_ingestion_bucket/new_data/file.ndjson"],
+            destination="s3://my_output_bucket/out/", client=s3_client)
+        assert output['summary']['succeeded'] == 1
+        lines = get_body(s3_client, "out/new_data/file.ndjson").splitlines()
+        assert [json.loads(line)["name"] for line in lines] == ["***"] * 3
+
+    def test_input_format_reads_files_without_extension(self, s3_client):
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key="exports/part-0000", Body=test_csv)
+        output = batch_obfuscate(
+            ["name"], s3_prefix="s3://my_ingestion_bucket/exports/",
+            destination="s3://my_output_bucket/out/", client=s3_client,
+            input_format="csv")
+        assert output['summary']['succeeded'] == 1
+        assert get_body(s3_client, "out/part-0000") == test_csv.replace(
+            b"'John Smith'", b"***")
+
+    def test_unknown_input_format_is_rejected(self, s3_client):
+        with pytest.raises(ValueError, match="xml"):
+            batch_obfuscate(
+                ["name"], s3_prefix="s3://my_ingestion_bucket/new_data/",
+                client=s3_client, input_format="xml")
+
+    def test_stream_gives_the_same_output(self, s3_client):
+        outputs = []
+        for stream in (False, True):
+            destination = f"s3://my_output_bucket/{stream}/"
+            batch_obfuscate(
+                ["name"], s3_prefix="s3://my_ingestion_bucket/new_data/",
+                destination=destination, client=s3_client, stream=stream)
+            outputs.append([
+                get_body(s3_client, f"{stream}/{key}")
+                for key in ("file0.csv", "nested/file.json")])
+        assert outputs[0][0] == outputs[1][0]
+        assert json.loads(outputs[0][1]) == json.loads(outputs[1][1])
+
+    def test_token_cache_is_shared_and_saved(self, s3_client, tmp_path,
+                                             monkeypatch):
+        from src.cache import clear_token_caches
+        path = tmp_path / "tokens.json"
+        monkeypatch.setenv("OBFUSCATOR_TOKEN_CACHE_FILE", str(path))
+        clear_token_caches()
+        output = batch_obfuscate(
+            {"name": "hash"},
+            s3_urls=[f"s3://my_ingestion_bucket/new_data/file{i}.csv"
+                     for i in range(3)],
+            max_workers=1, client=s3_client)
+        stats = output['summary']['token_caches']['hash-16']
+        assert stats['misses'] == 1
+        assert stats['hits'] == 2
+        assert path.exists()
+
+
+# Test files unchanged since the last run are skipped:
+class TestBatchManifest():
+    def test_unchanged_files_are_skipped(self, s3_client, tmp_path):
+        manifest = str(tmp_path / "manifest.json")
+        options = dict(s3_prefix="s3://my_ingestion_bucket/new_data/",
+                       destination="s3://my_output_bucket/out/",
+                       client=s3_client, manifest=manifest)
+        first = batch_obfuscate(["name"], **options)
+        assert first['summary']['succeeded'] == 4
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key="new_data/file1.csv",
+                             Body=test_csv + b"5678,'Jo','Data','j@e.com'\n")
+        second = batch_obfuscate(["name"], **options)
+        assert second['summary']['skipped'] == 3
+        assert second['summary']['succeeded'] == 1
+        assert [r['source'] for r in second['results']
+                if r['status'] == 'ok'] == [
+            "s3://my_ingestion_bucket/new_data/file1.csv"]
+        assert b"5678,***" in get_body(s3_client, "out/file1.csv")
+
+    def test_changed_pii_fields_obfuscate_again(self, s3_client, tmp_path):
+        manifest = "s3://my_output_bucket/manifests/run.json"
+        urls = [f"s3://my_ingestion_bucket/new_data/file{i}.csv"
+                for i in range(3)]
+        options = dict(s3_urls=urls, client=s3_client, manifest=manifest,
+                       destination="s3://my_output_bucket/out/")
+        batch_obfuscate(["name"], **options)
+        assert batch_obfuscate(["name"], **options)[
+            'summary']['skipped'] == 3
+        output = batch_obfuscate(["name", "email_address"], **options)
+        assert output['summary']['skipped'] == 0
+        assert output['summary']['succeeded'] == 3
+
+    def test_changed_compression_level_obfuscates_again(self, s3_client,
+                                                        tmp_path):
+        options = dict(s3_prefix="s3://my_ingestion_bucket/new_data/",
+                       client=s3_client, manifest=str(tmp_path / "run.json"),
+                       destination="s3://my_output_bucket/out/",
+                       compression="gzip")
+        batch_obfuscate(["name"], compression_level=1, **options)
+        assert batch_obfuscate(["name"], compression_level=1, **options)[
+            'summary']['skipped'] == 4
+        output = batch_obfuscate(["name"], compression_level=9, **options)
+        assert output['summary']['skipped'] == 0
+        assert output['summary']['succeeded'] == 4
+
+    def test_failed_files_are_not_recorded(self, s3_client, tmp_path):
+        manifest = str(tmp_path / "manifest.json")
+        urls = ["s3://my_ingestion_bucket/new_data/missing.csv"]
+        for _ in range(2):
+            output = batch_obfuscate(
+                ["name"], s3_urls=urls, client=s3_client, manifest=manifest,
+                destination="s3://my_output_bucket/out/")
+            assert output['summary']['failed'] == 1
+
+    def test_manifest_needs_destination(self, s3_client, tmp_path):
+        with pytest.raises(ValueError):
+            batch_obfuscate(["name"], s3_urls=[], client=s3_client,
+                            manifest=str(tmp_path / "manifest.json"))
+
+
+# Test local directories are obfuscated without S3:
+class TestBatchLocalFiles():
+    def test_directory_is_obfuscated_to_directory(self, tmp_path):
+        source = tmp_path / "new_data"
+        (source / "nested").mkdir(parents=True)
+        (source / "file1.csv").write_bytes(test_csv)
+        (source / "nested" / "file2.json").write_text(json.dumps(test_json))
+        (source / "file3.ndjson").write_text(json.dumps(test_json[0]))
+        destination = tmp_path / "out"
+        options = dict(s3_prefix=str(source), destination=str(destination),
+                       manifest=str(tmp_path / "manifest.json"))
+        output = batch_obfuscate(["name"], **options)
+        assert output['summary']['succeeded'] == 3
+        assert b"1234,***" in (destination / "file1.csv").read_bytes()
+        assert json.loads((destination / "nested" / "file2.json")
+                          .read_text())[0]['name'] == "***"
+        assert b'"name": "***"' in (destination / "file3.ndjson").read_bytes()
+        assert batch_obfuscate(["name"], **options)[
+            'summary']['skipped'] == 3
+
+    def test_input_format_parquet(self, tmp_path):
+        source = tmp_path / "new_data"
+        source.mkdir()
+        pd.DataFrame(test_json).to_parquet(source / "part-0000")
+        destination = tmp_path / "out"
+        output = batch_obfuscate(["name"], s3_prefix=str(source),
+                                 destination=str(destination),
+                                 input_format="parquet")
+        assert output['summary']['succeeded'] == 1
+        masked = pd.read_parquet(destination / "part-0000")
+        assert masked["name"].tolist() == ["***"]
+        assert masked["student_id"].tolist() == [1234]
+
+
+# Test batch JSON entry point:
+class TestBatchHandler():
+    def test_batch_handler_reads_json(self, s3_client):
+        output = batch_handler(json.dumps({
+            "files_to_obfuscate": [
+                "s3://my_ingestion_bucket/new_data/file2.csv"],
+            "pii_fields": ["name"],
+            "destination": "s3://my_output_bucket"}))
+        assert output['summary']['succeeded'] == 1
+        assert get_body(s3_client, "new_data/file2.csv").startswith(
+            b"student_id,name,course,email_address\n1234,***,")
+
+    def test_batch_handler_logs_errors(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        batch_handler('{"pii_fields": ["name"]}')
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert 'No files or prefix given to obfuscate.' in log_contents
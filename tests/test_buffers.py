@@ -0,0 +1,65 @@
+from src.buffers import SpillBuffer
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+
+# Test buffers stay in memory while small and spill to disk when large:
+class TestSpillBuffer():
+    def test_small_buffer_stays_in_memory(self):
+        buffer = SpillBuffer(threshold=100)
+        buffer.write(b"student_id,name\n")
+        buffer.write(b"1234,***\n")
+        assert not buffer.spilled
+        assert len(buffer) == 25
+        assert buffer.getbuffer() == b"student_id,name\n1234,***\n"
+
+    def test_large_buffer_spills_to_file(self, tmp_path):
+        buffer = SpillBuffer(threshold=10, spill_dir=str(tmp_path))
+        buffer.write(b"0123456789")
+        assert not buffer.spilled
+        buffer.write(b"abc")
+        assert buffer.spilled
+        view = buffer.getbuffer()
+        assert view == b"0123456789abc"
+        # The mapped view outlives the temporary file:
+        buffer.close()
+        assert bytes(view[10:]) == b"abc"
+
+    def test_ranges_written_out_of_order_from_threads(self):
+        data = os.urandom(64 * 1024)
+        buffer = SpillBuffer(threshold=16 * 1024)
+        buffer.reserve(len(data))
+        assert buffer.spilled
+        offsets = list(range(0, len(data), 4096))[::-1]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(
+                lambda offset: buffer.write_at(offset,
+                                               data[offset:offset + 4096]),
+                offsets))
+        assert buffer.getbuffer() == data
+
+    def test_reserve_in_memory(self):
+        buffer = SpillBuffer(threshold=100)
+        buffer.reserve(4)
+        buffer.write_at(2, b"cd")
+        buffer.write_at(0, b"ab")
+        assert buffer.getbuffer() == b"abcd"
+
+    @patch.dict(os.environ, {"OBFUSCATOR_SPILL_THRESHOLD": "5"})
+    def test_threshold_is_read_from_environment(self):
+        buffer = SpillBuffer()
+        assert buffer.threshold == 5
+        buffer.write(b"123456")
+        assert buffer.spilled
+
+    def test_parquet_can_be_written_to_and_read_from_buffer(self):
+        table = pa.table({"student_id": list(range(1000))})
+        buffer = SpillBuffer(threshold=1024)
+        with pq.ParquetWriter(buffer, table.schema) as writer:
+            writer.write_table(table)
+        assert buffer.spilled
+        result = pq.read_table(pa.BufferReader(buffer.getbuffer()))
+        assert result.equals(table)
@@ -0,0 +1,84 @@
+from src.cache import (ENTRY_OVERHEAD,
+                       TokenCache,
+                       clear_token_caches,
+                       get_cache_stats,
+                       load_token_caches,
+                       save_token_caches)
+from src.masking import get_strategies
+from src.transformer import setup_logging
+import os
+import stat
+from tests.conftest import read_log
+
+
+# Test the cache keeps recently used tokens within its memory cap:
+class TestTokenCache():
+    def test_lookup_counts_hits_and_misses(self):
+        cache = TokenCache()
+        cache.store(["jo", "al"], ["JO", "AL"])
+        found, missing = cache.lookup(["jo", "bo"])
+        assert found == {"jo": "JO"}
+        assert missing == ["bo"]
+        assert cache.hit_rate == 0.5
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TokenCache(max_bytes=3 * 205)
+        cache.store(["a", "b", "c"], ["AA", "BB", "CC"])
+        cache.lookup(["a"])
+        cache.store(["d"], ["DD"])
+        assert [value for value, _ in cache.items()] == ["c", "a", "d"]
+        assert cache.evictions == 1
+        assert cache.size <= cache.max_bytes
+
+    def test_storing_cached_values_keeps_size(self):
+        cache = TokenCache(max_bytes=10000)
+        for _ in range(200):
+            cache.store(["jo"], ["JO"])
+        assert len(cache) == 1
+        assert cache.size == len("jo") + len("JO") + ENTRY_OVERHEAD
+        cache.store(["jo", "jo", "al"], ["JOE", "JOE", "AL"])
+        assert len(cache) == 2
+        assert cache.size == 5 + 4 + 2 * ENTRY_OVERHEAD
+        assert cache.evictions == 0
+
+
+# Test strategies share caches, and caches are saved between runs:
+class TestSharedCaches():
+    def setup_method(self):
+        setup_logging()
+        clear_token_caches()
+
+    def test_strategies_with_same_options_share_a_cache(self):
+        first = get_strategies({"name": "hash"})["name"]
+        first.apply_values(["jo", "al"])
+        second = get_strategies({"course": "hash"})["course"]
+        second.apply_values(["jo", "bo"])
+        assert second.cache is first.cache
+        assert get_cache_stats()["hash-16"]["hits"] == 1
+
+    def test_hmac_cache_is_named_without_the_key(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        get_strategies({"name": "hmac"})["name"].apply_values(["jo"])
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "other")
+        get_strategies({"name": "hmac"})["name"].apply_values(["jo"])
+        namespaces = list(get_cache_stats())
+        assert len(namespaces) == 2
+        assert not any("secret" in namespace for namespace in namespaces)
+
+    def test_saved_caches_start_warm(self, tmp_path):
+        path = str(tmp_path / "tokens.json")
+        tokens = get_strategies({"name": "hash"})["name"].apply_values(
+            ["jo", "al"])
+        assert save_token_caches(path) == path
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        clear_token_caches()
+        assert load_token_caches(path) == 2
+        strategy = get_strategies({"name": "hash"})["name"]
+        assert strategy.apply_values(["jo", "al"]) == tokens
+        assert strategy.cache.hit_rate == 1.0
+
+    def test_unreadable_cache_file_is_logged(self, tmp_path):
+        path = tmp_path / "tokens.json"
+        path.write_text("not json")
+        assert load_token_caches(str(path)) == 0
+        assert "could not be loaded" in read_log()
@@ -0,0 +1,145 @@
+from src.cli import (Progress,
+                     format_bytes,
+                     main,
+                     parse_pii_fields,
+                     parse_size,
+                     split_sources)
+import argparse
+import io
+import json
+import pytest
+
+test_csv = b"student_id,name,email_address\n1234,John Smith,j@email.com\n"
+test_json = [{"student_id": 1234, "name": "John Smith"}]
+
+
+@pytest.fixture
+def source(tmp_path):
+    directory = tmp_path / "new_data"
+    (directory / "nested").mkdir(parents=True)
+    (directory / "file1.csv").write_bytes(test_csv)
+    (directory / "nested" / "file2.json").write_text(json.dumps(test_json))
+    return directory
+
+
+# Test command line values are parsed:
+class TestParsing():
+    def test_parse_size(self):
+        assert parse_size("1024") == 1024
+        assert parse_size("8M") == 8 * 1024 * 1024
+        assert parse_size("1.5KiB") == 1536
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_size("lots")
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_size("0")
+
+    def test_parse_pii_fields(self):
+        assert parse_pii_fields(["name", "email_address"]) == \
+            ["name", "email_address"]
+        assert parse_pii_fields(["name", "email_address=hmac"]) == \
+            {"name": "mask", "email_address": "hmac"}
+        assert parse_pii_fields(["name", "email_address=hmac"],
+                                "hash") == \
+            {"name": "hash", "email_address": "hmac"}
+
+    def test_split_sources(self, source):
+        files, prefixes = split_sources([
+            str(source), str(source / "file1.csv"),
+            "s3://my_ingestion_bucket/new_data/",
+            "s3://my_ingestion_bucket/new_data/file1.parquet"])
+        assert files == [str(source / "file1.csv"),
+                         "s3://my_ingestion_bucket/new_data/file1.parquet"]
+        assert prefixes == [str(source),
+                            "s3://my_ingestion_bucket/new_data/"]
+
+    def test_input_format_sources_are_files(self):
+        files, prefixes = split_sources(
+            ["s3://my_ingestion_bucket/exports/part-0000",
+             "s3://my_ingestion_bucket/exports/"], input_format="csv")
+        assert files == ["s3://my_ingestion_bucket/exports/part-0000"]
+        assert prefixes == ["s3://my_ingestion_bucket/exports/"]
+
+    def test_format_bytes(self):
+        assert format_bytes(999) == "999 B"
+        assert format_bytes(1500000) == "1.5 MB"
+
+
+# Test progress is written as files finish:
+class TestProgress():
+    def test_progress_lines(self):
+        stream = io.StringIO()
+        progress = Progress(stream=stream, interval=60)
+        progress({'source': 'a.csv', 'status': 'ok', 'bytes': 10}, 3)
+        progress({'source': 'b.csv', 'status': 'error', 'error': 'bad'}, 3)
+        progress({'source': 'c.csv', 'status': 'skipped'}, 3)
+        lines = stream.getvalue().splitlines()
+        assert lines[0].startswith("1/3 files")
+        assert lines[1] == "Failed: b.csv: bad"
+        assert lines[-1].startswith("3/3 files")
+        assert "1 failed, 1 unchanged" in lines[-1]
+
+
+# Test the command line runs batches:
+class TestMain():
+    def test_directory_is_obfuscated(self, source, tmp_path, capsys):
+        destination = tmp_path / "out"
+        status = main([str(source), "-f", "name", "email_address=hash",
+                       "-o", str(destination), "-w", "2", "-q"])
+        assert status == 0
+        output = (destination / "file1.csv").read_bytes()
+        assert b"1234,***," in output
+        assert b"j@email.com" not in output
+        assert json.loads((destination / "nested" / "file2.json")
+                          .read_text())[0]["name"] == "***"
+        assert "Obfuscated 2 of 2 files" in capsys.readouterr().out
+
+    def test_dry_run_writes_nothing(self, source, tmp_path, capsys):
+        destination = tmp_path / "out"
+        status = main([str(source), "-f", "name", "-o", str(destination),
+                       "--dry-run"])
+        assert status == 0
+        assert not destination.exists()
+        output = capsys.readouterr().out
+        assert f"{source}/file1.csv -> {destination}/file1.csv" in output
+        assert "Would obfuscate 2 of 2 files, 102 B estimated" in output
+
+    def test_config_file_and_report(self, source, tmp_path):
+        config = tmp_path / "config.json"
+        config.write_text(json.dumps({
+            "pii_fields": ["name"], "output_compression": "gzip",
+            "destination": str(tmp_path / "out")}))
+        report = tmp_path / "report.json"
+        status = main([str(source), "-c", str(config), "-q",
+                       "--report", str(report)])
+        assert status == 0
+        assert (tmp_path / "out" / "file1.csv.gz").exists()
+        results = json.loads(report.read_text())["results"]
+        assert [result["status"] for result in results] == ["ok", "ok"]
+
+    def test_failed_file_exits_with_error(self, source, tmp_path, capsys):
+        status = main([str(source / "missing.csv"), "-f", "name",
+                       "-o", str(tmp_path / "out")])
+        assert status == 1
+        assert "Failed:" in capsys.readouterr().err
+
+    def test_destination_is_needed(self, source):
+        with pytest.raises(SystemExit):
+            main([str(source), "-f", "name"])
+
+    def test_pii_fields_are_needed(self, source, tmp_path):
+        with pytest.raises(SystemExit):
+            main([str(source), "-o", str(tmp_path / "out")])
+
+    def test_format_options(self, source, tmp_path):
+        (source / "part-0000").write_bytes(test_csv)
+        (source / "file1.csv").unlink()
+        (source / "nested" / "file2.json").unlink()
+        config = tmp_path / "config.json"
+        config.write_text(json.dumps({"pii_fields": ["name"]}))
+        destination = tmp_path / "out"
+        status = main([str(source), "-c", str(config), "-o",
+                       str(destination), "--input-format", "csv",
+                       "--default-strategy", "null", "--stream", "-q"])
+        assert status == 0
+        assert (destination / "part-0000").read_bytes() == \
+            b"student_id,name,email_address\n1234,,j@email.com\n"
@@ -0,0 +1,151 @@
+from src.compression import (CompressionError,
+                             compress_chunks,
+                             get_output_codec,
+                             is_available,
+                             open_decompressed,
+                             split_codec,
+                             with_codec)
+from src.batch import batch_obfuscate
+from main import main
+import bz2
+import gzip
+import io
+import json
+import lzma
+import pytest
+
+test_csv = b"""student_id,name,course,email_address
+1234,'John Smith','Software','j.smith@email.com'
+"""
+test_records = [{"student_id": 1234, "name": "John Smith"},
+                {"student_id": 1235, "name": "Jo Smith"}]
+test_ndjson = b"".join(json.dumps(record).encode() + b"\n"
+                       for record in test_records)
+
+
+# Compressed source files in the mocked buckets of conftest:
+@pytest.fixture
+def s3_client(s3_client):
+    s3_client.put_object(Bucket="my_ingestion_bucket",
+                         Key="new_data/file1.csv.gz",
+                         Body=gzip.compress(test_csv))
+    s3_client.put_object(Bucket="my_ingestion_bucket",
+                         Key="new_data/file2.ndjson.bz2",
+                         Body=bz2.compress(test_ndjson))
+    return s3_client
+
+
+def get_body(client, key):
+    return client.get_object(Bucket="my_output_bucket",
+                             Key=key)['Body'].read()
+
+
+# Test codecs are found and used:
+class TestCodecs():
+    def test_codec_is_taken_from_extension(self):
+        assert split_codec("data/file1.csv.gz") == ("data/file1.csv", "gzip")
+        assert split_codec("data/file1.json.zst") == ("data/file1.json",
+                                                      "zstd")
+        assert split_codec("data/file1.csv") == ("data/file1.csv", None)
+
+    def test_output_codec(self):
+        assert get_output_codec("out/file1.csv.bz2") == "bz2"
+        assert get_output_codec("out/file1.csv") is None
+        assert get_output_codec("out/file1.csv.gz", "none") is None
+        assert get_output_codec("out/file1.csv", "xz") == "xz"
+        with pytest.raises(CompressionError):
+            get_output_codec("out/file1.csv", "snappy")
+
+    def test_output_path_takes_codec_extension(self):
+        assert with_codec("out/file1.csv.gz", "bz2") == "out/file1.csv.bz2"
+        assert with_codec("out/file1.csv.gz", None) == "out/file1.csv"
+
+    @pytest.mark.parametrize("codec, decompress", [
+        ("gzip", gzip.decompress), ("bz2", bz2.decompress),
+        ("xz", lzma.decompress)])
+    def test_chunks_are_compressed_and_read_back(self, codec, decompress):
+        chunks = [test_csv] * 1000
+        compressed = b"".join(compress_chunks(chunks, codec, level=1))
+        assert decompress(compressed) == test_csv * 1000
+        stream = open_decompressed(io.BytesIO(compressed), codec)
+        assert stream.read(10) == test_csv[:10]
+        assert stream.read() == (test_csv * 1000)[10:]
+
+    def test_zstd_without_zstandard_gives_error(self):
+        if is_available("zstd"):
+            pytest.skip("zstandard is installed")
+        with pytest.raises(CompressionError):
+            open_decompressed(io.BytesIO(b""), "zstd")
+
+
+# Test compressed files are obfuscated from S3 to S3:
+class TestCompressedFiles():
+    def test_gzip_csv_is_obfuscated_to_gzip(self, s3_client):
+        output = main(json.dumps({
+            "file_to_obfuscate":
+                "s3://my_ingestion_bucket/new_data/file1.csv.gz",
+            "pii_fields": ["name", "email_address"],
+            "destination": "s3://my_output_bucket/out/file1.csv.gz"}))
+        assert output["compression"] == "gzip"
+        body = gzip.decompress(get_body(s3_client, "out/file1.csv.gz"))
+        assert body == b"student_id,name,course,email_address\n" \
+                       b"1234,***,'Software',***\n"
+
+    def test_output_codec_and_level_can_be_chosen(self, s3_client):
+        main(json.dumps({
+            "file_to_obfuscate":
+                "s3://my_ingestion_bucket/new_data/file1.csv.gz",
+            "pii_fields": ["name"],
+            "destination": "s3://my_output_bucket/out/file1.csv.xz",
+            "output_compression": "xz", "compression_level": 1}))
+        body = lzma.decompress(get_body(s3_client, "out/file1.csv.xz"))
+        assert b"John Smith" not in body
+
+    def test_content_encoding_selects_codec(self, s3_client):
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key="new_data/encoded.csv",
+                             Body=gzip.compress(test_csv),
+                             ContentEncoding="gzip")
+        output = main(json.dumps({
+            "file_to_obfuscate":
+                "s3://my_ingestion_bucket/new_data/encoded.csv",
+            "pii_fields": ["name"], "streaming": True}))
+        assert b"'Software'" in b"".join(output)
+
+    def test_content_encoding_is_decoded_without_streaming(self, s3_client):
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key="new_data/encoded.csv",
+                             Body=gzip.compress(test_csv),
+                             ContentEncoding="gzip")
+        output = main(json.dumps({
+            "file_to_obfuscate":
+                "s3://my_ingestion_bucket/new_data/encoded.csv",
+            "pii_fields": ["name"]}))
+        assert bytes(output) == (b"student_id,name,course,email_address\n"
+                                 b"1234,***,'Software','j.smith@email.com'\n")
+
+    def test_batch_decodes_content_encoding(self, s3_client):
+        s3_client.put_object(Bucket="my_ingestion_bucket",
+                             Key="encoded/file1.json",
+                             Body=gzip.compress(json.dumps(
+                                 test_records).encode()),
+                             ContentEncoding="gzip")
+        output = batch_obfuscate(
+            ["name"], s3_urls=["s3://my_ingestion_bucket/encoded/file1.json"],
+            destination="s3://my_output_bucket/out/", client=s3_client)
+        assert output["summary"]["succeeded"] == 1
+        records = json.loads(get_body(s3_client, "out/encoded/file1.json"))
+        assert [record["name"] for record in records] == ["***"] * 2
+
+    def test_batch_recompresses_with_chosen_codec(self, s3_client):
+        output = batch_obfuscate(
+            ["name"], s3_prefix="s3://my_ingestion_bucket/new_data/",
+            destination="s3://my_output_bucket/out/", client=s3_client,
+            compression="gzip")
+        assert output["summary"]["succeeded"] == 2
+        assert [result["destination"] for result in output["results"]] == [
+            "s3://my_output_bucket/out/file1.csv.gz",
+            "s3://my_output_bucket/out/file2.ndjson.gz"]
+        lines = gzip.decompress(get_body(
+            s3_client, "out/file2.ndjson.gz")).splitlines()
+        assert [json.loads(line)["name"] for line in lines] == ["***"] * 2
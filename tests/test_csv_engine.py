@@ -0,0 +1,126 @@
+from src.csv_engine import (CSVMasker,
+                            csv_transformation,
+                            csv_stream_transformation,
+                            split_quoted)
+from io import BytesIO
+import csv
+import hashlib
+import io
+from random import Random
+
+test_csv = (b'student_id,name,score,graduation_date,notes\r\n'
+            b'0012,"Smith, Jo",1.50,31/03/2024,"said ""hi""\n'
+            b'on two lines"\r\n'
+            b'0013,Joe,2.0e3,2024-03-31,\r\n')
+
+
+# Test records are split into fields with quotes kept:
+class TestSplitFields():
+    def test_split_quoted_keeps_commas_in_quotes(self):
+        fields = split_quoted(b'1,"a, ""b""",c')
+        assert fields == [b'1', b'"a, ""b"""', b'c']
+
+    def test_split_quoted_empty_fields(self):
+        assert split_quoted(b',"",') == [b'', b'""', b'']
+
+
+# Test only the PII fields change:
+class TestCSVTransformation():
+    def test_fields_outside_pii_columns_are_unchanged(self):
+        output = csv_transformation(test_csv, ["name"])
+        assert output == (
+            b'student_id,name,score,graduation_date,notes\r\n'
+            b'0012,***,1.50,31/03/2024,"said ""hi""\n'
+            b'on two lines"\r\n'
+            b'0013,***,2.0e3,2024-03-31,\r\n')
+
+    def test_quoted_multiline_pii_field_is_masked(self):
+        output = csv_transformation(test_csv, ["notes", "student_id"])
+        rows = list(csv.reader(io.StringIO(output.decode())))
+        assert rows[1] == ["***", "Smith, Jo", "1.50", "31/03/2024", "***"]
+        assert rows[2] == ["***", "Joe", "2.0e3", "2024-03-31", "***"]
+
+    def test_quoted_header_is_matched(self):
+        output = csv_transformation(b'"id","full name"\n1,Jo\n',
+                                    ["full name"])
+        assert output == b'"id","full name"\n1,***\n'
+
+    def test_final_line_ending_is_added(self):
+        assert csv_transformation(b'id,name\n1,Jo', ["name"]) == \
+            b'id,name\n1,***\n'
+
+    def test_short_rows_are_masked_where_present(self):
+        assert csv_transformation(b'id,name,email\n1,Jo\n',
+                                  ["email", "name"]) == \
+            b'id,name,email\n1,***\n'
+
+    def test_rare_quoted_records_are_masked(self):
+        data = (b'id,name,notes\n' + b'1,Jo,ok\n' * 20 +
+                b'2,"Smith, Jo","a\nb"\n' + b'3,Al,ok\n' * 20)
+        output = csv_transformation(data, ["name"])
+        rows = list(csv.reader(io.StringIO(output.decode())))
+        assert len(rows) == 42
+        assert rows[21] == ["2", "***", "a\nb"]
+        assert {row[1] for row in rows[1:]} == {"***"}
+
+    def test_strategies_per_field(self):
+        data = (b'id,name,email\n'
+                b'1,"Smith, Jo",jo@email.com\n'
+                b'2,Al,"al@email.com"\n'
+                b'3,"Smith, Jo",\n')
+        output = csv_transformation(data, {"name": "hash",
+                                           "email": "email"})
+        rows = list(csv.reader(io.StringIO(output.decode())))
+        name_hash = hashlib.sha256(b"Smith, Jo").hexdigest()[:16]
+        assert rows[1] == ["1", name_hash, "***@email.com"]
+        assert rows[2][1:] == [hashlib.sha256(b"Al").hexdigest()[:16],
+                               "***@email.com"]
+        assert rows[3] == ["3", name_hash, ""]
+
+    def test_strategies_on_plain_and_quoted_lines(self):
+        data = (b'id,name,notes\n' + b'1,Jo,ok\n' * 20 +
+                b'2,Jo,"a\nb"\n' + b'3,Al,ok\n' * 20)
+        output = csv_transformation(data, {"name": "email",
+                                           "notes": "null"})
+        rows = list(csv.reader(io.StringIO(output.decode())))
+        assert {row[1] for row in rows[1:]} == {"***"}
+        assert {row[2] for row in rows[1:]} == {""}
+
+    def test_no_rows_gives_no_output(self):
+        assert csv_transformation(b'id,name\n\n', ["name"]) is None
+
+
+# Test streams are masked across reads of any size:
+class TestCSVStream():
+    def test_stream_matches_in_memory_output(self):
+        expected = csv_transformation(test_csv, ["name", "notes"])
+        for read_size in (1, 3, 7, 1024):
+            output = b''.join(csv_stream_transformation(
+                BytesIO(test_csv), ["name", "notes"], read_size=read_size))
+            assert output == expected
+
+    def test_blank_lines_match_in_memory_output(self):
+        data = (b'name,id\n"a","1"\n\n"b","2"\n\r\n"c,d","3"\n' +
+                b'"e","4"\n\n' * 50)
+        expected = csv_transformation(data, ["name"])
+        assert expected.startswith(b'name,id\n***,"1"\n\n***,"2"\n\r\n')
+        assert expected.count(b'***') == 53
+        random = Random(11)
+        for _ in range(20):
+            stream = BytesIO(data)
+            chunks = []
+            while chunk := stream.read(random.randint(1, 64)):
+                chunks.append(chunk)
+            masker = CSVMasker(["name"])
+            output = b''.join(masker.feed(chunk) for chunk in chunks)
+            assert output + masker.finish() == expected
+        for read_size in (1, 5, 13, 4096):
+            output = b''.join(csv_stream_transformation(
+                BytesIO(data), ["name"], read_size=read_size))
+            assert output == expected
+
+    def test_masker_holds_open_quoted_records(self):
+        masker = CSVMasker(["notes"])
+        assert masker.feed(b'id,notes\n1,"a\n') == b'id,notes\n'
+        assert masker.feed(b'b"\n') == b'1,***\n'
+        assert masker.rows == 1
@@ -2,7 +2,14 @@ import unittest
 from unittest.mock import patch, MagicMock
 from src.extractor import (
     extraction_handler,
-    get_data)
+    stream_extraction_handler,
+    get_client,
+    clear_client_cache,
+    get_data,
+    get_stream,
+    get_stream_format,
+    parse_body)
+from concurrent.futures import ThreadPoolExecutor
 import os
 from botocore.exceptions import ClientError
 import json
@@ -137,6 +144,105 @@ class TestSubFunctions(unittest.TestCase):
                           'new_data/file1.pqt')
         self.assertEqual(result, buffer.getvalue())
 
+    def test_unsupported_body_raises_ValueError(self):
+        with self.assertRaisesRegex(
+                ValueError, "Unsupported file type: new_data/file1.txt"):
+            parse_body('new_data/file1.txt', b'not data')
+
+
+# Test streaming extraction returns the unread S3 body:
+class TestStreamExtraction(unittest.TestCase):
+    @patch('src.extractor.get_stream')
+    @patch('src.extractor.get_client')
+    def test_stream_extractor_calls_correctly_for_csvs(
+            self, mock_get_client, mock_get_stream):
+        result = stream_extraction_handler(test_s3_url)
+        mock_get_stream.assert_called_once_with(
+            mock_get_client.return_value, test_s3_bucket, test_s3_filepath)
+        self.assertEqual(result, mock_get_stream.return_value)
+
+    def test_get_stream_does_not_read_body(self):
+        mock_s3_client = MagicMock()
+        mock_body = MagicMock()
+        mock_s3_client.get_object.return_value = {'Body': mock_body}
+        result = get_stream(mock_s3_client, test_s3_bucket,
+                            test_s3_filepath)
+        self.assertIs(result, mock_body)
+        mock_body.read.assert_not_called()
+
+    @patch('src.extractor.get_client')
+    def test_stream_extractor_rejects_parquet(self, mock_get_client):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        stream_extraction_handler(
+            "s3://my_ingestion_bucket/new_data/file1.parquet")
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        self.assertIn("File is not csv or json format, cannot be streamed.",
+                      log_contents)
+
+    @patch('src.extractor.get_stream')
+    @patch('src.extractor.get_client')
+    def test_stream_extractor_calls_correctly_for_ndjson(
+            self, mock_get_client, mock_get_stream):
+        result = stream_extraction_handler(
+            "s3://my_ingestion_bucket/new_data/file1.ndjson")
+        mock_get_stream.assert_called_once_with(
+            mock_get_client.return_value, test_s3_bucket,
+            "new_data/file1.ndjson")
+        self.assertEqual(result, mock_get_stream.return_value)
+
+    def test_get_stream_format(self):
+        self.assertEqual(get_stream_format("file1.csv"), "csv")
+        self.assertEqual(get_stream_format("file1.json"), "json")
+        self.assertEqual(get_stream_format("file1.jsonl"), "ndjson")
+        self.assertIsNone(get_stream_format("file1.pqt"))
+
+
+# Test S3 clients are cached and reused:
+class TestClientCache(unittest.TestCase):
+    def setUp(self):
+        clear_client_cache()
+
+    def tearDown(self):
+        clear_client_cache()
+
+    def test_client_is_reused(self):
+        self.assertIs(get_client(), get_client())
+
+    def test_region_is_configurable(self):
+        client = get_client(region_name="us-east-1")
+        self.assertEqual(client.meta.region_name, "us-east-1")
+        self.assertIsNot(client, get_client(region_name="eu-west-1"))
+
+    @patch.dict(os.environ, {"AWS_REGION": "eu-west-1"})
+    def test_region_is_read_from_environment(self):
+        self.assertEqual(get_client().meta.region_name, "eu-west-1")
+
+    @patch.dict(os.environ, {"AWS_REGION": "", "AWS_DEFAULT_REGION": ""})
+    def test_default_region(self):
+        self.assertEqual(get_client().meta.region_name, "eu-west-2")
+
+    def test_connection_pool_and_retries_are_configured(self):
+        client = get_client(max_pool_connections=64, max_attempts=3)
+        self.assertEqual(client.meta.config.max_pool_connections, 64)
+        self.assertEqual(client.meta.config.retries['mode'], 'adaptive')
+        # botocore counts the first attempt as well as the retries:
+        self.assertEqual(
+            client.meta.config.retries['total_max_attempts'], 4)
+
+    def test_new_credentials_get_a_new_client(self):
+        with patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "first"}):
+            first = get_client()
+        with patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "second"}):
+            second = get_client()
+        self.assertIsNot(first, second)
+
+    def test_threads_share_one_client(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: get_client(), range(32)))
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
 
 # Check all error handling works as intended:
 class TestExtractorErrorHandling(unittest.TestCase):
@@ -0,0 +1,80 @@
+from src.field_plan import (get_field_plan,
+                            get_matcher,
+                            is_pattern,
+                            select_paths)
+from src.csv_engine import csv_transformation
+from src.instrumentation import setup_logging
+from tests.conftest import read_log
+
+
+# Test PII fields are matched to field paths:
+class TestFieldMatcher():
+    def test_names_are_matched_exactly(self):
+        matcher = get_matcher(["name", "contact.email"])
+        assert matcher.match("name") == "name"
+        assert matcher.match("Name") is None
+        assert matcher.match("contact.email") == "contact.email"
+        assert matcher.match("email") is None
+
+    def test_glob_matches_nested_paths(self):
+        matcher = get_matcher(["*email*"])
+        assert matcher.match("email_address") == "*email*"
+        assert matcher.match("contact.work_email") == "*email*"
+        assert matcher.match("name") is None
+
+    def test_regex_and_ignore_case(self):
+        matcher = get_matcher(["re:phone_[0-9]+", "i:Email_Address",
+                               "i:*.SSN"])
+        assert matcher.match("phone_1") == "re:phone_[0-9]+"
+        assert matcher.match("phone_x") is None
+        assert matcher.match("EMAIL_address") == "i:Email_Address"
+        assert matcher.match("person.ssn") == "i:*.SSN"
+
+    def test_exact_name_comes_before_patterns(self):
+        matcher = get_matcher({"*name*": "hash", "first_name": "mask"})
+        assert matcher.match("first_name") == "first_name"
+        assert matcher.match("last_name") == "*name*"
+
+    def test_names_with_pattern_characters_match_themselves(self):
+        assert is_pattern("scores[0]")
+        assert get_matcher(["scores[0]"]).match("scores[0]") == "scores[0]"
+
+    def test_flat_fields_search_no_nested_paths(self):
+        assert get_matcher(["name", "email"]).is_flat
+        matcher = get_matcher(["contact.address.city"])
+        assert not matcher.is_flat
+        assert matcher.has_nested("contact")
+        assert matcher.has_nested("contact.address")
+        assert not matcher.has_nested("notes")
+
+
+# Test plans are cached by the paths of the file:
+class TestFieldPlan():
+    def test_plan_is_reused_for_the_same_paths(self):
+        columns = [f"column_{i}" for i in range(1000)] + ["Email"]
+        plan = get_field_plan(["i:email", "*_999"], columns)
+        assert plan.matches == {"column_999": "*_999", "Email": "i:email"}
+        assert get_field_plan(["i:email", "*_999"], list(columns)) is plan
+
+    def test_missing_fields_are_listed(self):
+        plan = get_field_plan(["name", "re:ssn.*"], ["name", "course"])
+        assert plan.missing == ["re:ssn.*"]
+
+    def test_paths_are_selected_with_their_strategies(self):
+        pii_fields = {"*email*": "hash", "name": "mask"}
+        plan = get_field_plan(pii_fields, ["name", "email", "work_email"])
+        assert select_paths(pii_fields, plan) == {
+            "name": "mask", "email": "hash", "work_email": "hash"}
+        plan = get_field_plan(["*email*"], ["name", "email", "work_email"])
+        assert select_paths(["*email*"], plan) == ["email", "work_email"]
+
+    def test_csv_columns_are_matched_with_patterns(self):
+        data = b"Student_ID,First_Name,Last_Name,course\n1,Jo,Li,Data\n"
+        output = csv_transformation(data, ["i:*_name", "re:(?i)student_id"])
+        assert output == \
+            b"Student_ID,First_Name,Last_Name,course\n***,***,***,Data\n"
+
+    def test_pattern_that_matches_nothing_gives_error(self):
+        setup_logging()
+        csv_transformation(b"name,course\nJo,Data\n", ["name", "*ssn*"])
+        assert 'PII field "*ssn*" not found in file.' in read_log()
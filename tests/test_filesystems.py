@@ -0,0 +1,148 @@
+from src.extractor import extraction_handler, stream_extraction_handler
+from src.filesystems import (FileWriter,
+                             get_file_version,
+                             get_protocol,
+                             head_file,
+                             is_s3_url,
+                             list_files,
+                             map_file,
+                             open_input,
+                             read_bytes,
+                             strip_protocol)
+from src.loader import upload_handler
+from src.transformer import setup_logging
+import fsspec
+import gzip
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from tests.conftest import read_log
+
+test_csv = b"student_id,name\n1234,John Smith\n1235,Joe Smith\n"
+
+
+@pytest.fixture
+def memory_fs():
+    filesystem = fsspec.filesystem('memory')
+    yield filesystem
+    filesystem.rm('/', recursive=True)
+
+
+# Test URLs are sorted by protocol, paths without one are local:
+class TestProtocols():
+    def test_get_protocol(self):
+        assert get_protocol("s3://bucket/file1.csv") == "s3"
+        assert get_protocol("file:///data/file1.csv") == "file"
+        assert get_protocol("/data/file1.csv") == "file"
+        assert get_protocol("data/file1.csv") == "file"
+        assert get_protocol("memory://data/file1.csv") == "memory"
+
+    def test_is_s3_url(self):
+        assert is_s3_url("s3://bucket/file1.csv")
+        assert not is_s3_url("/bucket/file1.csv")
+
+    def test_strip_protocol(self):
+        assert strip_protocol("file:///data/file1.csv") == "/data/file1.csv"
+        assert strip_protocol("data/file1.csv") == "data/file1.csv"
+
+
+# Test files are read whole, or as streams:
+class TestReading():
+    def test_local_file_is_mapped(self, tmp_path):
+        path = tmp_path / "file1.csv"
+        path.write_bytes(test_csv)
+        body = read_bytes(str(path))
+        assert type(body) is memoryview
+        assert body == test_csv
+
+    def test_empty_file_is_not_mapped(self, tmp_path):
+        path = tmp_path / "file1.csv"
+        path.write_bytes(b"")
+        assert map_file(str(path)) == b""
+
+    def test_memory_file_is_read(self, memory_fs):
+        memory_fs.pipe("/data/file1.csv", test_csv)
+        assert read_bytes("memory://data/file1.csv") == test_csv
+
+    def test_compressed_file_is_decompressed(self, tmp_path):
+        path = tmp_path / "file1.csv.gz"
+        path.write_bytes(gzip.compress(test_csv))
+        with open_input(f"file://{path}") as stream:
+            assert stream.read() == test_csv
+
+    def test_list_files(self, tmp_path):
+        (tmp_path / "new_data").mkdir()
+        (tmp_path / "file1.csv").write_bytes(test_csv)
+        (tmp_path / "new_data" / "file2.csv").write_bytes(test_csv)
+        urls = [url for url, info in list_files(str(tmp_path))]
+        assert urls == [f"{tmp_path}/file1.csv",
+                        f"{tmp_path}/new_data/file2.csv"]
+
+    def test_file_version(self, tmp_path):
+        path = tmp_path / "file1.csv"
+        path.write_bytes(test_csv)
+        version = head_file(str(path))
+        assert version['size'] == len(test_csv)
+        assert head_file(str(tmp_path / "missing.csv")) is None
+        assert get_file_version({'ETag': '"abc"', 'size': 3}) == \
+            {'etag': 'abc', 'size': 3}
+
+
+# Test outputs are written in one step, and removed if they fail:
+class TestFileWriter():
+    def test_local_file_is_replaced_when_closed(self, tmp_path):
+        path = tmp_path / "output" / "file1.csv"
+        writer = FileWriter(str(path))
+        writer.write(test_csv)
+        assert not path.exists()
+        assert writer.close() == {'parts': 0, 'bytes': len(test_csv)}
+        assert path.read_bytes() == test_csv
+        assert [p.name for p in path.parent.iterdir()] == ["file1.csv"]
+
+    def test_aborted_local_file_is_removed(self, tmp_path):
+        writer = FileWriter(str(tmp_path / "file1.csv"))
+        writer.write(test_csv)
+        writer.abort()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_memory_file_is_written(self, memory_fs):
+        writer = FileWriter("memory://output/file1.csv")
+        writer.write(test_csv)
+        writer.close()
+        assert memory_fs.cat_file("/output/file1.csv") == test_csv
+
+
+# Test the extraction and upload handlers take local and fsspec URLs:
+class TestHandlers():
+    def test_local_csv_is_extracted(self, tmp_path):
+        path = tmp_path / "file1.csv"
+        path.write_bytes(test_csv)
+        assert extraction_handler(str(path)) == test_csv.decode('utf-8')
+
+    def test_local_parquet_is_extracted_unread(self, tmp_path):
+        path = tmp_path / "file1.parquet"
+        pq.write_table(pa.table({"name": ["John Smith"]}), path)
+        body = extraction_handler(str(path), skip_columns=["name"])
+        assert type(body) is memoryview
+
+    def test_local_stream_is_extracted(self, tmp_path):
+        path = tmp_path / "file1.csv"
+        path.write_bytes(test_csv)
+        with stream_extraction_handler(f"file://{path}") as stream:
+            assert stream.read() == test_csv
+
+    def test_missing_file(self, tmp_path):
+        setup_logging()
+        assert extraction_handler(str(tmp_path / "missing.csv")) is None
+        assert "File not found." in read_log()
+
+    def test_output_is_compressed_to_local_file(self, tmp_path):
+        path = tmp_path / "file1.csv.gz"
+        result = upload_handler(iter([test_csv]), str(path))
+        assert result['compression'] == 'gzip'
+        assert gzip.decompress(path.read_bytes()) == test_csv
+
+    def test_output_is_written_to_memory(self, memory_fs):
+        upload_handler([{"name": "***"}], "memory://output/file1.json")
+        assert memory_fs.cat_file("/output/file1.json") == \
+            b'[{"name": "***"}]'
@@ -0,0 +1,110 @@
+from src.instrumentation import (JSONFormatter,
+                                 get_stage_totals,
+                                 measure,
+                                 measure_stream,
+                                 reset_stage_totals,
+                                 set_metrics_callback,
+                                 setup_logging)
+from src.transformer import transformation_handler
+import io
+import json
+import logging
+import os
+from logging.handlers import WatchedFileHandler
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from tests.conftest import read_log
+
+
+@pytest.fixture
+def metrics():
+    recorded = []
+    setup_logging()
+    reset_stage_totals()
+    set_metrics_callback(recorded.append)
+    yield recorded
+    set_metrics_callback(None)
+
+
+# Test logging is set up once and survives the log file being removed:
+class TestSetupLogging():
+    def test_handler_is_kept_between_calls(self):
+        first = [handler for handler in setup_logging().handlers
+                 if isinstance(handler, WatchedFileHandler)]
+        second = [handler for handler in setup_logging().handlers
+                  if isinstance(handler, WatchedFileHandler)]
+        assert len(first) == 1
+        assert first == second
+
+    def test_log_file_is_reopened_when_removed(self):
+        setup_logging()
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        logging.getLogger('test').info('After removal')
+        assert 'After removal' in read_log()
+
+    def test_json_formatter_includes_metric(self):
+        record = logging.LogRecord('src.test', logging.INFO, __file__, 1,
+                                   'Stage mask', None, None)
+        record.metric = {'stage': 'mask', 'rows': 2}
+        entry = json.loads(JSONFormatter().format(record))
+        assert entry['message'] == 'Stage mask'
+        assert entry['metric'] == {'stage': 'mask', 'rows': 2}
+
+
+# Test stages record time, bytes and rows:
+class TestStageMetrics():
+    def test_measure_records_bytes_and_rows(self, metrics):
+        with measure('mask', bytes=10) as metric:
+            metric['rows'] = 2
+        assert metrics[0]['stage'] == 'mask'
+        assert metrics[0]['bytes'] == 10
+        assert metrics[0]['rows'] == 2
+        assert metrics[0]['seconds'] >= 0
+
+    def test_measure_records_errors(self, metrics):
+        with pytest.raises(ValueError):
+            with measure('decode'):
+                raise ValueError('bad input')
+        assert metrics[0]['error'] == 'ValueError'
+
+    def test_stream_is_recorded_once(self, metrics):
+        chunks = list(measure_stream('mask', iter([b'ab', b'cde'])))
+        assert chunks == [b'ab', b'cde']
+        assert len(metrics) == 1
+        assert metrics[0]['bytes'] == 5
+
+    def test_stream_rows_are_counted_as_lines(self, metrics):
+        chunks = iter([b'name\nJo\n', b'Al\nJay\n'])
+        list(measure_stream('mask', chunks, header_lines=1))
+        assert metrics[0]['rows'] == 3
+
+    def test_csv_transformation_records_mask(self, metrics):
+        data = "name,course\nJo,Data\nAl,Cloud\n"
+        transformation_handler(data, ["name"])
+        assert [metric['stage'] for metric in metrics] == ['mask']
+        assert metrics[0]['rows'] == 2
+
+    def test_parquet_transformation_records_mask_and_encode(self, metrics):
+        buffer = io.BytesIO()
+        pq.write_table(pa.table({'name': ['Jo', 'Al'], 'score': [1, 2]}),
+                       buffer)
+        transformation_handler(buffer.getvalue(), ["name"])
+        assert get_stage_totals()['mask']['rows'] == 2
+        assert get_stage_totals()['encode']['bytes'] > 0
+
+    def test_metrics_are_logged_without_callback(self):
+        setup_logging()
+        set_metrics_callback(None)
+        with measure('json_parse', bytes=4):
+            pass
+        assert 'Stage json_parse' in read_log()
+
+    def test_callback_failure_is_logged(self, metrics):
+        def failing_callback(metric):
+            raise RuntimeError('sink down')
+        set_metrics_callback(failing_callback)
+        with measure('upload'):
+            pass
+        assert 'Metrics callback failed: sink down' in read_log()
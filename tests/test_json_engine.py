@@ -0,0 +1,150 @@
+from src.json_engine import (iter_json_array,
+                             iter_ndjson,
+                             mask_record,
+                             json_stream_transformation,
+                             JSONStreamError)
+from src.transformer import stream_transformation_handler
+import io
+import json
+import os
+import pytest
+from tests.conftest import read_log
+
+records = [{"student_id": 1234, "name": "Zoë Smith",
+            "email_address": "z.smith@email.com"},
+           {"student_id": 1235, "name": "John Smith",
+            "email_address": "j.smith@email.com",
+            "notes": {"text": "a, [b] } \"c\""}}]
+
+
+# Test records are parsed incrementally:
+class TestJSONReaders():
+    def test_array_is_read_across_small_reads(self):
+        stream = io.BytesIO(json.dumps(records, ensure_ascii=False)
+                            .encode('utf-8'))
+        # Reads of 3 bytes split records and multi-byte characters:
+        assert list(iter_json_array(stream, read_size=3)) == records
+
+    def test_array_of_numbers_at_read_boundary(self):
+        stream = io.BytesIO(b'[12, 345]')
+        assert list(iter_json_array(stream, read_size=6)) == [12, 345]
+
+    def test_empty_array(self):
+        assert list(iter_json_array(io.BytesIO(b' [ ] '))) == []
+
+    def test_not_an_array_is_an_error(self):
+        with pytest.raises(JSONStreamError):
+            list(iter_json_array(io.BytesIO(b'{"name": "Jo"}')))
+
+    def test_unclosed_array_is_an_error(self):
+        with pytest.raises(JSONStreamError):
+            list(iter_json_array(io.BytesIO(b'[{"name": "Jo"}, ')))
+
+    @pytest.mark.parametrize("body, message", [
+        (b'[1 2]', "not separated by a comma"),
+        (b'[1,,2]', "missing record"),
+        (b'[,1]', "missing record"),
+        (b'[{"a":1},]', "trailing comma"),
+        (b'[1, 2] [3]', "followed by other data"),
+        (b'[1, 2]x', "followed by other data"),
+    ])
+    def test_malformed_array_is_an_error(self, body, message):
+        with pytest.raises(JSONStreamError, match=message):
+            list(iter_json_array(io.BytesIO(body), read_size=2))
+        with pytest.raises(ValueError):
+            json.loads(body)
+
+    def test_whitespace_after_array(self):
+        stream = io.BytesIO(b'[1, 2]\n\n')
+        assert list(iter_json_array(stream, read_size=2)) == [1, 2]
+
+    def test_ndjson_is_read_across_small_reads(self):
+        body = b"\n".join(json.dumps(record).encode() for record in records)
+        stream = io.BytesIO(body + b"\n\n")
+        assert list(iter_ndjson(stream, read_size=5)) == records
+
+    def test_mask_record_in_place(self):
+        record = {"name": "Jo", "course": "Data"}
+        assert mask_record(record, ["name", "email_address"]) is record
+        assert record == {"name": "***", "course": "Data"}
+
+    def test_nested_fields_are_masked(self):
+        record = {"name": "Jo", "contact": {
+            "Email": "jo@email.com", "phones": [{"number": "0123"},
+                                                {"number": "0456"}]}}
+        mask_record(record, ["i:contact.email", "contact.phones.number"])
+        assert record == {"name": "Jo", "contact": {
+            "Email": "***", "phones": [{"number": "***"},
+                                       {"number": "***"}]}}
+
+
+# Test the streaming JSON transformation:
+class TestJSONStreamTransformation():
+    def test_array_output_is_masked(self):
+        stream = io.BytesIO(json.dumps(records).encode())
+        output = b"".join(json_stream_transformation(
+            stream, ["name", "email_address"]))
+        result = json.loads(output)
+        assert [r["name"] for r in result] == ["***", "***"]
+        assert [r["email_address"] for r in result] == ["***", "***"]
+        assert result[1]["notes"] == records[1]["notes"]
+
+    def test_ndjson_output_is_masked(self):
+        body = b"\n".join(json.dumps(record).encode() for record in records)
+        output = b"".join(json_stream_transformation(
+            io.BytesIO(body), ["name"], ndjson=True))
+        lines = output.decode().splitlines()
+        assert output.endswith(b"\n")
+        assert [json.loads(line)["name"] for line in lines] == ["***"] * 2
+
+    def test_output_is_yielded_in_batches(self):
+        stream = io.BytesIO(json.dumps(records * 50).encode())
+        chunks = list(json_stream_transformation(stream, ["name"],
+                                                 batch_size=100,
+                                                 record_batch_size=10))
+        assert len(chunks) > 1
+        assert len(json.loads(b"".join(chunks))) == 100
+
+    def test_handler_streams_json(self):
+        stream = io.BytesIO(json.dumps(records).encode())
+        output = b"".join(stream_transformation_handler(
+            stream, ["name"], file_format="json"))
+        assert [r["name"] for r in json.loads(output)] == ["***", "***"]
+
+    def test_nested_fields_are_masked_in_stream(self):
+        stream = io.BytesIO(json.dumps(records).encode())
+        output = b"".join(json_stream_transformation(
+            stream, ["*.text", "re:.*_address"]))
+        result = json.loads(output)
+        assert result[1]["notes"] == {"text": "***"}
+        assert [r["email_address"] for r in result] == ["***", "***"]
+        assert [r["name"] for r in result] == ["Zoë Smith", "John Smith"]
+
+
+# Test errors are logged:
+class TestJSONStreamErrors():
+    def setup_method(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+
+    def test_blank_file(self):
+        assert list(stream_transformation_handler(
+            io.BytesIO(b""), ["name"], file_format="json")) == []
+        assert "Input file is blank." in read_log()
+
+    def test_no_content(self):
+        assert list(stream_transformation_handler(
+            io.BytesIO(b"[]"), ["name"], file_format="json")) == []
+        assert "Input data file has no content." in read_log()
+
+    def test_pii_field_not_found(self):
+        list(stream_transformation_handler(
+            io.BytesIO(json.dumps(records).encode()), ["address"],
+            file_format="json"))
+        assert 'PII field "address" not found in file.' in read_log()
+
+    def test_invalid_json(self):
+        assert list(stream_transformation_handler(
+            io.BytesIO(b'{"name": '), ["name"],
+            file_format="ndjson")) == []
+        assert "Input file is not valid JSON." in read_log()
@@ -0,0 +1,41 @@
+from src.lazy_imports import LazyModule, lazy_import
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Modules loaded by running code in a new interpreter:
+def get_loaded_modules(code, modules):
+    output = subprocess.run(
+        [sys.executable, '-c', code +
+         f'\nimport sys\nprint(__import__("json").dumps('
+         f'[name for name in {modules!r} if name in sys.modules]))'],
+        cwd=ROOT, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=ROOT)).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+# Test modules are imported on first use:
+class TestLazyImport():
+    def test_imported_module_is_returned(self):
+        assert lazy_import('json') is json
+
+    def test_module_is_loaded_on_attribute_access(self):
+        sys.modules.pop('colorsys', None)
+        module = lazy_import('colorsys')
+        assert isinstance(module, LazyModule)
+        assert 'colorsys' not in sys.modules
+        assert module.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+        assert 'colorsys' in sys.modules
+
+    def test_main_does_not_import_heavy_modules(self):
+        assert get_loaded_modules(
+            'import main', ['pandas', 'pyarrow', 'numpy', 'boto3']) == []
+
+    def test_csv_does_not_load_pandas_or_pyarrow(self):
+        code = ('from src.transformer import transform_data\n'
+                'transform_data("name,course\\nJo,Data\\n", ["name"])')
+        assert get_loaded_modules(code, ['pandas', 'pyarrow']) == []
@@ -0,0 +1,84 @@
+from src.loader import (MultipartUploader,
+                        upload_handler,
+                        iter_output_chunks,
+                        MIN_PART_SIZE)
+import json
+import os
+import pytest
+from unittest.mock import MagicMock
+
+test_bucket = "my_output_bucket"
+
+
+def get_body(client, key):
+    return client.get_object(Bucket=test_bucket, Key=key)['Body'].read()
+
+
+# Test multipart uploads against moto:
+class TestMultipartUploader():
+    def test_large_output_is_uploaded_in_parts(self, s3_client):
+        data = os.urandom(MIN_PART_SIZE * 2 + 1000)
+        uploader = MultipartUploader(s3_client, test_bucket, "out/file.csv",
+                                     part_size=MIN_PART_SIZE,
+                                     max_concurrency=2)
+        # Written in uneven chunks, like a streamed transformation:
+        for start in range(0, len(data), 1000003):
+            uploader.write(data[start:start + 1000003])
+        result = uploader.close()
+        assert result == {'parts': 3, 'bytes': len(data)}
+        assert get_body(s3_client, "out/file.csv") == data
+
+    def test_small_output_is_put_in_one_request(self, s3_client):
+        uploader = MultipartUploader(s3_client, test_bucket, "out/file.csv")
+        uploader.write(b"student_id,name\n1234,***\n")
+        result = uploader.close()
+        assert result == {'parts': 0, 'bytes': 25}
+        assert get_body(s3_client, "out/file.csv") == \
+            b"student_id,name\n1234,***\n"
+
+    def test_part_size_below_s3_minimum_is_rejected(self, s3_client):
+        with pytest.raises(ValueError):
+            MultipartUploader(s3_client, test_bucket, "out/file.csv",
+                              part_size=1024)
+
+    def test_failed_part_aborts_upload(self):
+        mock_client = MagicMock()
+        mock_client.create_multipart_upload.return_value = {'UploadId': 'x'}
+        mock_client.upload_part.side_effect = Exception('Upload failed')
+        uploader = MultipartUploader(mock_client, test_bucket, "file.csv",
+                                     part_size=MIN_PART_SIZE)
+        uploader.write(b"0" * (MIN_PART_SIZE + 1))
+        with pytest.raises(Exception):
+            uploader.close()
+        mock_client.abort_multipart_upload.assert_called_once_with(
+            Bucket=test_bucket, Key="file.csv", UploadId='x')
+        mock_client.complete_multipart_upload.assert_not_called()
+
+
+# Test upload handler accepts all transformer output types:
+class TestUploadHandler():
+    def test_streamed_chunks_are_uploaded(self, s3_client):
+        chunks = (b"student_id,name\n", b"1234,***\n", b"1235,***\n")
+        result = upload_handler(
+            chunks, f"s3://{test_bucket}/new_data/file1.csv",
+            client=s3_client)
+        assert result['bytes'] == 34
+        assert get_body(s3_client, "new_data/file1.csv") == b"".join(chunks)
+
+    def test_json_output_is_uploaded(self, s3_client):
+        records = [{"student_id": 1234, "name": "***"}]
+        upload_handler(records, f"s3://{test_bucket}/file1.json",
+                       client=s3_client)
+        assert json.loads(get_body(s3_client, "file1.json")) == records
+
+    def test_empty_output_is_not_uploaded(self, s3_client):
+        result = upload_handler(iter([]), f"s3://{test_bucket}/file1.csv",
+                                client=s3_client)
+        assert result is None
+        listing = s3_client.list_objects_v2(Bucket=test_bucket)
+        assert listing['KeyCount'] == 0
+
+    def test_iter_output_chunks(self):
+        assert list(iter_output_chunks(b"abc")) == [b"abc"]
+        assert list(iter_output_chunks([{"a": 1}])) == [b'[{"a": 1}]']
+        assert list(iter_output_chunks(iter([b"a", b"b"]))) == [b"a", b"b"]
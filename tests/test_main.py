@@ -54,6 +54,100 @@ class TestMainFunction(unittest.TestCase):
         mock_trnfrm_handler.assert_called_once_with(test_csv, test_pii_fields)
 
 
+# Test that streaming mode uses the streaming handlers:
+class TestStreamingMode(unittest.TestCase):
+    @patch.object(DataTransformer, '_stream_transformation_handler')
+    @patch.object(DataTransformer, '_DataTransformer__extraction_handler')
+    @patch.object(DataTransformer, '_DataTransformer__stream_handler')
+    def test_main_streams_when_requested(
+         self,
+         mock_stream_handler,
+         mock_extraction_handler,
+         mock_stream_trnfrm_handler):
+        test_json = """{
+            "file_to_obfuscate": "s3://my_ingestion_bucket/new_data/file1.csv",
+            "pii_fields": ["name", "email_address"],
+            "streaming": true
+            }"""
+        test_url = "s3://my_ingestion_bucket/new_data/file1.csv"
+        result = main(test_json)
+        mock_extraction_handler.assert_not_called()
+        mock_stream_handler.assert_called_once_with(test_url)
+        mock_stream_trnfrm_handler.assert_called_once_with(
+            mock_stream_handler.return_value, ["name", "email_address"])
+        assert result == mock_stream_trnfrm_handler.return_value
+
+    @patch('main.stream_transformation_handler')
+    @patch.object(DataTransformer, '_DataTransformer__extraction_handler')
+    @patch.object(DataTransformer, '_DataTransformer__stream_handler')
+    def test_main_always_streams_ndjson(
+         self,
+         mock_stream_handler,
+         mock_extraction_handler,
+         mock_stream_trnfrm_handler):
+        test_json = """{
+            "file_to_obfuscate":
+            "s3://my_ingestion_bucket/new_data/file1.ndjson",
+            "pii_fields": ["name"]
+            }"""
+        main(test_json)
+        mock_extraction_handler.assert_not_called()
+        mock_stream_trnfrm_handler.assert_called_once_with(
+            mock_stream_handler.return_value, ["name"],
+            file_format="ndjson")
+
+
+# Test that parallel mode extracts raw bytes and splits the file:
+class TestParallelMode(unittest.TestCase):
+    @patch('main.parallel_transformation_handler')
+    @patch.object(DataTransformer, '_DataTransformer__extraction_handler')
+    @patch.object(DataTransformer,
+                  '_DataTransformer__raw_extraction_handler')
+    def test_main_runs_in_parallel_when_requested(
+         self,
+         mock_raw_extraction_handler,
+         mock_extraction_handler,
+         mock_parallel_handler):
+        test_json = """{
+            "file_to_obfuscate":
+            "s3://my_ingestion_bucket/new_data/file1.ndjson",
+            "pii_fields": ["name"],
+            "parallel": true,
+            "max_workers": 4
+            }"""
+        result = main(test_json)
+        mock_extraction_handler.assert_not_called()
+        mock_parallel_handler.assert_called_once_with(
+            mock_raw_extraction_handler.return_value, ["name"], "ndjson",
+            max_workers=4)
+        assert result == mock_parallel_handler.return_value
+
+
+# Test that output is uploaded when a destination is given:
+class TestDestinationOutput(unittest.TestCase):
+    @patch.object(DataTransformer, '_upload_handler')
+    @patch.object(DataTransformer, '_transformation_handler')
+    @patch.object(DataTransformer, '_DataTransformer__extraction_handler')
+    def test_main_uploads_to_destination(
+         self,
+         mock_extraction_handler,
+         mock_trnfrm_handler,
+         mock_upload_handler):
+        test_json = """{
+            "file_to_obfuscate": "s3://my_ingestion_bucket/new_data/file1.csv",
+            "pii_fields": ["name"],
+            "destination": "s3://my_output_bucket/new_data/file1.csv"
+            }"""
+        mock_upload_handler.return_value = {'parts': 0, 'bytes': 10}
+        result = main(test_json)
+        mock_upload_handler.assert_called_once_with(
+            mock_trnfrm_handler.return_value,
+            "s3://my_output_bucket/new_data/file1.csv")
+        assert result == {'parts': 0, 'bytes': 10,
+                          'destination':
+                          "s3://my_output_bucket/new_data/file1.csv"}
+
+
 # Test basic errors are handled:
 class TestErrorHandling(unittest.TestCase):
     @patch.object(DataTransformer, 'load_json')
@@ -0,0 +1,68 @@
+from src.manifest import (Manifest,
+                          get_config_hash,
+                          load_manifest,
+                          save_manifest)
+from src.instrumentation import setup_logging
+from tests.conftest import read_log
+
+
+VERSION = {'etag': 'abc', 'size': 10}
+
+
+# Test the masking configuration is hashed:
+class TestConfigHash():
+    def test_list_and_mask_dictionary_are_the_same(self):
+        assert get_config_hash(["name"]) == get_config_hash({"name": "mask"})
+
+    def test_strategy_options_change_the_hash(self):
+        assert get_config_hash({"name": "hash"}) != \
+            get_config_hash({"name": {"strategy": "hash", "length": 8}})
+
+    def test_hmac_key_changes_the_hash(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "first")
+        first = get_config_hash({"name": "hmac"})
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "second")
+        assert get_config_hash({"name": "hmac"}) != first
+
+    def test_output_options_change_the_hash(self):
+        default = get_config_hash(["name"])
+        assert get_config_hash(["name"], compression_level=None) == default
+        assert get_config_hash(["name"], compression="gzip") != default
+        assert get_config_hash(["name"], compression="gzip",
+                               compression_level=9) != \
+            get_config_hash(["name"], compression="gzip",
+                            compression_level=1)
+        assert get_config_hash(["name"], input_format="csv") != default
+
+
+# Test entries are matched, saved and loaded:
+class TestManifest():
+    def test_entry_matches_same_version_and_config(self):
+        manifest = Manifest('manifest.json')
+        manifest.record('s3://a/b.csv', VERSION, 'config', 's3://out/b.csv')
+        assert manifest.is_unchanged('s3://a/b.csv', VERSION, 'config',
+                                     's3://out/b.csv')
+        assert not manifest.is_unchanged(
+            's3://a/b.csv', {'etag': 'new', 'size': 10}, 'config',
+            's3://out/b.csv')
+        assert not manifest.is_unchanged('s3://a/b.csv', VERSION, 'config',
+                                         's3://other/b.csv')
+        assert not manifest.is_unchanged('s3://a/b.csv', None, 'config',
+                                         's3://out/b.csv')
+
+    def test_saved_manifest_is_loaded(self, tmp_path):
+        path = str(tmp_path / "manifest.json")
+        manifest = Manifest(path)
+        manifest.record('s3://a/b.csv', VERSION, 'config', 's3://out/b.csv')
+        assert save_manifest(manifest, None) == path
+        assert load_manifest(path, None).entries == manifest.entries
+
+    def test_missing_manifest_is_empty(self, tmp_path):
+        assert load_manifest(str(tmp_path / "none.json"), None).entries == {}
+
+    def test_unreadable_manifest_gives_error(self, tmp_path):
+        setup_logging()
+        path = tmp_path / "manifest.json"
+        path.write_text("not json")
+        assert load_manifest(str(path), None).entries == {}
+        assert "could not be loaded" in read_log()
@@ -0,0 +1,135 @@
+from src.masking import (Strategy,
+                         constant_array,
+                         constant_categorical,
+                         get_constant_fields,
+                         get_strategies,
+                         mask_dataframe,
+                         register_strategy)
+from src.transformer import setup_logging
+import hashlib
+import hmac
+import pandas as pd
+import pyarrow as pa
+import numpy as np
+from tests.conftest import read_log
+
+
+# Counts the values it is given, to check each is transformed once:
+class CountingStrategy(Strategy):
+    is_constant = False
+    calls = 0
+
+    def __init__(self):
+        super().__init__(None)
+
+    def transform_value(self, value):
+        CountingStrategy.calls += 1
+        return value.upper()
+
+
+register_strategy('counting', CountingStrategy)
+
+
+# Test masking helpers build constant columns without per-row objects:
+class TestMaskingFunctions():
+    def test_constant_categorical_has_one_category(self):
+        masked = constant_categorical(5)
+        assert list(masked) == ['***'] * 5
+        assert list(masked.categories) == ['***']
+        assert masked.codes.dtype == np.int8
+
+    def test_constant_array(self):
+        masked = constant_array(3)
+        assert masked.to_pylist() == ['***'] * 3
+
+    def test_mask_dataframe_masks_pii_columns(self):
+        df = pd.DataFrame({"student_id": [1234, 1235],
+                           "name": ["John Smith", "Joe Smith"]})
+        masked = mask_dataframe(df, ["name"])
+        assert list(masked["name"]) == ['***', '***']
+        assert list(masked["student_id"]) == [1234, 1235]
+
+    def test_mask_dataframe_does_not_mutate_input(self):
+        df = pd.DataFrame({"student_id": [1234, 1235],
+                           "name": ["John Smith", "Joe Smith"]})
+        mask_dataframe(df, ["name"])
+        assert list(df["name"]) == ["John Smith", "Joe Smith"]
+
+    def test_mask_dataframe_shares_non_pii_data(self):
+        df = pd.DataFrame({"student_id": [1234, 1235],
+                           "name": ["John Smith", "Joe Smith"]})
+        masked = mask_dataframe(df, ["name"])
+        assert np.shares_memory(masked["student_id"].to_numpy(),
+                                df["student_id"].to_numpy())
+
+
+# Test strategies selected per field from the input JSON:
+class TestMaskingStrategies():
+    def setup_method(self):
+        setup_logging()
+
+    def test_list_masks_every_field(self):
+        strategies = get_strategies(["name"])
+        assert strategies["name"].apply_values(["Jo", None]) == \
+            ["***", "***"]
+
+    def test_hmac_matches_standard_library(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        strategy = get_strategies({"email_address": "hmac"})["email_address"]
+        expected = hmac.new(b"secret", b"jo@email.com",
+                            hashlib.sha256).hexdigest()
+        assert strategy.apply_values(["jo@email.com", None]) == \
+            [expected, None]
+
+    def test_hmac_long_key(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "k" * 100)
+        strategy = get_strategies({"name": "hmac"})["name"]
+        assert strategy.apply_values(["Jo"]) == [
+            hmac.new(b"k" * 100, b"Jo", hashlib.sha256).hexdigest()]
+
+    def test_hash_with_options(self):
+        strategy = get_strategies(
+            {"name": {"strategy": "hash", "length": 8}})["name"]
+        assert strategy.apply_values(["Jo", 1234]) == [
+            hashlib.sha256(b"Jo").hexdigest()[:8],
+            hashlib.sha256(b"1234").hexdigest()[:8]]
+
+    def test_email_keeps_domain(self):
+        strategy = get_strategies({"email": "email"})["email"]
+        assert strategy.apply_values(["j.smith@email.com", "none"]) == \
+            ["***@email.com", "***"]
+
+    def test_null_strategy(self):
+        strategy = get_strategies({"name": "null"})["name"]
+        assert strategy.apply_array(pa.array(["Jo", "Al"])).to_pylist() == \
+            [None, None]
+
+    def test_array_values_are_transformed_once(self):
+        CountingStrategy.calls = 0
+        strategy = get_strategies({"name": "counting"})["name"]
+        array = pa.array(["jo", "al", None, "jo"] * 1000)
+        masked = strategy.apply_array(array)
+        assert masked.to_pylist()[:4] == ["JO", "AL", None, "JO"]
+        strategy.apply_array(pa.array(["jo", "bo"]))
+        assert CountingStrategy.calls == 3
+
+    def test_mask_dataframe_with_strategy(self):
+        df = pd.DataFrame({"name": ["jo", None, "jo"], "id": [1, 2, 3]})
+        masked = mask_dataframe(df, {"name": "counting"})
+        assert list(masked["name"]) == ["JO", None, "JO"]
+
+    def test_unknown_strategy_is_logged(self):
+        assert get_strategies({"name": "scramble"}) is None
+        assert 'Masking strategy "scramble" for PII field "name" not ' \
+            'recognised.' in read_log()
+
+    def test_hmac_without_key_is_logged(self, monkeypatch):
+        monkeypatch.delenv("OBFUSCATOR_HMAC_KEY", raising=False)
+        assert get_strategies({"name": "hmac"}) is None
+        assert "HMAC key not set in OBFUSCATOR_HMAC_KEY." in read_log()
+
+    def test_constant_fields(self):
+        assert get_constant_fields(["name"]) == ["name"]
+        assert get_constant_fields({"name": "mask", "email": "hmac",
+                                    "notes": {"strategy": "null"}}) == \
+            ["name", "notes"]
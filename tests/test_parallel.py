@@ -0,0 +1,114 @@
+from src.parallel import (find_partitions,
+                          parallel_transformation,
+                          run_partitions)
+from src.csv_engine import csv_transformation
+from src.parquet_engine import parquet_transformation
+import io
+import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from unittest.mock import patch
+from tests.conftest import read_log
+
+test_csv = b"student_id,name,notes\n" + b"".join(
+    b'%04d,"Smith, %d","line one\nline ""two"""\n' % (n, n) if n % 3 == 0
+    else b"%04d,Jo %d,ok\n" % (n, n)
+    for n in range(200))
+
+
+# Test inputs are split at record boundaries:
+class TestPartitions():
+    def test_csv_partitions_end_outside_quotes(self):
+        header_end = test_csv.index(b"\n") + 1
+        partitions = find_partitions(test_csv, header_end, 100)
+        assert len(partitions) > 10
+        assert partitions[0][0] == header_end
+        assert partitions[-1][1] == len(test_csv)
+        for start, end in partitions:
+            assert test_csv[start:end].count(b'"') % 2 == 0
+            assert test_csv[end - 1:end] == b"\n"
+
+    def test_ndjson_partitions_end_at_line_ends(self):
+        data = b"".join(b'{"n": %d}\n' % n for n in range(100))
+        partitions = find_partitions(data, 0, 64, quoted=False)
+        assert len(partitions) > 1
+        assert b"".join(data[start:end] for start, end in partitions) == data
+        for start, end in partitions:
+            assert end - start >= 64 or end == len(data)
+            assert data[end - 1:end] == b"\n"
+
+
+# Test partitions masked in a process pool are put back together in order:
+class TestParallelTransformation():
+    def test_csv_matches_serial_output(self):
+        output = b"".join(parallel_transformation(
+            test_csv, ["name", "notes"], "csv", max_workers=2,
+            partition_size=256))
+        assert output == csv_transformation(test_csv, ["name", "notes"])
+
+    def test_csv_from_memoryview(self):
+        output = b"".join(parallel_transformation(
+            memoryview(test_csv), ["name"], "csv", max_workers=1,
+            partition_size=256))
+        assert output == csv_transformation(test_csv, ["name"])
+
+    def test_ndjson_is_masked_in_order(self):
+        data = b"".join(b'{"n": %d, "name": "Jo"}\n' % n for n in range(100))
+        output = b"".join(parallel_transformation(
+            data, ["name"], "ndjson", max_workers=2, partition_size=200))
+        records = [json.loads(line) for line in output.splitlines()]
+        assert [record["n"] for record in records] == list(range(100))
+        assert {record["name"] for record in records} == {"***"}
+
+    def test_parquet_matches_serial_output(self):
+        table = pa.table({"student_id": list(range(1000)),
+                          "name": [f"student {n}" for n in range(1000)]})
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, row_group_size=100)
+        data = buffer.getvalue()
+        output = parallel_transformation(data, ["name"], "parquet",
+                                         max_workers=2, partition_size=1)
+        result = pq.read_table(io.BytesIO(output))
+        assert result.equals(pq.read_table(io.BytesIO(
+            parquet_transformation(data, ["name"]))))
+        assert pq.ParquetFile(io.BytesIO(output)).num_row_groups == 10
+
+    def test_parquet_hmac_is_masked_in_the_pool(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        table = pa.table({"student_id": list(range(1000)),
+                          "name": [f"student {n}" for n in range(1000)]})
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, row_group_size=100)
+        data = buffer.getvalue()
+        with patch("src.parallel.copy_parquet_columns") as copy, \
+                patch("src.parallel.run_partitions",
+                      wraps=run_partitions) as run:
+            output = parallel_transformation(data, {"name": "hmac"},
+                                             "parquet", max_workers=2,
+                                             partition_size=1)
+        copy.assert_not_called()
+        assert len(run.call_args.args[2]) == 10
+        assert run.call_args.args[3] == 2
+        assert pq.read_table(io.BytesIO(output)).equals(pq.read_table(
+            io.BytesIO(parquet_transformation(data, {"name": "hmac"}))))
+
+
+# Test errors are logged once:
+class TestParallelErrors():
+    def setup_method(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+
+    def test_csv_with_no_rows(self):
+        from src.transformer import parallel_transformation_handler
+        output = parallel_transformation_handler(b"id,name\n", ["name"],
+                                                 "csv")
+        assert list(output) == []
+        assert "Input data file has no content." in read_log()
+
+    def test_missing_pii_field_is_logged_once(self):
+        from src.transformer import parallel_transformation_handler
+        list(parallel_transformation_handler(
+            test_csv, ["address"], "csv", max_workers=2))
+        assert read_log().count('PII field "address" not found') == 1
@@ -0,0 +1,138 @@
+from src.parquet_copy import copy_parquet_columns, get_chunk_range
+from src.parquet_engine import (get_column_compression,
+                                get_masked_schema,
+                                get_parquet_file,
+                                mask_row_group,
+                                parquet_transformation,
+                                write_row_groups)
+from src.masking import get_strategies
+from src.parquet_footer import (FooterError,
+                                read_footer,
+                                write_footer)
+from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+
+def make_parquet(table, **kwargs):
+    buffer = BytesIO()
+    pq.write_table(table, buffer, **kwargs)
+    return buffer.getvalue()
+
+
+def get_footer(data):
+    return read_footer(lambda start, end: data[start:end], len(data))
+
+
+# Output of the decoding path, to compare against:
+def decode_transformation(data, pii_fields):
+    parquet_file = get_parquet_file(data)
+    pii_columns = get_strategies(pii_fields)
+    masked_schema = get_masked_schema(parquet_file.schema_arrow, pii_columns)
+    tables = (mask_row_group(parquet_file, index, masked_schema, pii_columns)
+              for index in range(parquet_file.metadata.num_row_groups))
+    return write_row_groups(tables, masked_schema, parquet_file.metadata)
+
+
+# Bytes of each column chunk, by column name:
+def get_chunks(data):
+    metadata = pq.ParquetFile(BytesIO(data)).metadata
+    chunks = {}
+    for i in range(metadata.num_row_groups):
+        for j in range(metadata.num_columns):
+            column = metadata.row_group(i).column(j)
+            start = column.data_page_offset
+            if column.has_dictionary_page and \
+                    column.dictionary_page_offset < start:
+                start = column.dictionary_page_offset
+            chunks.setdefault(column.path_in_schema, []).append(
+                data[start:start + column.total_compressed_size])
+    return chunks
+
+
+test_table = pa.table({
+    "student_id": list(range(1000)),
+    "name": [f"student {n}" for n in range(1000)],
+    "address": pa.array([{"street": f"{n} Road", "city": "Leeds"}
+                         for n in range(1000)]),
+    "scores": [[n, n + 1] for n in range(1000)],
+    "email_address": [f"s{n}@email.com" if n % 7 else None
+                      for n in range(1000)],
+    "grade": [n / 3 for n in range(1000)],
+})
+
+
+# Test the footer reads and writes back unchanged:
+class TestParquetFooter():
+    def test_footer_round_trip(self):
+        data = make_parquet(test_table, row_group_size=300,
+                            write_page_index=True)
+        footer, start = get_footer(data)
+        assert write_footer(footer) == data[start:]
+
+    def test_not_parquet_is_rejected(self):
+        with pytest.raises(FooterError):
+            get_footer(b"student_id,name\n1,Jo\n")
+
+
+# Test non-PII chunks are copied without being decoded:
+class TestParquetCopy():
+    @pytest.mark.parametrize("options", [
+        {},
+        {"write_page_index": True},
+        {"compression": "zstd", "version": "1.0"},
+        {"compression": "gzip", "use_dictionary": False,
+         "data_page_version": "2.0"},
+        {"compression": "none", "write_statistics": False},
+    ])
+    def test_output_matches_decoding(self, options):
+        data = make_parquet(test_table, row_group_size=300, **options)
+        pii_fields = ["name", "address", "email_address"]
+        output = pq.read_table(BytesIO(parquet_transformation(
+            data, pii_fields)))
+        expected = pq.read_table(BytesIO(decode_transformation(
+            data, pii_fields)))
+        assert output.equals(expected)
+        assert output.schema.equals(expected.schema, check_metadata=True)
+
+    def test_non_pii_chunks_are_byte_identical(self):
+        data = make_parquet(test_table, row_group_size=300,
+                            compression="zstd")
+        output = bytes(parquet_transformation(data, ["name"]))
+        source_chunks = get_chunks(data)
+        output_chunks = get_chunks(output)
+        for path in ("student_id", "address.street", "scores.list.element",
+                     "grade"):
+            assert output_chunks[path] == source_chunks[path]
+        assert output_chunks["name"] != source_chunks["name"]
+
+    def test_copies_from_seekable_file(self):
+        data = make_parquet(test_table, row_group_size=300)
+        parquet_file = get_parquet_file(data)
+        pii_columns = get_strategies(["name"])
+        masked_schema = get_masked_schema(parquet_file.schema_arrow,
+                                          pii_columns)
+        output = copy_parquet_columns(
+            BytesIO(data), parquet_file, pii_columns, masked_schema,
+            get_column_compression(parquet_file.metadata))
+        result = pq.read_table(BytesIO(output))
+        assert result.column("name").to_pylist() == ["***"] * 1000
+        assert result.column("grade").equals(test_table.column("grade"))
+
+    def test_chunk_range_starts_at_dictionary_page(self):
+        assert get_chunk_range([[9, 6, 120], [7, 6, 80], [11, 6, 4]]) == \
+            (4, 84)
+        assert get_chunk_range([[9, 6, 4], [7, 6, 80]]) == (4, 84)
+
+    def test_uncopyable_file_is_decoded(self):
+        data = make_parquet(test_table.slice(0, 10), row_group_size=5)
+        footer, start = get_footer(data)
+        # Column chunks held in another file cannot be copied:
+        row_group = [item for item in footer if item[0] == 4][0][2][1][0]
+        chunk = [item for item in row_group if item[0] == 1][0][2][1][0]
+        chunk.append([1, 8, b"other.parquet"])
+        data = data[:start] + write_footer(footer)
+        output = parquet_transformation(data, ["name"])
+        result = pq.read_table(BytesIO(output))
+        assert result.column("name").to_pylist() == ["***"] * 10
@@ -0,0 +1,123 @@
+from src.parquet_engine import (get_masked_schema,
+                                get_parquet_file,
+                                get_pii_columns,
+                                iter_masked_row_groups,
+                                parquet_transformation,
+                                write_row_groups)
+from src.transformer import setup_logging
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from io import BytesIO
+
+
+def make_parquet(table, **kwargs):
+    buffer = BytesIO()
+    pq.write_table(table, buffer, **kwargs)
+    return buffer.getvalue()
+
+
+test_table = pa.table({
+    "student_id": [1234, 1235, 1236, 1237],
+    "name": ["John Smith", "Joe Smith", "Jo Smith", "Jay Smith"],
+    "course": ["Software", "Data", "Data", "Cloud"],
+    "email_address": ["j@email.com", "jo@email.com", None, "jay@email.com"]
+})
+
+
+# Test parquet engine masks PII columns and passes others through:
+class TestParquetEngine():
+    def test_pii_columns_are_masked(self):
+        output = parquet_transformation(make_parquet(test_table),
+                                        ["name", "email_address"])
+        result = pq.read_table(BytesIO(output))
+        assert result.column("name").to_pylist() == ["***"] * 4
+        assert result.column("email_address").to_pylist() == ["***"] * 4
+        assert result.column("student_id").equals(
+            test_table.column("student_id"))
+        assert result.column("course").equals(test_table.column("course"))
+
+    def test_non_string_pii_column_becomes_string(self):
+        output = parquet_transformation(make_parquet(test_table),
+                                        ["student_id"])
+        result = pq.read_table(BytesIO(output))
+        assert result.schema.field("student_id").type == pa.string()
+        assert result.schema.names == test_table.schema.names
+
+    def test_row_groups_and_compression_are_kept(self):
+        data = make_parquet(test_table, row_group_size=3,
+                            compression="gzip")
+        output = parquet_transformation(data, ["name"])
+        metadata = pq.ParquetFile(BytesIO(output)).metadata
+        assert metadata.num_row_groups == 2
+        assert metadata.row_group(0).num_rows == 3
+        assert metadata.row_group(1).num_rows == 1
+        for i in range(metadata.num_columns):
+            assert metadata.row_group(0).column(i).compression == "GZIP"
+
+    def test_pandas_written_parquet_reads_back_with_pandas(self):
+        buffer = BytesIO()
+        test_table.to_pandas().to_parquet(buffer, index=False)
+        output = parquet_transformation(buffer.getvalue(), ["student_id"])
+        df = pd.read_parquet(BytesIO(output))
+        assert list(df["student_id"]) == ["***"] * 4
+        assert list(df["course"]) == ["Software", "Data", "Data", "Cloud"]
+
+
+nested_table = pa.table({
+    "student_id": [1234, 1235, 1236],
+    "contact": pa.array([
+        {"email": "j@email.com", "address": {"city": "Leeds", "zip": "LS1"}},
+        None,
+        {"email": None, "address": {"city": "York", "zip": "YO1"}}]),
+})
+
+
+# Test PII fields inside structs are masked in place:
+class TestParquetNestedFields():
+    def test_struct_fields_are_masked(self):
+        output = parquet_transformation(make_parquet(nested_table),
+                                        ["contact.email", "*.zip"])
+        result = pq.read_table(BytesIO(output)).to_pylist()
+        assert result[0]["contact"] == {
+            "email": "***", "address": {"city": "Leeds", "zip": "***"}}
+        assert result[1]["contact"] is None
+        assert result[2]["contact"]["address"]["city"] == "York"
+
+    def test_struct_fields_are_masked_when_decoded(self):
+        parquet_file = get_parquet_file(make_parquet(nested_table,
+                                                     row_group_size=2))
+        pii_columns = get_pii_columns(parquet_file, ["i:CONTACT.Email"])
+        masked_schema = get_masked_schema(parquet_file.schema_arrow,
+                                          pii_columns)
+        output = write_row_groups(
+            iter_masked_row_groups(parquet_file, masked_schema, pii_columns),
+            masked_schema, parquet_file.metadata)
+        result = pq.read_table(BytesIO(output)).to_pylist()
+        assert [row["contact"] and row["contact"]["email"]
+                for row in result] == ["***", None, "***"]
+        assert result[2]["contact"]["address"]["zip"] == "YO1"
+
+
+# Test that error handling works as intended:
+class TestParquetEngineErrorHandling():
+    def test_pii_field_not_found_error(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        setup_logging()
+        parquet_transformation(make_parquet(test_table), ["location"])
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert 'PII field "location" not found in file.' in log_contents
+
+    def test_file_has_no_rows(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        setup_logging()
+        output = parquet_transformation(
+            make_parquet(test_table.slice(0, 0)), ["name"])
+        assert output is None
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert 'Input data file has no content.' in log_contents
@@ -0,0 +1,168 @@
+from src.range_reader import (get_object_bytes,
+                              get_parquet_source,
+                              get_column_chunk_ranges,
+                              split_range,
+                              ObjectChangedError,
+                              S3RangeFile)
+from src.parquet_engine import parquet_transformation
+import gzip
+import io
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from unittest.mock import patch
+
+test_bucket = "my_ingestion_bucket"
+
+
+# Passes calls through to the S3 client, recording the ranges requested:
+class RecordingClient:
+    def __init__(self, client):
+        self.client = client
+        self.ranges = []
+
+    def get_object(self, **kwargs):
+        self.ranges.append(kwargs.get('Range'))
+        return self.client.get_object(**kwargs)
+
+
+# Replaces the object with body after the first request, as a writer
+# overwriting it mid-download would:
+class ReplacingClient(RecordingClient):
+    def __init__(self, client, body):
+        super().__init__(client)
+        self.body = body
+        self.if_match = []
+
+    def get_object(self, **kwargs):
+        response = super().get_object(**kwargs)
+        self.if_match.append(kwargs.get('IfMatch'))
+        if len(self.ranges) == 1:
+            self.client.put_object(Bucket=kwargs['Bucket'],
+                                   Key=kwargs['Key'], Body=self.body)
+        return response
+
+
+def make_parquet(rows):
+    table = pa.table({
+        "student_id": list(range(rows)),
+        "name": [f"student number {i} " * 20 for i in range(rows)],
+        "course": ["Software", "Data"] * (rows // 2),
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=rows // 4,
+                   compression="none")
+    return buffer.getvalue()
+
+
+# Test whole objects are downloaded in concurrent ranges:
+class TestGetObjectBytes():
+    def test_small_object_takes_one_request(self, s3_client):
+        s3_client.put_object(Bucket=test_bucket, Key="file1.csv",
+                             Body=b"student_id,name\n1234,Jo\n")
+        client = RecordingClient(s3_client)
+        data = get_object_bytes(client, test_bucket, "file1.csv")
+        assert data == b"student_id,name\n1234,Jo\n"
+        assert len(client.ranges) == 1
+
+    def test_large_object_is_read_in_ranges(self, s3_client):
+        body = os.urandom(3 * 1024 * 1024 + 11)
+        s3_client.put_object(Bucket=test_bucket, Key="file1.csv", Body=body)
+        client = RecordingClient(s3_client)
+        data = get_object_bytes(client, test_bucket, "file1.csv",
+                                range_size=1024 * 1024)
+        assert data == body
+        assert client.ranges == [
+            "bytes=0-1048575", "bytes=1048576-2097151",
+            "bytes=2097152-3145727", "bytes=3145728-3145738"]
+
+    def test_large_object_spills_to_disk(self, s3_client):
+        body = os.urandom(3 * 1024 * 1024)
+        s3_client.put_object(Bucket=test_bucket, Key="file1.pqt", Body=body)
+        with patch.dict(os.environ,
+                        {"OBFUSCATOR_SPILL_THRESHOLD": str(1024 * 1024)}):
+            data = get_object_bytes(s3_client, test_bucket, "file1.pqt",
+                                    range_size=1024 * 1024)
+        assert type(data) is memoryview
+        assert data == body
+
+    def test_encoded_object_is_decompressed(self, s3_client):
+        body = os.urandom(1024 * 1024).hex().encode()
+        s3_client.put_object(Bucket=test_bucket, Key="file1.csv",
+                             Body=gzip.compress(body),
+                             ContentEncoding="gzip")
+        data = get_object_bytes(s3_client, test_bucket, "file1.csv",
+                                range_size=256 * 1024)
+        assert data == body
+
+    def test_replaced_object_is_not_spliced(self, s3_client):
+        body = os.urandom(3 * 1024 * 1024)
+        s3_client.put_object(Bucket=test_bucket, Key="file1.csv", Body=body)
+        client = ReplacingClient(s3_client, os.urandom(len(body)))
+        with pytest.raises(ObjectChangedError, match="replaced"):
+            get_object_bytes(client, test_bucket, "file1.csv",
+                             range_size=1024 * 1024)
+        etag = s3_client.head_object(Bucket=test_bucket, Key="file1.csv")
+        assert client.if_match[0] is None
+        assert etag['ETag'] not in client.if_match[1:]
+        assert all(client.if_match[1:])
+
+    def test_empty_object(self, s3_client):
+        s3_client.put_object(Bucket=test_bucket, Key="file1.csv", Body=b"")
+        assert get_object_bytes(s3_client, test_bucket, "file1.csv") == b""
+
+    def test_split_range(self):
+        assert split_range(10, 35, 10) == [(10, 20), (20, 30), (30, 35)]
+
+
+# Test parquet sources only download the columns that are kept:
+class TestParquetSource():
+    def test_pii_column_chunks_are_not_downloaded(self, s3_client):
+        data = make_parquet(4000)
+        s3_client.put_object(Bucket=test_bucket, Key="file1.parquet",
+                             Body=data)
+        client = RecordingClient(s3_client)
+        source = get_parquet_source(client, test_bucket, "file1.parquet",
+                                    ["name"])
+        output = parquet_transformation(source, ["name"])
+        result = pq.read_table(io.BytesIO(output))
+        expected = pq.read_table(io.BytesIO(data))
+        assert result.column("name").to_pylist() == ["***"] * 4000
+        assert result.column("course").equals(expected.column("course"))
+        # The name column is most of the file, and is never requested:
+        downloaded = 0
+        for byte_range in client.ranges:
+            if byte_range.startswith("bytes=-"):
+                downloaded += int(byte_range[len("bytes=-"):])
+            else:
+                start, end = byte_range[len("bytes="):].split("-")
+                downloaded += int(end) - int(start) + 1
+        assert downloaded < len(data) / 4
+
+    def test_replaced_parquet_is_not_spliced(self, s3_client):
+        data = make_parquet(4000)
+        s3_client.put_object(Bucket=test_bucket, Key="file1.parquet",
+                             Body=data)
+        client = ReplacingClient(s3_client, make_parquet(4000)[::-1])
+        with pytest.raises(ObjectChangedError):
+            get_parquet_source(client, test_bucket, "file1.parquet",
+                               ["name"])
+
+    def test_column_chunk_ranges_skip_columns(self):
+        metadata = pq.read_metadata(io.BytesIO(make_parquet(4000)))
+        all_ranges = get_column_chunk_ranges(metadata, set())
+        kept_ranges = get_column_chunk_ranges(metadata, {"name"})
+        assert sum(end - start for start, end in kept_ranges) < \
+            sum(end - start for start, end in all_ranges)
+
+    def test_range_file_reads_fetch_missing_bytes(self, s3_client):
+        s3_client.put_object(Bucket=test_bucket, Key="file1.pqt",
+                             Body=b"0123456789")
+        source = S3RangeFile(s3_client, test_bucket, "file1.pqt", 10)
+        source.add_range(2, b"234")
+        source.seek(2)
+        assert source.read(3) == b"234"
+        assert source.read() == b"56789"
+        source.seek(-2, io.SEEK_END)
+        assert source.read() == b"89"
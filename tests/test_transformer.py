@@ -1,4 +1,5 @@
-from src.transformer import transformation_handler
+from src.transformer import (transformation_handler,
+                             stream_transformation_handler)
 import os
 import pandas as pd
 from io import BytesIO, StringIO
@@ -92,6 +93,41 @@ email_address\n\
         }]
         assert actual == test_result_json
 
+    def test_json_fields_keep_their_types(self):
+        test_json = [{"student_id": 1234, "name": "Jo", "score": 1.0},
+                     {"student_id": 1235, "name": "Al", "notes": None}]
+        actual = transformation_handler(test_json, ["name"])
+        assert actual == [{"student_id": 1234, "name": "***", "score": 1.0},
+                          {"student_id": 1235, "name": "***", "notes": None}]
+        assert type(actual[0]["score"]) is float
+        assert "notes" not in actual[0]
+
+    def test_json_with_strategies(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        test_json = [{"student_id": 1234, "email_address": "jo@email.com"},
+                     {"student_id": 1235, "email_address": "jo@email.com"}]
+        actual = transformation_handler(
+            test_json, {"student_id": "hmac", "email_address": "email"})
+        assert actual[0]["email_address"] == "***@email.com"
+        assert actual[0]["student_id"] != actual[1]["student_id"]
+        assert len(actual[0]["student_id"]) == 64
+
+    def test_parquet_with_strategies(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        df_original = pd.DataFrame({"student_id": [1234, 1235, 1234],
+                                    "name": ["Jo", "Al", "Jo"],
+                                    "course": ["Data"] * 3})
+        buffer_original = BytesIO()
+        df_original.to_parquet(buffer_original, index=False)
+        transformed_data = transformation_handler(
+            buffer_original.getvalue(), {"student_id": "hmac",
+                                         "name": "null"})
+        df_transformed = pd.read_parquet(BytesIO(transformed_data))
+        ids = list(df_transformed["student_id"])
+        assert ids[0] == ids[2] != ids[1]
+        assert list(df_transformed["name"]) == [None] * 3
+        assert list(df_transformed["course"]) == ["Data"] * 3
+
     def test_transformer_works_with_parquet(self):
         df_original = pd.read_csv(StringIO(test_csv))
         buffer_original = BytesIO()
@@ -202,3 +238,51 @@ email_address"""
             log_contents = log_file.read()
         log_message = 'No PII fields given.'
         assert log_message in log_contents
+
+
+# Test streaming transformer works chunk by chunk:
+class TestStreamTransformer():
+    def test_stream_yields_masked_chunks(self):
+        test_csv = """student_id,name,course,cohort,graduation_date,\
+email_address
+1234,'John Smith','Software','August','2024-03-31','j.smith@email.com'
+1235,'Joe Smith','Data','November','2024-03-31','j.smith@email.com'
+1236,'Jo Smith','Data','November','2024-03-31','j.smith@email.com'
+"""
+        test_pii_fields = ["name", "email_address"]
+        chunks = list(stream_transformation_handler(
+            BytesIO(test_csv.encode('utf-8')), test_pii_fields,
+            chunk_size=64))
+        assert len(chunks) > 1
+        assert b''.join(chunks) == b"""student_id,name,course,cohort,\
+graduation_date,email_address
+1234,***,'Software','August','2024-03-31',***
+1235,***,'Data','November','2024-03-31',***
+1236,***,'Data','November','2024-03-31',***
+"""
+
+    def test_stream_keeps_values_unchanged(self):
+        test_csv = b"student_id,name,score\n0012,'Jo',1.50\n"
+        output = b''.join(stream_transformation_handler(
+            BytesIO(test_csv), ["name"]))
+        assert output == b"student_id,name,score\n0012,***,1.50\n"
+
+    def test_stream_blank_file(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        output = list(stream_transformation_handler(BytesIO(b''),
+                                                    ["name"]))
+        assert output == []
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert 'Input file is blank.' in log_contents
+
+    def test_stream_file_has_no_content(self):
+        if os.path.exists('log.txt'):
+            os.remove('log.txt')
+        output = list(stream_transformation_handler(
+            BytesIO(b'student_id,name\n'), ["name"]))
+        assert output == []
+        with open('log.txt', 'r') as log_file:
+            log_contents = log_file.read()
+        assert 'Input data file has no content.' in log_contents
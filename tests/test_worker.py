@@ -0,0 +1,204 @@
+from src.worker import (MessageError,
+                        ObfuscationWorker,
+                        parse_message,
+                        worker_handler)
+import json
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from tests.conftest import read_log
+
+test_csv = b"""student_id,name,course,email_address
+1234,'John Smith','Software','j.smith@email.com'
+"""
+
+
+def s3_event(bucket, key):
+    return json.dumps({'Records': [{
+        'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+        's3': {'bucket': {'name': bucket}, 'object': {'key': key}}}]})
+
+
+# Mocked S3 and SQS of conftest, with a source file:
+@pytest.fixture
+def clients(s3_client, sqs_queue):
+    s3_client.put_object(Bucket="my_ingestion_bucket",
+                         Key="new_data/file 1.csv", Body=test_csv)
+    return (s3_client, *sqs_queue)
+
+
+def get_worker(clients, **options):
+    s3, sqs, queue_url = clients
+    return ObfuscationWorker(
+        queue_url, pii_fields=["name", "email_address"],
+        destination="s3://my_output_bucket/out", wait_time=0,
+        client=s3, queue_client=sqs, **options)
+
+
+def count_messages(sqs, queue_url):
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=[
+            'ApproximateNumberOfMessages',
+            'ApproximateNumberOfMessagesNotVisible'])['Attributes']
+    return sum(int(value) for value in attributes.values())
+
+
+# Test messages are read as requests:
+class TestParseMessage():
+    def test_request_is_passed_through(self):
+        request = {"file_to_obfuscate": "s3://bucket/file.csv",
+                   "pii_fields": ["name"],
+                   "destination": "s3://out/file.csv"}
+        assert parse_message(json.dumps(request)) == [request]
+
+    def test_s3_event_key_is_decoded(self):
+        requests = parse_message(
+            s3_event("bucket", "new_data/file+1.csv"), ["name"],
+            "s3://out/masked")
+        assert requests == [{
+            "file_to_obfuscate": "s3://bucket/new_data/file 1.csv",
+            "pii_fields": ["name"],
+            "destination": "s3://out/masked/new_data/file 1.csv"}]
+
+    def test_sns_notification_is_unwrapped(self):
+        body = json.dumps({"Type": "Notification",
+                           "Message": s3_event("bucket", "file.json")})
+        requests = parse_message(body, ["name"], "s3://out")
+        assert requests[0]["file_to_obfuscate"] == "s3://bucket/file.json"
+
+    def test_unsupported_files_are_skipped(self):
+        assert parse_message(s3_event("bucket", "notes.txt"), ["name"],
+                             "s3://out") == []
+
+    def test_unreadable_message_raises(self):
+        with pytest.raises(MessageError):
+            parse_message("not json")
+        with pytest.raises(MessageError):
+            parse_message(json.dumps({"hello": "world"}))
+
+
+# Test the worker against moto's S3 and SQS:
+class TestObfuscationWorker():
+    def test_s3_events_are_obfuscated_and_deleted(self, clients):
+        s3, sqs, queue_url = clients
+        for _ in range(3):
+            sqs.send_message(QueueUrl=queue_url, MessageBody=s3_event(
+                "my_ingestion_bucket", "new_data/file+1.csv"))
+        worker = get_worker(clients, max_workers=2)
+        summary = worker.run(stop_when_empty=True)
+        worker.close()
+        assert summary == {'processed': 3, 'failed': 0}
+        body = s3.get_object(Bucket="my_output_bucket",
+                             Key="out/new_data/file 1.csv")['Body'].read()
+        assert b"John Smith" not in body
+        assert b"'Software'" in body
+        assert count_messages(sqs, queue_url) == 0
+
+    def test_request_messages_are_obfuscated(self, clients):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({
+            "file_to_obfuscate": "s3://my_ingestion_bucket/new_data/"
+                                 "file 1.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://my_output_bucket/masked.csv"}))
+        worker = get_worker(clients)
+        worker.run(stop_when_empty=True)
+        worker.close()
+        body = s3.get_object(Bucket="my_output_bucket",
+                             Key="masked.csv")['Body'].read()
+        assert b"John Smith" in body
+        assert b"j.smith@email.com" not in body
+
+    def test_failed_messages_are_left_on_queue(self, clients):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody=s3_event(
+            "my_ingestion_bucket", "missing.csv"))
+        worker = get_worker(clients)
+        summary = worker.run(stop_when_empty=True)
+        worker.close()
+        assert summary == {'processed': 0, 'failed': 1}
+        assert count_messages(sqs, queue_url) == 1
+
+    def test_unreadable_messages_are_deleted(self, clients):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody="not json")
+        worker = get_worker(clients)
+        worker.run(stop_when_empty=True)
+        worker.close()
+        assert count_messages(sqs, queue_url) == 0
+        assert "could not be read" in read_log()
+
+    def test_visibility_is_extended_for_messages_in_hand(self, clients):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody=s3_event(
+            "my_ingestion_bucket", "new_data/file+1.csv"))
+        calls = []
+        sqs.change_message_visibility_batch = \
+            lambda **kwargs: calls.append(kwargs) or {}
+        worker = get_worker(clients, visibility_timeout=0)
+        worker.run(stop_when_empty=True)
+        worker.close()
+        assert calls
+        assert calls[0]['Entries'][0]['VisibilityTimeout'] == 0
+
+    def test_failed_visibility_extensions_are_logged(self, clients):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody=s3_event(
+            "my_ingestion_bucket", "new_data/file+1.csv"))
+        sqs.change_message_visibility_batch = lambda **kwargs: {
+            'Failed': [{'Id': '0', 'Message': 'Receipt handle expired'}]}
+        worker = get_worker(clients, visibility_timeout=0)
+        worker.run(stop_when_empty=True)
+        worker.close()
+        assert "visibility could not be extended: Receipt handle expired" \
+            in read_log()
+
+    def test_queue_errors_do_not_stop_the_worker(self, clients,
+                                                 monkeypatch):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody=s3_event(
+            "my_ingestion_bucket", "new_data/file+1.csv"))
+        monkeypatch.setattr("src.worker.IDLE_WAIT", 0)
+        receive_message = sqs.receive_message
+        calls = []
+
+        def flaky_receive(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise ClientError({'Error': {'Code': 'ThrottlingException',
+                                             'Message': 'Rate exceeded'}},
+                                  'ReceiveMessage')
+            return receive_message(**kwargs)
+
+        def failing_delete(**kwargs):
+            raise EndpointConnectionError(endpoint_url=queue_url)
+
+        sqs.receive_message = flaky_receive
+        sqs.delete_message_batch = failing_delete
+        worker = get_worker(clients)
+        summary = worker.run(stop_when_empty=True)
+        worker.close()
+        assert summary == {'processed': 1, 'failed': 0}
+        assert len(calls) >= 2
+        # The message that could not be deleted is left to be received
+        # again:
+        assert count_messages(sqs, queue_url) == 1
+        log = read_log()
+        assert "Messages could not be received" in log
+        assert "Messages could not be deleted" in log
+
+
+# Test the worker entry point:
+class TestWorkerHandler():
+    def test_handler_runs_until_queue_is_empty(self, clients):
+        s3, sqs, queue_url = clients
+        sqs.send_message(QueueUrl=queue_url, MessageBody=s3_event(
+            "my_ingestion_bucket", "new_data/file+1.csv"))
+        summary = worker_handler(json.dumps({
+            "queue_url": queue_url, "pii_fields": ["name"],
+            "destination": "s3://my_output_bucket/out", "wait_time": 0}),
+            stop_when_empty=True)
+        assert summary == {'processed': 1, 'failed': 0}
+
+    def test_handler_without_queue_gives_error(self):
+        assert worker_handler(json.dumps({"pii_fields": ["name"]})) is None
+        assert "An unexpected error has occurred" in read_log()